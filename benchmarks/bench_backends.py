@@ -0,0 +1,381 @@
+"""
+Benchmark of the TorchScript and ONNX Runtime Python backend models on the CPU, on recorded dumps
+or a synthetic corpus.
+
+Usage:
+    python benchmarks/bench_backends.py [--backends torch,onnx] [--batch-sizes 1,10,200,5000] [--particles 50,100]
+                                        [--sv-particles 10] [--threads 1,4] [--iterations 50] [--warmup 5]
+                                        [--param key=value ...] [--json out.json] [--compare previous.json]
+                                        (--profile profile.json | [--dump-dir DIR] [--max-dumps N] <selection> [...])
+
+The TritonPythonModel classes of model_prep/torch_model.py and model_prep/onnx_model.py are
+loaded as Triton would load them, next to the model.pt / model.onnx of the latest version in
+the local model repository. A stand-in triton_python_backend_utils module provides requests,
+tensors and responses. Each execute() call gets one request. GPUs are hidden, so both
+backends run on the CPU.
+
+Rows come from the selected dumps (as in bulk_replay.py) or are drawn from a synthetic_corpus.py
+profile. They are repeated as needed to fill each batch size. Inputs without the "sv_" prefix
+have their variable-length axis cut or zero-padded to each --particles count (masks included),
+and "sv_" inputs to --sv-particles if given. Every (backend, threads) setting runs in a fresh
+process, so peak RSS is that backend's own and thread pools are set up from scratch. Thread
+counts go to torch.set_num_threads and to the ort_intra_op_threads parameter. --param sets other
+model config parameters, e.g. torch_optimize=none.
+
+Each point reports throughput, execute() latency percentiles, and the peak RSS of its process
+so far. For every batch size and particle count, the outputs of the first execute() of each
+backend are compared with the first backend's: max absolute difference and argmax agreement.
+--compare prints the throughput ratio to the matching points of an earlier --json file.
+"""
+
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import importlib.util
+import multiprocessing
+import concurrent.futures
+import numpy as np
+from google.protobuf import json_format
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model_prep"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "client"))
+from batching import get_variable_axes
+from dump_format import DumpLogIndex, load_dump
+from bulk_replay import select_dumps
+from offline_engine import MODEL_FILES, find_model_file, load_model_config
+from replay_diff import MODEL_REPOSITORY
+from synthetic_corpus import generate_requests, load_profile
+
+MODEL_PREP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model_prep")
+BACKEND_MODULES = {"torch": "torch_model.py", "onnx": "onnx_model.py"}
+
+def make_pb_utils():
+    """A stand-in for the triton_python_backend_utils module, with what the backend models use on the CPU."""
+    from tritonclient import utils as tcutils
+    pb_utils = types.ModuleType("triton_python_backend_utils")
+
+    class Tensor:
+        def __init__(self, name, array):
+            self._name = name
+            self._array = array
+
+        def name(self):
+            return self._name
+
+        def as_numpy(self):
+            return self._array
+
+    class InferenceRequest:
+        def __init__(self, inputs, request_id=""):
+            self.inputs = {tensor.name(): tensor for tensor in inputs}
+            self._request_id = request_id
+
+        def request_id(self):
+            return self._request_id
+
+    class TritonError:
+        def __init__(self, message):
+            self._message = message
+
+        def message(self):
+            return self._message
+
+    class InferenceResponse:
+        def __init__(self, output_tensors=None, error=None):
+            self._output_tensors = output_tensors or []
+            self._error = error
+
+        def output_tensors(self):
+            return self._output_tensors
+
+        def has_error(self):
+            return self._error is not None
+
+        def error(self):
+            return self._error
+
+    def get_input_tensor_by_name(request, name):
+        return request.inputs.get(name)
+
+    def get_output_config_by_name(model_config, name):
+        return next((out for out in model_config.get("output", []) if out["name"] == name), None)
+
+    def triton_string_to_numpy(triton_type):
+        return tcutils.triton_to_np_dtype(triton_type[len("TYPE_"):] if triton_type.startswith("TYPE_") else triton_type)
+
+    for obj in (Tensor, InferenceRequest, TritonError, InferenceResponse, get_input_tensor_by_name,
+                get_output_config_by_name, triton_string_to_numpy):
+        setattr(pb_utils, obj.__name__, obj)
+    return pb_utils
+
+def config_dict(model_dir, config_name=None, params=None):
+    """The model config as the JSON-decoded dict Triton passes to initialize(), with extra parameters set."""
+    config = json_format.MessageToDict(load_model_config(model_dir, config_name), preserving_proto_field_name=True)
+    for io in config.get("input", []) + config.get("output", []):
+        io["dims"] = [int(dim) for dim in io.get("dims", [])]
+    for key, value in (params or {}).items():
+        config.setdefault("parameters", {})[key] = {"string_value": value}
+    return config
+
+def resize_axis(arr, axis, length):
+    """Cut or zero-pad an array along one axis to the given length."""
+    if (arr.shape[axis] >= length):
+        return arr[(slice(None),) * axis + (slice(0, length),)]
+    pad = [(0, 0)] * arr.ndim
+    pad[axis] = (0, length - arr.shape[axis])
+    return np.pad(arr, pad)
+
+def stack_rows(requests, variable_axes):
+    """Concatenate the rows of several requests, zero-padding variable-length axes to the longest."""
+    rows = {}
+    for name in requests[0]:
+        arrays = [np.asarray(request[name]) for request in requests]
+        for axis in variable_axes.get(name, []):
+            length = max(arr.shape[axis] for arr in arrays)
+            arrays = [resize_axis(arr, axis, length) for arr in arrays]
+        rows[name] = np.concatenate(arrays)
+    return rows
+
+def make_inputs(rows, variable_axes, batch_size, particles, sv_particles):
+    """Inputs of one request: batch_size rows (repeating the pool as needed), resized to the particle counts."""
+    index = np.arange(batch_size) % next(iter(rows.values())).shape[0]
+    inputs = {}
+    for name, arr in rows.items():
+        arr = arr[index]
+        length = sv_particles if name.startswith("sv_") else particles
+        if length is not None:
+            for axis in variable_axes.get(name, []):
+                arr = resize_axis(arr, axis, length)
+        inputs[name] = np.ascontiguousarray(arr)
+    return inputs
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_backend(backend, model_path, model_config, threads, rows, points, iterations, warmup):
+    """
+    Load one backend's TritonPythonModel in this (fresh) process and time execute() on every
+    (batch size, particles, sv particles) point. Returns the per-point results and the outputs
+    of the first execute() of every point.
+    """
+    sys.modules["triton_python_backend_utils"] = make_pb_utils()
+    pb_utils = sys.modules["triton_python_backend_utils"]
+    if (backend == "torch"):
+        import torch
+        torch.set_num_threads(threads)
+    parameters = dict(model_config.get("parameters", {}), ort_intra_op_threads={"string_value": str(threads)})
+    # The model is loaded from a temporary directory, keep optimized graphs where the server would
+    for key, name in (("ort_cache_dir", "ort_cache"), ("torch_cache_dir", "torch_cache")):
+        parameters.setdefault(key, {"string_value": os.path.join(os.path.dirname(os.path.abspath(model_path)), name)})
+    model_config = dict(model_config, parameters=parameters)
+
+    # Triton loads model.py from the version directory, next to the model file it opens
+    model_dir = tempfile.mkdtemp(prefix=f"bench_{backend}_")
+    try:
+        os.symlink(os.path.abspath(os.path.join(MODEL_PREP, BACKEND_MODULES[backend])), os.path.join(model_dir, "model.py"))
+        os.symlink(os.path.abspath(model_path), os.path.join(model_dir, MODEL_FILES[backend]))
+        spec = importlib.util.spec_from_file_location(f"{backend}_backend_model", os.path.join(model_dir, "model.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+        model = module.TritonPythonModel()
+        load_start = time.perf_counter()
+        model.initialize({"model_config": json.dumps(model_config), "model_instance_name": f"{model_config['name']}_bench",
+                          "model_instance_kind": "CPU", "model_instance_device_id": "0", "model_version": "1"})
+        load_seconds = time.perf_counter() - load_start
+        rss_after_load = peak_rss_mb()
+
+        variable_axes = get_variable_axes(model_config)
+        results, outputs = [], []
+        for batch_size, particles, sv_particles in points:
+            inputs = make_inputs(rows, variable_axes, batch_size, particles, sv_particles)
+            request = pb_utils.InferenceRequest([pb_utils.Tensor(name, arr) for name, arr in inputs.items()], "bench")
+            result = {"backend": backend, "threads": threads, "batch_size": batch_size, "particles": particles,
+                      "sv_particles": sv_particles, "load_s": load_seconds, "rss_after_load_mb": rss_after_load, "error": None}
+
+            latencies = []
+            first_outputs = None
+            for iteration in range(warmup + iterations):
+                start = time.perf_counter()
+                response = model.execute([request])[0]
+                elapsed = time.perf_counter() - start
+                if response.has_error():
+                    result["error"] = response.error().message()
+                    break
+                if first_outputs is None:
+                    first_outputs = {tensor.name(): np.array(tensor.as_numpy()) for tensor in response.output_tensors()}
+                if (iteration >= warmup):
+                    latencies.append(elapsed)
+
+            if latencies:
+                latencies_ms = np.array(latencies) * 1000
+                result["throughput_rows_per_s"] = batch_size * len(latencies) / sum(latencies)
+                result["throughput_rps"] = len(latencies) / sum(latencies)
+                for p in (50, 90, 99):
+                    result[f"latency_ms_p{p}"] = float(np.percentile(latencies_ms, p))
+                result["latency_ms_mean"] = float(latencies_ms.mean())
+            result["peak_rss_mb"] = peak_rss_mb()
+            results.append(result)
+            outputs.append(first_outputs)
+
+        if hasattr(model, "finalize"):
+            model.finalize()
+        return results, outputs
+    finally:
+        shutil.rmtree(model_dir, ignore_errors=True)
+
+def compare_backends(points, outputs_by_backend):
+    """Compare every backend's outputs with the first backend's, per point."""
+    backends = list(outputs_by_backend)
+    reference = backends[0]
+    agreement = []
+    for other in backends[1:]:
+        for idx, (batch_size, particles, sv_particles) in enumerate(points):
+            ref_outputs, other_outputs = outputs_by_backend[reference][idx], outputs_by_backend[other][idx]
+            if (ref_outputs is None) or (other_outputs is None):
+                continue
+            for name, ref in ref_outputs.items():
+                out = other_outputs.get(name)
+                if (out is None) or (out.shape != ref.shape):
+                    continue
+                entry = {"reference": reference, "backend": other, "batch_size": batch_size, "particles": particles,
+                         "sv_particles": sv_particles, "output": name,
+                         "max_abs_diff": float(np.abs(out.astype(np.float64) - ref).max(initial=0.0))}
+                if (ref.ndim == 2) and (ref.shape[1] > 1):
+                    entry["argmax_agreement"] = float((out.argmax(axis=1) == ref.argmax(axis=1)).mean())
+                agreement.append(entry)
+    return agreement
+
+def _key(result):
+    return (result["backend"], result["threads"], result["batch_size"], result["particles"], result["sv_particles"])
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the TorchScript and ONNX Runtime backend models on the CPU.")
+    parser.add_argument("selection", nargs="*", help="Dumps to take rows from: glob, request ids/file names, or catalog conditions")
+    parser.add_argument("--dump-dir", default=os.path.join(os.path.dirname(__file__), "..", "replay_dumps"), help="Directory holding the dumps")
+    parser.add_argument("--max-dumps", type=int, default=200, help="Maximum number of dumps to take rows from")
+    parser.add_argument("--profile", help="Draw rows from this synthetic_corpus.py profile instead of dumps")
+    parser.add_argument("--model", default="particlenet_AK4_PT", help="Model in the local model repository")
+    parser.add_argument("--model-repository", default=MODEL_REPOSITORY, help="Local model repository")
+    parser.add_argument("--config-name", default=None, help="Use configs/<name>.pbtxt instead of config.pbtxt")
+    parser.add_argument("--backends", default="torch,onnx", help="Comma-separated backends, the first is the reference for agreement")
+    parser.add_argument("--batch-sizes", default="1,10,200,5000", help="Comma-separated rows per request")
+    parser.add_argument("--particles", default="", help="Comma-separated particle counts (default: as in the source)")
+    parser.add_argument("--sv-particles", type=int, default=None, help="Secondary vertex count for sv_* inputs (default: as in the source)")
+    parser.add_argument("--threads", default="1", help="Comma-separated intra-op thread counts")
+    parser.add_argument("--iterations", type=int, default=50, help="Measured execute() calls per point")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured execute() calls per point")
+    parser.add_argument("--param", action="append", default=[], help="Extra model config parameter key=value, may be repeated")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for --profile")
+    parser.add_argument("--json", help="Also write results to this JSON file")
+    parser.add_argument("--compare", help="Print throughput relative to the results in this earlier --json file")
+    args = parser.parse_args()
+
+    # Benchmark the CPU paths even on a machine with GPUs, in the worker processes too
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+    model_dir = os.path.join(args.model_repository, args.model)
+    params = dict(param.split("=", 1) for param in args.param)
+    model_config = config_dict(model_dir, args.config_name, params)
+    variable_axes = get_variable_axes(model_config)
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",")]
+    particle_counts = [int(p) for p in args.particles.split(",") if p] or [None]
+    thread_counts = [int(t) for t in args.threads.split(",")]
+
+    if args.profile:
+        profile = load_profile(args.profile)
+        rows = next(generate_requests(profile, 1, np.random.default_rng(args.seed), rows=max(batch_sizes)))
+        source = f"profile {args.profile}"
+    elif args.selection:
+        try:
+            locations = select_dumps(args.dump_dir, args.selection, log_index=DumpLogIndex(args.dump_dir))
+        except ValueError as e:
+            print(f"✗ {e}")
+            return 1
+        dumps = [load_dump(path, offset) for path, offset in locations[:args.max_dumps]]
+        dumps = [dump for dump in dumps if dump["model"] == args.model]
+        if not dumps:
+            print(f"✗ No dumps of {args.model} selected")
+            return 1
+        rows = stack_rows([dump["inputs"] for dump in dumps], variable_axes)
+        source = f"{len(dumps)} dumps"
+    else:
+        print("✗ Select dumps or give --profile")
+        return 1
+    print(f"✓ {next(iter(rows.values())).shape[0]} rows from {source}")
+
+    models = {}
+    for backend in args.backends.split(","):
+        try:
+            models[backend] = find_model_file(model_dir, backend)[1]
+        except (FileNotFoundError, KeyError) as e:
+            print(f"✗ Skipping {backend}: {e}")
+    if not models:
+        return 1
+
+    points = [(batch_size, particles, args.sv_particles) for batch_size in batch_sizes for particles in particle_counts]
+    results, outputs_by_backend = [], {}
+    print(f"\n{'backend':<8} {'threads':>7} {'batch':>6} {'particles':>9} {'rows/s':>11} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'peak RSS MB':>12}")
+    context = multiprocessing.get_context("spawn")
+    for backend, model_path in models.items():
+        for threads in thread_counts:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                try:
+                    backend_results, outputs = pool.submit(run_backend, backend, model_path, model_config, threads, rows, points,
+                                                           args.iterations, args.warmup).result()
+                except Exception as e:
+                    print(f"✗ {backend} with {threads} thread(s) failed: {e}")
+                    continue
+            outputs_by_backend.setdefault(backend, outputs)
+            for result in backend_results:
+                results.append(result)
+                particles = "source" if result["particles"] is None else result["particles"]
+                if result["error"] is not None:
+                    print(f"{backend:<8} {threads:>7} {result['batch_size']:>6} {particles:>9} ✗ {result['error']}")
+                    continue
+                print(f"{backend:<8} {threads:>7} {result['batch_size']:>6} {particles:>9} {result['throughput_rows_per_s']:>11.1f} "
+                      f"{result['latency_ms_p50']:>9.2f} {result['latency_ms_p90']:>9.2f} {result['latency_ms_p99']:>9.2f} {result['peak_rss_mb']:>12.0f}")
+
+    agreement = compare_backends(points, outputs_by_backend)
+    if agreement:
+        print(f"\n{'backend':<8} {'vs':<8} {'batch':>6} {'particles':>9} {'output':<12} {'max abs diff':>13} {'argmax agree':>13}")
+        for entry in agreement:
+            particles = "source" if entry["particles"] is None else entry["particles"]
+            argmax = f"{entry['argmax_agreement']:.4%}" if "argmax_agreement" in entry else "-"
+            print(f"{entry['backend']:<8} {entry['reference']:<8} {entry['batch_size']:>6} {particles:>9} {entry['output']:<12} "
+                  f"{entry['max_abs_diff']:>13.3g} {argmax:>13}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = {_key(result): result for result in json.load(f)["results"]}
+        print(f"\nThroughput relative to {args.compare}:")
+        for result in results:
+            old = previous.get(_key(result))
+            if old and old.get("throughput_rows_per_s") and result.get("throughput_rows_per_s"):
+                ratio = result["throughput_rows_per_s"] / old["throughput_rows_per_s"]
+                print(f"  {result['backend']:<8} threads {result['threads']:>3}, batch {result['batch_size']:>5}: {ratio:.2f}x")
+
+    if args.json:
+        environment = {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+                       "numpy": np.__version__}
+        for name in ("torch", "onnxruntime"):
+            try:
+                environment[name] = __import__(name).__version__
+            except ImportError:
+                pass
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "environment": environment, "source": source,
+                       "results": results, "agreement": agreement}, f, indent=2)
+        print(f"\n✓ Results written to {args.json}")
+    return 0
+
+if (__name__ == "__main__"):
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""
+Benchmark dump compression codecs on real dumps.
+
+Usage:
+    python benchmarks/bench_dump_compression.py <dump_dir> [--codecs zstd:1,zstd:3,lz4:0] [--max-dumps N] [--json out.json]
+
+Every codec is run with and without the byte-shuffle filter over the tensors of the dumps in
+<dump_dir> (standalone .dump/.pkl files and log segments), reporting compression ratio and
+compression/decompression throughput in MB/s of uncompressed data.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model_prep"))
+from dump_format import DUMP_EXTENSION, LEGACY_EXTENSION, DumpCodec, DumpLogIndex, decompress_tensor, load_dump
+
+def collect_tensors(dump_dir, max_dumps):
+    """Load the input tensors of up to max_dumps dumps into memory."""
+    locations = [(os.path.join(dump_dir, f), 0) for f in sorted(os.listdir(dump_dir))
+                 if f.endswith((DUMP_EXTENSION, LEGACY_EXTENSION)) and not f.startswith(".")]
+
+    log_index = DumpLogIndex(dump_dir)
+    log_index.refresh()
+    locations += [(seg_path, offset) for seg_path, offset, _ in log_index.entries.values()]
+
+    tensors = []
+    for path, offset in locations[:max_dumps]:
+        dump = load_dump(path, offset)
+        tensors += [np.array(arr) for arr in dump.get("inputs", {}).values() if arr.nbytes > 0]
+    return tensors
+
+def bench_codec(codec, tensors):
+    raw_nbytes = sum(arr.nbytes for arr in tensors)
+
+    start = time.perf_counter()
+    compressed = [codec.compress(arr) for arr in tensors]
+    compress_time = time.perf_counter() - start
+
+    entries = [dict(fields, dtype=arr.dtype.str) for arr, (_, fields) in zip(tensors, compressed)]
+    start = time.perf_counter()
+    for (payload, _), entry in zip(compressed, entries):
+        decompress_tensor(payload, entry)
+    decompress_time = time.perf_counter() - start
+
+    compressed_nbytes = sum(len(payload) for payload, _ in compressed)
+    return {
+        "codec": codec.name,
+        "level": codec.level,
+        "shuffle": codec.shuffle,
+        "raw_mb": raw_nbytes / 1e6,
+        "compressed_mb": compressed_nbytes / 1e6,
+        "ratio": raw_nbytes / compressed_nbytes,
+        "compress_mb_per_s": raw_nbytes / 1e6 / compress_time,
+        "decompress_mb_per_s": raw_nbytes / 1e6 / decompress_time,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dump compression codecs on real dumps.")
+    parser.add_argument("dump_dir", help="Directory of dumps to benchmark on")
+    parser.add_argument("--codecs", default="zstd:1,zstd:3,zstd:9,lz4:0,lz4:9", help="Comma-separated <codec>[:<level>] specs")
+    parser.add_argument("--max-dumps", type=int, default=100, help="Maximum number of dumps to load")
+    parser.add_argument("--json", help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    tensors = collect_tensors(args.dump_dir, args.max_dumps)
+    if not tensors:
+        print(f"✗ No dump tensors found in {args.dump_dir}")
+        return 1
+    print(f"✓ Loaded {len(tensors)} tensors ({sum(arr.nbytes for arr in tensors) / 1e6:.1f} MB)\n")
+
+    results = []
+    print(f"{'codec':<10} {'shuffle':<8} {'ratio':>7} {'compress MB/s':>14} {'decompress MB/s':>16}")
+    for spec in args.codecs.split(","):
+        for shuffle in (False, True):
+            codec = DumpCodec.from_string(spec, shuffle=shuffle)
+            result = bench_codec(codec, tensors)
+            results.append(result)
+            print(f"{spec:<10} {str(shuffle):<8} {result['ratio']:>7.2f} {result['compress_mb_per_s']:>14.1f} {result['decompress_mb_per_s']:>16.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✓ Results written to {args.json}")
+    return 0
+
+if (__name__ == "__main__"):
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""
+Microbenchmark of the tensor path through execute(): fusing the requests of a dynamic batch,
+moving inputs to the model's device, and bringing outputs back, before and after copy
+elimination.
+
+Usage:
+    python benchmarks/bench_tensor_path.py [--batch-sizes 1,200,5000] [--requests 4] [--device cpu|cuda]
+                                           [--iterations 50] [--json out.json]
+
+Each execute() call fuses --requests requests of the given batch size, with ParticleNet-shaped
+inputs and particle counts varying between requests so fusion has to pad. Three paths are compared:
+
+- before: np.pad + np.concatenate fusion, torch.from_numpy(...).to(device), and
+  .cpu().numpy().astype(dtype) on outputs, as model_prep/torch_model.py used to do
+- numpy: the current default, fusing each request once into pooled buffers and skipping the cast
+  when the dtype already matches (GPU outputs go through a pooled pinned host buffer)
+- dlpack: the tensor_transfer=dlpack mode, fusing into a pooled device buffer and handing outputs
+  back through DLPack without leaving the device
+
+The forward pass is a cheap stand-in with ParticleNet's output shape, so the numbers reflect the
+tensor path alone. Bytes copied are counted per operation, checking whether each result shares
+memory with its source. Without torch installed, only the numpy parts of the first two paths run.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+try:
+    import torch
+    import torch.utils.dlpack
+except ImportError:
+    torch = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model_prep"))
+from batching import BufferPool, fuse_inputs, split_outputs
+
+# (name, channels, uses secondary vertex count) for the ParticleNet inputs
+INPUTS = [("pf_points__0", 2, False), ("pf_features__1", 20, False), ("pf_mask__2", 1, False),
+          ("sv_points__3", 2, True), ("sv_features__4", 11, True), ("sv_mask__5", 1, True)]
+INPUT_NAMES = [name for name, _, _ in INPUTS]
+VARIABLE_AXES = {name: [2] for name in INPUT_NAMES}
+NUM_CLASSES = 8
+
+def _pointer(x):
+    return x.data_ptr() if (torch is not None and torch.is_tensor(x)) else x.__array_interface__["data"][0]
+
+def _nbytes(x):
+    return x.element_size() * x.numel() if (torch is not None and torch.is_tensor(x)) else x.nbytes
+
+class CopyCounter:
+    def __init__(self):
+        self.nbytes = 0
+
+    def count(self, result, source=None):
+        """Count result as copied unless it shares memory with source. Returns result."""
+        if (source is None) or (_pointer(result) != _pointer(source)):
+            self.nbytes += _nbytes(result)
+        return result
+
+def make_requests(rng, batch_size, num_requests):
+    requests = []
+    for _ in range(num_requests):
+        particles, vertices = int(rng.integers(50, 101)), int(rng.integers(5, 11))
+        requests.append({
+            name: rng.standard_normal((batch_size, channels, vertices if is_sv else particles)).astype(np.float32)
+            for name, channels, is_sv in INPUTS
+        })
+    return requests
+
+def legacy_fuse(request_inputs, counter):
+    """The np.pad + np.concatenate fusion that batching.fuse_inputs replaced."""
+    row_counts = [inputs[INPUT_NAMES[0]].shape[0] for inputs in request_inputs]
+    if (len(request_inputs) == 1):
+        return request_inputs[0], row_counts
+
+    fused = {}
+    for name in INPUT_NAMES:
+        arrays = [inputs[name] for inputs in request_inputs]
+        length = max(arr.shape[2] for arr in arrays)
+        padded = []
+        for arr in arrays:
+            if (arr.shape[2] < length):
+                arr = counter.count(np.pad(arr, [(0, 0), (0, 0), (0, length - arr.shape[2])], mode="constant"))
+            padded.append(arr)
+        fused[name] = counter.count(np.concatenate(padded, axis=0))
+    return fused, row_counts
+
+def pooled_fuse(request_inputs, pool, allocate, counter):
+    fused, row_counts = fuse_inputs(request_inputs, INPUT_NAMES, VARIABLE_AXES, pool, allocate)
+    if (len(request_inputs) > 1):
+        for value in fused.values():
+            counter.count(value) # every request is copied once into the fused buffer
+    return fused, row_counts
+
+def forward_numpy(inputs):
+    return inputs["pf_features__1"][:, :NUM_CLASSES, :].sum(axis=2)
+
+def forward_torch(inputs):
+    return torch.softmax(inputs[1][:, :NUM_CLASSES, :].sum(dim=2), dim=1)
+
+def run_before(requests, device, counter):
+    fused, row_counts = legacy_fuse(requests, counter)
+    if torch is None:
+        output = forward_numpy(fused)
+        return split_outputs([counter.count(output.astype(np.float32), output)], row_counts)
+
+    model_inputs = []
+    for name in INPUT_NAMES:
+        tensor = counter.count(torch.from_numpy(fused[name]), fused[name])
+        model_inputs.append(counter.count(tensor.to(device), tensor))
+    output = forward_torch(model_inputs)
+    host = counter.count(output.cpu(), output)
+    outputs = [counter.count(host.numpy().astype(np.float32), host.numpy())]
+    return split_outputs(outputs, row_counts)
+
+def run_numpy(requests, device, pool, counter):
+    fused, row_counts = pooled_fuse(requests, pool, lambda size, like: np.empty(size, dtype=like.dtype), counter)
+    if torch is None:
+        output = forward_numpy(fused)
+        return split_outputs([counter.count(output.astype(np.float32, copy=False), output)], row_counts)
+
+    model_inputs = []
+    for name in INPUT_NAMES:
+        tensor = counter.count(torch.from_numpy(fused[name]), fused[name])
+        model_inputs.append(counter.count(tensor.to(device), tensor))
+    output = forward_torch(model_inputs)
+    if (output.device.type != "cpu"):
+        host = pool.get(("output", 0), tuple(output.shape), lambda size: torch.empty(size, dtype=output.dtype, pin_memory=True))
+        output = counter.count(host.copy_(output))
+    array = output.numpy()
+    return split_outputs([counter.count(array.astype(np.float32, copy=False), array)], row_counts)
+
+def run_dlpack(requests, device, pool, counter):
+    # Triton hands inputs over through DLPack, which shares memory
+    request_tensors = [{name: torch.utils.dlpack.from_dlpack(torch.utils.dlpack.to_dlpack(torch.from_numpy(arr)))
+                        for name, arr in inputs.items()} for inputs in requests]
+    fused, row_counts = pooled_fuse(request_tensors, pool, lambda size, like: torch.empty(size, dtype=like.dtype, device=device), counter)
+    model_inputs = [counter.count(fused[name].to(device), fused[name]) for name in INPUT_NAMES]
+    output = forward_torch(model_inputs)
+    output = counter.count(output.to(torch.float32), output)
+    per_request = split_outputs([output], row_counts)
+    return [[torch.utils.dlpack.to_dlpack(out.contiguous()) for out in outs] for outs in per_request]
+
+def bench(path, requests, device, iterations, warmup):
+    pool = BufferPool()
+    counter = CopyCounter()
+    for _ in range(warmup):
+        path(requests, device, pool, CopyCounter())
+    if (device == "cuda"):
+        torch.cuda.synchronize()
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        path(requests, device, pool, counter)
+    if (device == "cuda"):
+        torch.cuda.synchronize()
+    elapsed = time.perf_counter() - start
+
+    calls = iterations * len(requests)
+    return {"mb_copied_per_request": counter.nbytes / calls / 1e6, "ms_per_request": elapsed / calls * 1000}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark copies in the execute() tensor path.")
+    parser.add_argument("--batch-sizes", default="1,200,5000", help="Comma-separated rows per request")
+    parser.add_argument("--requests", type=int, default=4, help="Requests fused per execute() call")
+    parser.add_argument("--device", default="cpu", choices=["cpu", "cuda"], help="Device the model runs on")
+    parser.add_argument("--iterations", type=int, default=50, help="Measured execute() calls per point")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured execute() calls per point")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the inputs")
+    parser.add_argument("--json", help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    if (args.device == "cuda") and (torch is None or not torch.cuda.is_available()):
+        print("✗ CUDA requested but torch with CUDA is not available")
+        return 1
+
+    paths = {"before": lambda r, d, pool, c: run_before(r, d, c), "numpy": run_numpy}
+    if torch is not None:
+        paths["dlpack"] = run_dlpack
+    else:
+        print("torch is not installed, benchmarking the numpy parts of the paths only\n")
+
+    rng = np.random.default_rng(args.seed)
+    results = []
+    print(f"{'batch':>6} {'path':<8} {'MB copied/req':>14} {'ms/req':>10} {'speedup':>8}")
+    for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+        requests = make_requests(rng, batch_size, args.requests)
+        baseline = None
+        for name, path in paths.items():
+            result = bench(path, requests, args.device, args.iterations, args.warmup)
+            baseline = baseline or result["ms_per_request"]
+            result.update(batch_size=batch_size, path=name, requests_per_execute=args.requests, device=args.device,
+                          speedup=baseline / result["ms_per_request"])
+            results.append(result)
+            print(f"{batch_size:>6} {name:<8} {result['mb_copied_per_request']:>14.3f} {result['ms_per_request']:>10.4f} {result['speedup']:>7.2f}x")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✓ Results written to {args.json}")
+    return 0
+
+if (__name__ == "__main__"):
+    sys.exit(main())
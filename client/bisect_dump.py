@@ -0,0 +1,232 @@
+"""
+Narrow a failing batched dump down to the rows that make it fail.
+
+Usage:
+    python client/bisect_dump.py [--url localhost:8001[,...]] [--balance POLICY] [--concurrency 8]
+                                 [--match TEXT] [--nonfinite] [--timeout SECONDS] [--out-dir DIR] <dump>
+    python client/bisect_dump.py --offline [--model-repository DIR] [--config-name NAME] [--backend auto|torch|onnx]
+                                 [--threads N] ... <dump>
+
+The dump's rows are split along dimension 0 and the parts are replayed concurrently, either
+against Triton or in-process on the CPU with the same model files replay_offline uses. Every
+part that still fails is split again, so a single bad row among 5000 is found in about a dozen
+rounds of requests. If the batch only fails as a whole and no part fails alone (e.g. the
+failure needs two rows together), parts are removed instead, at ever finer granularity, until
+no row can be dropped (the ddmin algorithm). The failing rows are saved as a new dump next to
+the original, with the original row indices in its "bisected_rows" field.
+
+A request counts as failed when the model raises an error, containing --match if given, or
+with --nonfinite, when an output holds a NaN or infinity. The same functions back the REPL's
+bisect_dump command.
+"""
+
+import os
+import sys
+import time
+import uuid
+import argparse
+import concurrent.futures
+import numpy as np
+from tritonclient import grpc as grpcclient
+
+import model_prep_path # puts model_prep/ on sys.path
+from dump_format import DUMP_EXTENSION, DumpLogIndex, load_dump
+from replay_dump import FileDumpStore
+from bulk_replay import build_inputs, get_model_io, resolve_dump
+from client_pool import BALANCE_POLICIES, ClientPool
+from offline_engine import LocalModel
+from replay_diff import MODEL_REPOSITORY
+
+class TritonRunner:
+    """Sends rows of a dump to a Triton server (or ClientPool), returning the outputs or raising the error."""
+
+    def __init__(self, client, model_name, timeout=None):
+        self.client = client
+        self.model_name = model_name
+        self.timeout = timeout
+        self.input_names, self.output_names = get_model_io(client.get_model_config(model_name))
+
+    def run(self, inputs):
+        outputs = [grpcclient.InferRequestedOutput(name) for name in self.output_names]
+        result = self.client.infer(self.model_name, build_inputs(inputs, self.input_names), outputs=outputs,
+                                   request_id=f"bisect-{uuid.uuid4()}", client_timeout=self.timeout)
+        return {name: result.as_numpy(name) for name in self.output_names}
+
+class LocalRunner:
+    """Runs rows of a dump through a LocalModel in this process."""
+
+    def __init__(self, model):
+        self.model = model
+
+    def run(self, inputs):
+        return self.model.infer(inputs)
+
+def take_rows(arrays, rows):
+    """Select rows (original indices, ascending) from every array of a {name: array} dict."""
+    return {name: np.ascontiguousarray(arr[rows]) for name, arr in arrays.items()}
+
+def _split(rows, n):
+    return [[int(row) for row in part] for part in np.array_split(rows, n) if len(part) > 0]
+
+class Bisector:
+    """
+    Finds the rows of a request's {input_name: array} inputs that make `runner` fail. Requests
+    of the same round go out together on `concurrency` threads, and the outcome of every row set
+    is remembered so ddmin never sends the same rows twice.
+    """
+
+    def __init__(self, runner, inputs, concurrency=8, match=None, nonfinite=False, on_round=None):
+        self.runner = runner
+        self.inputs = inputs
+        self.concurrency = concurrency
+        self.match = match
+        self.nonfinite = nonfinite
+        self.on_round = on_round
+        self.outcomes = {}
+        self.requests = 0
+        self.rounds = 0
+
+    def failure(self, rows):
+        """Return the failure message of running these rows, or None if they pass."""
+        try:
+            outputs = self.runner.run(take_rows(self.inputs, rows))
+        except Exception as e:
+            message = str(e)
+            return message if (self.match is None) or (self.match in message) else None
+        if self.nonfinite:
+            bad = [name for name, out in outputs.items() if np.issubdtype(out.dtype, np.floating) and not np.isfinite(out).all()]
+            if bad:
+                return f"Non-finite values in output(s) {', '.join(bad)}"
+        return None
+
+    def _run_round(self, row_sets):
+        """Run the row sets not tried before concurrently, returning their failure messages in order."""
+        pending = [rows for rows in {tuple(rows): rows for rows in row_sets}.values() if tuple(rows) not in self.outcomes]
+        if pending:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.concurrency, len(pending))) as pool:
+                for rows, message in zip(pending, pool.map(self.failure, pending)):
+                    self.outcomes[tuple(rows)] = message
+            self.requests += len(pending)
+            self.rounds += 1
+            if self.on_round is not None:
+                self.on_round(self.rounds, pending, [self.outcomes[tuple(rows)] for rows in pending])
+        return [self.outcomes[tuple(rows)] for rows in row_sets]
+
+    def minimize(self, rows):
+        """
+        Return a list of failing row sets within `rows` (which must fail): every part that fails
+        on its own is narrowed down separately, and a failure that needs several rows together
+        ends as one set from which no row can be removed.
+        """
+        n = 2
+        while len(rows) > 1:
+            parts = _split(rows, min(n, len(rows)))
+            failing = [part for part, message in zip(parts, self._run_round(parts)) if message is not None]
+            if failing:
+                return [found for part in failing for found in self.minimize(part)]
+
+            # No part fails alone, try dropping one part at a time
+            if (len(parts) > 2):
+                complements = [[row for row in rows if row not in dropped] for dropped in map(set, parts)]
+                failing = [comp for comp, message in zip(complements, self._run_round(complements)) if message is not None]
+                if failing:
+                    rows = failing[0]
+                    n = max(n - 1, 2)
+                    continue
+            if (n >= len(rows)):
+                break
+            n = min(2 * n, len(rows))
+        return [rows]
+
+    def bisect(self):
+        """
+        Returns (failing rows, failure message), the rows being the union of minimize()'s sets in
+        ascending order, or (None, None) if the full batch does not fail.
+        """
+        all_rows = list(range(next(iter(self.inputs.values())).shape[0]))
+        if self._run_round([all_rows])[0] is None:
+            return None, None
+        rows = sorted({row for found in self.minimize(all_rows) for row in found})
+
+        # The union of independently failing sets is checked once more, for the message of the dump
+        message = self._run_round([rows])[0]
+        if message is None:
+            rows = min(self.minimize(all_rows), key=len)
+            message = self._run_round([rows])[0]
+        return rows, message
+
+def write_bisected_dump(dump, rows, message, out_dir):
+    """Save the given rows of a dump as a new dump in out_dir, returning its path."""
+    record = {
+        "id": f"{dump.get('id', 'dump')}-bisect-{uuid.uuid4().hex[:8]}",
+        "model": dump["model"],
+        "message": message,
+        "timestamp": time.time(),
+        "bisected_from": dump.get("id"),
+        "bisected_rows": rows,
+        "inputs": take_rows(dump["inputs"], rows),
+    }
+    if dump.get("outputs"):
+        record["outputs"] = take_rows(dump["outputs"], rows)
+    store = FileDumpStore(out_dir)
+    store.write(record)
+    return os.path.join(out_dir, f"{record['id']}{DUMP_EXTENSION}")
+
+def print_bisect_round(round_idx, row_sets, messages):
+    failed = sum(message is not None for message in messages)
+    sizes = sorted({len(rows) for rows in row_sets})
+    size_range = f"{sizes[0]}" if (len(sizes) == 1) else f"{sizes[0]}-{sizes[-1]}"
+    print(f"  round {round_idx:>3}: {len(row_sets)} request(s) of {size_range} rows, {failed} failed")
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the rows of a failing dump that make it fail, and save them as a new dump.")
+    parser.add_argument("dump", help="Dump file name or request id")
+    parser.add_argument("--dump-dir", default=os.path.join(os.path.dirname(__file__), "..", "replay_dumps"), help="Directory holding the dumps")
+    parser.add_argument("--out-dir", default=None, help="Directory to save the bisected dump to (default: --dump-dir)")
+    parser.add_argument("--url", default="localhost:8001", help="Triton gRPC endpoint, or comma-separated endpoints to spread requests over")
+    parser.add_argument("--balance", choices=BALANCE_POLICIES, default="round_robin", help="How requests are spread over several endpoints")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum requests in flight")
+    parser.add_argument("--timeout", type=float, default=None, help="Per-request timeout in seconds")
+    parser.add_argument("--match", default=None, help="Only count errors containing this text as failures")
+    parser.add_argument("--nonfinite", action="store_true", help="Also count NaN or infinite outputs as failures")
+    parser.add_argument("--offline", action="store_true", help="Run the model in this process instead of on Triton")
+    parser.add_argument("--model-repository", default=MODEL_REPOSITORY, help="With --offline, the local model repository")
+    parser.add_argument("--config-name", default=None, help="With --offline, use configs/<name>.pbtxt")
+    parser.add_argument("--backend", choices=("auto", "torch", "onnx"), default="auto", help="With --offline, the model file to load")
+    parser.add_argument("--threads", type=int, default=None, help="With --offline, intra-op threads (default: cores / concurrency)")
+    args = parser.parse_args()
+
+    location = resolve_dump(args.dump_dir, args.dump, DumpLogIndex(args.dump_dir))
+    if location is None:
+        print(f"✗ No dump found for '{args.dump}'")
+        return 1
+    dump = load_dump(*location)
+
+    client = None
+    if args.offline:
+        threads = args.threads or max(1, (os.cpu_count() or 1) // args.concurrency)
+        runner = LocalRunner(LocalModel(args.model_repository, dump["model"], args.config_name, args.backend, threads))
+    else:
+        client = ClientPool([url for url in args.url.split(",") if url], args.balance)
+        runner = TritonRunner(client, dump["model"], args.timeout)
+
+    try:
+        bisector = Bisector(runner, dump["inputs"], args.concurrency, args.match, args.nonfinite, on_round=print_bisect_round)
+        start = time.perf_counter()
+        rows, message = bisector.bisect()
+        elapsed = time.perf_counter() - start
+    finally:
+        if client is not None:
+            client.close()
+
+    if rows is None:
+        print(f"✗ The dump does not fail when replayed ({bisector.requests} request(s), {elapsed:.1f} s)")
+        return 2
+    path = write_bisected_dump(dump, rows, message, args.out_dir or os.path.dirname(location[0]))
+    print(f"✓ {len(rows)} failing row(s) found in {bisector.requests} requests over {bisector.rounds} rounds ({elapsed:.1f} s): {rows}")
+    print(f"✓ Error: {message}")
+    print(f"✓ Saved as {path}")
+    return 0
+
+if (__name__ == "__main__"):
+    sys.exit(main())
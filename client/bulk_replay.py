@@ -0,0 +1,352 @@
+"""
+Concurrent replay of many dumps against a Triton server.
+
+Usage:
+    python client/bulk_replay.py [--url localhost:8001[,localhost:8101,...]] [--balance round_robin|least_outstanding]
+                                 [--dump-dir DIR] [--concurrency 16] [--timeout SECONDS] [--json report.json]
+                                 <selection> [<selection> ...]
+    python client/bulk_replay.py --timed [--speed 2] ... <selection> [<selection> ...]
+
+A selection is either a glob of dump files ("*.dump"), request ids or file names (separated by
+spaces or commas), or catalog conditions as accepted by the REPL's find_dumps command
+("model=particlenet_AK4_PT error~CUDA"). The same functions back the REPL's replay_many command.
+
+With --timed, dumps are replayed on the schedule the server originally executed them on (sped
+up by --speed), reproducing the batch composition and queueing seen by the dynamic batcher.
+This backs the REPL's replay_timed command.
+
+With several comma-separated --url endpoints, requests are spread over the servers by the
+--balance policy, and the default concurrency grows with the number of endpoints.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import uuid
+import argparse
+import threading
+import functools
+import numpy as np
+from tritonclient import grpc as grpcclient
+from tritonclient import utils as tcutils
+
+import model_prep_path # puts model_prep/ on sys.path
+from dump_format import DUMP_EXTENSION, LEGACY_EXTENSION, DumpLogIndex, load_dump
+from dump_catalog import DumpCatalog, parse_query
+from client_pool import BALANCE_POLICIES, ClientPool
+
+_GLOB_CHARS = set("*?[")
+
+def resolve_dump(dump_dir, name, log_index=None):
+    """
+    Find a dump by file name or request id, returning (file path, offset of the record in the
+    file), or None if there is no such dump. Standalone files are preferred over log records.
+    """
+    filepath = os.path.join(dump_dir, name)
+    if filepath.endswith((DUMP_EXTENSION, LEGACY_EXTENSION)):
+        candidates = [filepath]
+    else:
+        # Prefer the binary format, fall back to legacy pickled dumps
+        candidates = [filepath + DUMP_EXTENSION, filepath + LEGACY_EXTENSION]
+
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return candidate, 0
+
+    # Not a standalone file, look the request id up in the dump log
+    if log_index is not None:
+        log_index.refresh()
+        entry = log_index.lookup(name)
+        if entry is not None:
+            seg_path, offset, _ = entry
+            return seg_path, offset
+
+    return None
+
+def select_dumps(dump_dir, tokens, catalog=None, log_index=None):
+    """
+    Turn selection tokens into a list of (file path, offset) dump locations. Tokens are either
+    catalog conditions, globs, or request ids/file names; raises ValueError for ids that do not
+    match any dump.
+    """
+    tokens = [t for token in tokens for t in token.split(",") if t]
+    if not tokens:
+        raise ValueError("No dumps selected")
+
+    if any(any(op in token for op in "=~<>") for token in tokens):
+        if catalog is None:
+            catalog = DumpCatalog(dump_dir)
+        catalog.refresh()
+        conditions, options = parse_query(tokens)
+        rows, _ = catalog.query(conditions, limit=2**62, page=1, order=options["order"])
+        return [(row["path"], row["offset"]) for row in rows]
+
+    locations = []
+    for token in tokens:
+        if _GLOB_CHARS & set(token):
+            matches = sorted(glob.glob(os.path.join(dump_dir, token)))
+            locations += [(path, 0) for path in matches if path.endswith((DUMP_EXTENSION, LEGACY_EXTENSION))]
+        else:
+            location = resolve_dump(dump_dir, token, log_index)
+            if location is None:
+                raise ValueError(f"No dump found for '{token}'")
+            locations.append(location)
+    return locations
+
+def get_model_io(model_config):
+    """Extract input and output names from model config."""
+    input_names = [inp.name for inp in model_config.config.input]
+    output_names = [out.name for out in model_config.config.output]
+    return input_names, output_names
+
+def build_inputs(data, input_names):
+    """Create Triton inputs for the given {input_name: array} data."""
+    inputs = []
+    for name in input_names:
+        tensor_data = data[name]
+        triton_dtype = tcutils.np_to_triton_dtype(tensor_data.dtype)
+        inputs.append(grpcclient.InferInput(name, tensor_data.shape, triton_dtype))
+        inputs[-1].set_data_from_numpy(tensor_data)
+    return inputs
+
+def _new_result(path, offset):
+    return {"dump": path if (offset == 0) else f"{path}@{offset}", "dump_id": None, "request_id": None,
+            "model": None, "rows": 0, "status": None, "error": None, "latency": None}
+
+def _prepare_request(client, model_io, dump, result):
+    """Build the Triton inputs and outputs for a dump, filling in the result's dump fields."""
+    model_name = dump["model"]
+    result["dump_id"] = dump.get("id")
+    result["model"] = model_name
+
+    if model_name not in model_io:
+        model_io[model_name] = get_model_io(client.get_model_config(model_name))
+    input_names, output_names = model_io[model_name]
+
+    inputs = build_inputs(dump["inputs"], input_names)
+    outputs = [grpcclient.InferRequestedOutput(name) for name in output_names]
+    result["rows"] = int(dump["inputs"][input_names[0]].shape[0]) if input_names else 0
+    result["request_id"] = str(uuid.uuid4())
+    return model_name, inputs, outputs
+
+def _on_response(complete, idx, record, sent, check, result, error):
+    # tritonclient passes the InferResult as the "result" keyword, so the per-dump dict is "record" here
+    record["latency"] = time.perf_counter() - sent
+    if error is not None:
+        record["status"] = "error"
+        record["error"] = str(error)
+    else:
+        record["status"] = "ok"
+        if check is not None:
+            try:
+                check(result)
+            except Exception as e:
+                record["status"] = "error"
+                record["error"] = f"Could not check response: {e}"
+    complete(idx, record)
+
+def replay_dumps(client, locations, concurrency=8, timeout=None, on_result=None, on_response=None):
+    """
+    Replay dumps through client.async_infer with at most `concurrency` requests in flight.
+    Returns a list of per-dump result dicts (in the order of locations) and the wall time in
+    seconds. on_result, if given, is called with each result as soon as it is known.
+    on_response, if given, is called with (result, dump, response) for every successful
+    response, from the gRPC callback thread.
+    """
+    results = [None] * len(locations)
+    model_io = {}
+    slots = threading.BoundedSemaphore(concurrency)
+    finished = threading.Condition()
+    pending = [len(locations)]
+
+    def complete(idx, result):
+        results[idx] = result
+        if on_result is not None:
+            on_result(result)
+        slots.release()
+        with finished:
+            pending[0] -= 1
+            finished.notify_all()
+
+    start = time.perf_counter()
+    for idx, (path, offset) in enumerate(locations):
+        slots.acquire()
+        result = _new_result(path, offset)
+        try:
+            dump = load_dump(path, offset)
+            model_name, inputs, outputs = _prepare_request(client, model_io, dump, result)
+            check = functools.partial(on_response, result, dump) if on_response is not None else None
+            sent = time.perf_counter()
+            client.async_infer(
+                model_name, inputs, functools.partial(_on_response, complete, idx, result, sent, check),
+                outputs=outputs, request_id=result["request_id"], client_timeout=timeout
+            )
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = f"Could not send request: {e}"
+            complete(idx, result)
+
+    with finished:
+        finished.wait_for(lambda: pending[0] == 0)
+
+    return results, time.perf_counter() - start
+
+def replay_schedule(client, locations, speed=1.0, timeout=None, on_result=None, on_response=None):
+    """
+    Replay dumps on the schedule the server originally executed them on, compressed by `speed`
+    (2.0 replays twice as fast). Dumps are ordered by the start of the execute() call that ran
+    them, falling back to the dump timestamp for dumps that predate execute timing, and requests
+    the dynamic batcher grouped into one call are sent back to back. All requests are built
+    before the first one is sent, so loading dumps does not delay the schedule, and there is no
+    limit on requests in flight, so queueing pressure is reproduced as well.
+
+    Returns the per-dump result dicts in schedule order and the wall time in seconds. Results
+    also hold the original batch id and the send lag behind the schedule. on_result and
+    on_response work as for replay_dumps().
+    """
+    model_io = {}
+    planned = []
+    for path, offset in locations:
+        result = _new_result(path, offset)
+        dump = {}
+        request = None
+        try:
+            dump = load_dump(path, offset)
+            request = _prepare_request(client, model_io, dump, result)
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = f"Could not send request: {e}"
+        result["batch_id"] = dump.get("batch_id")
+        result["send_lag"] = None
+        planned.append((dump.get("execute_start", dump.get("timestamp")), dump.get("batch_index", 0), result, request, dump))
+
+    times = [when for when, *_ in planned if when is not None]
+    first = min(times) if times else 0.0
+    planned.sort(key=lambda item: (item[0] if item[0] is not None else first, item[1]))
+
+    results = [result for _, _, result, _, _ in planned]
+    finished = threading.Condition()
+    pending = [len(results)]
+
+    def complete(idx, result):
+        if on_result is not None:
+            on_result(result)
+        with finished:
+            pending[0] -= 1
+            finished.notify_all()
+
+    start = time.perf_counter()
+    for idx, (when, _, result, request, dump) in enumerate(planned):
+        if request is None:
+            complete(idx, result)
+            continue
+
+        target = start + ((when if when is not None else first) - first) / speed
+        now = time.perf_counter()
+        if (now < target):
+            time.sleep(target - now)
+
+        model_name, inputs, outputs = request
+        check = functools.partial(on_response, result, dump) if on_response is not None else None
+        sent = time.perf_counter()
+        result["send_lag"] = max(0.0, sent - target)
+        try:
+            client.async_infer(
+                model_name, inputs, functools.partial(_on_response, complete, idx, result, sent, check),
+                outputs=outputs, request_id=result["request_id"], client_timeout=timeout
+            )
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = f"Could not send request: {e}"
+            complete(idx, result)
+
+    with finished:
+        finished.wait_for(lambda: pending[0] == 0)
+
+    return results, time.perf_counter() - start
+
+def summarize(results, elapsed):
+    """Aggregate per-request results into throughput and latency percentiles."""
+    ok = [r for r in results if r["status"] == "ok"]
+    latencies_ms = np.array([r["latency"] * 1000 for r in results if r["latency"] is not None])
+    summary = {
+        "requests": len(results),
+        "ok": len(ok),
+        "failed": len(results) - len(ok),
+        "elapsed_s": elapsed,
+        "requests_per_s": len(results) / elapsed if elapsed > 0 else 0.0,
+        "rows_per_s": sum(r["rows"] for r in ok) / elapsed if elapsed > 0 else 0.0,
+    }
+    if (latencies_ms.size > 0):
+        p50, p90, p99 = np.percentile(latencies_ms, [50, 90, 99])
+        summary.update({"latency_ms_p50": p50, "latency_ms_p90": p90, "latency_ms_p99": p99,
+                        "latency_ms_mean": latencies_ms.mean(), "latency_ms_max": latencies_ms.max()})
+
+    # Only scheduled replays record how far sends fell behind the original timing
+    lags_ms = np.array([r["send_lag"] * 1000 for r in results if r.get("send_lag") is not None])
+    if (lags_ms.size > 0):
+        summary.update({"send_lag_ms_mean": lags_ms.mean(), "send_lag_ms_max": lags_ms.max()})
+    return summary
+
+def print_result(result):
+    latency = f"{result['latency'] * 1000:.1f} ms" if result["latency"] is not None else "-"
+    batch = f", batch {result['batch_id']}" if result.get("batch_id") else ""
+    if (result["status"] == "ok"):
+        print(f"  ✓ {result['dump']} (id {result['dump_id']}, {result['rows']} rows{batch}): {latency}")
+    else:
+        print(f"  ✗ {result['dump']} (id {result['dump_id']}{batch}): {latency}, {result['error']}")
+
+def print_summary(summary):
+    print(f"Replayed {summary['requests']} dumps in {summary['elapsed_s']:.2f} s: {summary['ok']} ok, {summary['failed']} failed")
+    print(f"  Throughput: {summary['requests_per_s']:.1f} requests/s, {summary['rows_per_s']:.1f} rows/s")
+    if "latency_ms_p50" in summary:
+        print(f"  Latency: p50 {summary['latency_ms_p50']:.1f} ms, p90 {summary['latency_ms_p90']:.1f} ms, "
+              f"p99 {summary['latency_ms_p99']:.1f} ms, max {summary['latency_ms_max']:.1f} ms")
+    if "send_lag_ms_max" in summary:
+        print(f"  Schedule: sends lagged by {summary['send_lag_ms_mean']:.2f} ms on average, {summary['send_lag_ms_max']:.2f} ms at most")
+
+def write_report(path, results, summary):
+    with open(path, "w") as f:
+        json.dump({"summary": summary, "results": results}, f, indent=2, default=float)
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay many dumps concurrently against a Triton server.")
+    parser.add_argument("selection", nargs="+", help="Glob, request ids/file names, or catalog conditions")
+    parser.add_argument("--url", default="localhost:8001", help="Triton gRPC endpoint, or comma-separated endpoints to spread requests over")
+    parser.add_argument("--balance", choices=BALANCE_POLICIES, default="round_robin", help="How requests are spread over several endpoints")
+    parser.add_argument("--dump-dir", default=os.path.join(os.path.dirname(__file__), "..", "replay_dumps"), help="Directory holding the dumps")
+    parser.add_argument("--concurrency", type=int, default=None, help="Maximum requests in flight (default: 8 per endpoint)")
+    parser.add_argument("--timed", action="store_true", help="Replay on the original schedule instead of as fast as possible")
+    parser.add_argument("--speed", type=float, default=1.0, help="With --timed, time-scale factor for the schedule (2 is twice as fast)")
+    parser.add_argument("--timeout", type=float, default=None, help="Per-request timeout in seconds")
+    parser.add_argument("--json", help="Write per-request results and summary to this JSON file")
+    parser.add_argument("--quiet", action="store_true", help="Only print the summary")
+    args = parser.parse_args()
+
+    try:
+        locations = select_dumps(args.dump_dir, args.selection, log_index=DumpLogIndex(args.dump_dir))
+    except ValueError as e:
+        print(f"✗ {e}")
+        return 1
+    print(f"✓ Selected {len(locations)} dumps")
+
+    urls = [url for url in args.url.split(",") if url]
+    concurrency = args.concurrency or 8 * len(urls)
+    with ClientPool(urls, args.balance) as client:
+        on_result = None if args.quiet else print_result
+        if args.timed:
+            results, elapsed = replay_schedule(client, locations, speed=args.speed, timeout=args.timeout, on_result=on_result)
+        else:
+            results, elapsed = replay_dumps(client, locations, concurrency=concurrency, timeout=args.timeout, on_result=on_result)
+
+    summary = summarize(results, elapsed)
+    print_summary(summary)
+    if args.json:
+        write_report(args.json, results, summary)
+        print(f"✓ Report written to {args.json}")
+    return 0 if (summary["failed"] == 0) else 2
+
+if (__name__ == "__main__"):
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""
+A pool of Triton gRPC clients spread over several server endpoints, with a shared model
+config/metadata cache.
+
+ClientPool has the methods of tritonclient.grpc.InferenceServerClient that the replay tools use,
+so it can be passed wherever a client is expected. Inference requests go to one endpoint each,
+picked round-robin or by fewest outstanding requests; other calls go to the first endpoint, and
+shared-memory registration goes to all of them. Model configs and metadata are fetched once per
+model and kept until the pool is closed (the REPL makes a new pool on reconnect), or until a
+response comes from a model version the cached entry did not list as ready.
+"""
+
+import threading
+from tritonclient import grpc as grpcclient
+
+BALANCE_POLICIES = ("round_robin", "least_outstanding")
+
+class ModelConfigCache:
+    """Model configs and metadata of one server (or of identical servers), fetched on first use."""
+
+    def __init__(self, client):
+        self.client = client
+        self.lock = threading.Lock()
+        self.configs = {}
+        self.metadata = {}
+
+    def get_config(self, model_name):
+        with self.lock:
+            config = self.configs.get(model_name)
+        if config is None:
+            # Fetch metadata alongside, its list of ready versions is what invalidates the entry
+            self.get_metadata(model_name)
+            config = self.client.get_model_config(model_name)
+            with self.lock:
+                self.configs[model_name] = config
+        return config
+
+    def get_metadata(self, model_name):
+        with self.lock:
+            metadata = self.metadata.get(model_name)
+        if metadata is None:
+            metadata = self.client.get_model_metadata(model_name)
+            with self.lock:
+                self.metadata[model_name] = metadata
+        return metadata
+
+    def check_version(self, model_name, version):
+        """Drop the model's entries if `version` (of a response) is not among the cached ready versions."""
+        with self.lock:
+            metadata = self.metadata.get(model_name)
+            if (metadata is not None) and version and (version not in metadata.versions):
+                self.configs.pop(model_name, None)
+                self.metadata.pop(model_name, None)
+
+    def invalidate(self, model_name=None):
+        with self.lock:
+            if model_name is None:
+                self.configs.clear()
+                self.metadata.clear()
+            else:
+                self.configs.pop(model_name, None)
+                self.metadata.pop(model_name, None)
+
+class ClientPool:
+    """
+    gRPC clients for a list of endpoints ("host:port"), balanced by `policy`: "round_robin", or
+    "least_outstanding" to send each request to the endpoint with the fewest requests in flight.
+    """
+
+    def __init__(self, urls, policy="round_robin"):
+        if not urls:
+            raise ValueError("At least one endpoint is needed")
+        if policy not in BALANCE_POLICIES:
+            raise ValueError(f"Unknown balancing policy '{policy}', expected one of {', '.join(BALANCE_POLICIES)}")
+        self.urls = list(urls)
+        self.policy = policy
+        self.clients = []
+        try:
+            for url in self.urls:
+                self.clients.append(grpcclient.InferenceServerClient(url))
+        except Exception:
+            self.close()
+            raise
+
+        self.cache = ModelConfigCache(self.clients[0])
+        self.lock = threading.Lock()
+        self.outstanding = [0] * len(self.clients)
+        self.sent = [0] * len(self.clients)
+        self.next = 0
+
+    def __len__(self):
+        return len(self.clients)
+
+    def _acquire(self):
+        with self.lock:
+            if (self.policy == "least_outstanding"):
+                # Ties go to the endpoint after the last one picked, so idle endpoints are used in turn
+                order = [(self.next + i) % len(self.clients) for i in range(len(self.clients))]
+                idx = min(order, key=lambda i: self.outstanding[i])
+            else:
+                idx = self.next % len(self.clients)
+            self.next = idx + 1
+            self.outstanding[idx] += 1
+            self.sent[idx] += 1
+        return idx
+
+    def _release(self, idx, model_name, response):
+        with self.lock:
+            self.outstanding[idx] -= 1
+        if response is not None:
+            self.cache.check_version(model_name, response.get_response().model_version)
+
+    def infer(self, model_name, inputs, **kwargs):
+        idx = self._acquire()
+        response = None
+        try:
+            response = self.clients[idx].infer(model_name, inputs, **kwargs)
+            return response
+        finally:
+            self._release(idx, model_name, response)
+
+    def async_infer(self, model_name, inputs, callback, **kwargs):
+        idx = self._acquire()
+
+        # tritonclient calls back with keyword arguments, so the names must stay result and error
+        def done(result, error):
+            self._release(idx, model_name, result if error is None else None)
+            callback(result=result, error=error)
+
+        try:
+            return self.clients[idx].async_infer(model_name, inputs, done, **kwargs)
+        except Exception:
+            self._release(idx, model_name, None)
+            raise
+
+    def get_model_config(self, model_name):
+        return self.cache.get_config(model_name)
+
+    def get_model_metadata(self, model_name):
+        return self.cache.get_metadata(model_name)
+
+    def register_system_shared_memory(self, name, key, byte_size):
+        # Requests may go to any endpoint, so every server needs the region
+        for idx, client in enumerate(self.clients):
+            try:
+                client.register_system_shared_memory(name, key, byte_size)
+            except Exception:
+                for registered in self.clients[:idx]:
+                    registered.unregister_system_shared_memory(name)
+                raise
+
+    def unregister_system_shared_memory(self, name=""):
+        # Try every endpoint even if one fails, so no server is left holding the region
+        error = None
+        for client in self.clients:
+            try:
+                client.unregister_system_shared_memory(name)
+            except Exception as e:
+                error = e
+        if error is not None:
+            raise error
+
+    def is_server_live(self):
+        return all(client.is_server_live() for client in self.clients)
+
+    def is_server_ready(self):
+        return all(client.is_server_ready() for client in self.clients)
+
+    def endpoint_stats(self):
+        """Return [(url, requests sent, requests outstanding)] for every endpoint."""
+        with self.lock:
+            return list(zip(self.urls, self.sent, self.outstanding))
+
+    def close(self):
+        for client in self.clients:
+            client.close()
+        self.clients = []
+
+    def __getattr__(self, name):
+        # Everything else (repository index, statistics, ...) is asked of the first endpoint
+        clients = self.__dict__.get("clients")
+        if not clients:
+            raise AttributeError(name)
+        return getattr(clients[0], name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
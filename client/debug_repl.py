@@ -1,16 +1,44 @@
 import os
+import sys
 import cmd
+import json
 import ast
 import shlex
+import time
+import threading
 import uuid
+import datetime
+import functools
 import traceback
-import pickle
 import numpy as np
 from tritonclient import grpc as grpcclient
 from tritonclient import utils as tcutils
 
+# The dump format is shared with the server-side model code in model_prep/
+import model_prep_path # puts model_prep/ on sys.path
+from dump_format import DUMP_EXTENSION, LEGACY_EXTENSION, DumpLogIndex, collect_blobs, load_dump, load_dump_info
+from dump_catalog import DumpCatalog, parse_query
+from bulk_replay import (build_inputs, get_model_io, print_result, print_summary, replay_dumps, replay_schedule,
+                         resolve_dump, select_dumps, summarize, write_report)
+from replay_diff import ReplayDiff, compare_outputs, find_labels, load_labels, print_diff_report
+from offline_engine import MODEL_REPOSITORY, LocalModel, model_labels, replay_offline
+from triton_metrics import DEFAULT_METRICS_URL, fetch_metrics, model_counters, parse_metrics, stage_summary
+from shm_transport import SharedMemoryPool
+from client_pool import BALANCE_POLICIES, ClientPool
+from synthetic_corpus import generate_requests, load_profile
+from bisect_dump import Bisector, LocalRunner, TritonRunner, print_bisect_round, write_bisected_dump
+from repl_jobs import JobTable
+
+try:
+    import readline
+except ImportError:
+    readline = None
+
+# Display order of the execute() stages timed by the Python backend models
+STAGE_ORDER = ("inputs", "cache", "fuse", "to_device", "forward", "outputs", "split", "responses", "dump")
+
 class TritonReplayREPL(cmd.Cmd):
-    """REPL for replaying Triton inference requests from pickled dumps."""
+    """REPL for replaying Triton inference requests from dumps."""
     
     intro = "Triton Replay REPL - Type 'help' for available commands."
     prompt = "triton> "
@@ -18,53 +46,300 @@ class TritonReplayREPL(cmd.Cmd):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.dump_dir = os.path.join(os.path.dirname(__file__), "..", "replay_dumps")
+        self.dump_log_index = DumpLogIndex(self.dump_dir)
+        self.catalog = None
+        self.metrics_url = DEFAULT_METRICS_URL
         self.last_request_id = None
         self.rng = np.random.default_rng()
 
+        # Set by the shm command, None while requests go over gRPC
+        self.shm_pool = None
+
+        # Requests sent by replay and request_random run as jobs, and the prompt comes back at once
+        self.jobs = JobTable()
+        self.request_timeout = None
+        self.print_lock = threading.Lock()
+        self.at_prompt = False
+
+        # Servers to send requests to, changed with reconnect
+        self.endpoints = ["localhost:8001"]
+        self.balance = "round_robin"
+
         self.client = None
         self._connect_client()
     
     def do_replay(self, arg):
-        """Replay an inference request from a pickled dump. Usage: replay <filename>"""
+        """Replay an inference request from a dump, as a job. Usage: replay [timeout=<s>] <filename>"""
+        try:
+            arg, timeout = self._pop_timeout(arg)
+        except ValueError as e:
+            print(f"✗ Invalid input: {e}")
+            return
         if not arg:
-            print("Usage: replay <filename>")
+            print("Usage: replay [timeout=<s>] <filename>")
             return
         
         if self.client is None:
             print("✗ Not connected to Triton server. Cannot replay.")
             return
         
-        filename = arg.strip()
-        filepath = os.path.join(self.dump_dir, filename)
-        
-        # Add .pkl extension if not present
-        if not filepath.endswith('.pkl'):
-            filepath += '.pkl'
-        
-        if not os.path.isfile(filepath):
-            print(f"✗ File not found: {filepath}")
+        location = self._resolve_dump_path(arg.strip())
+        if location is None:
             return
         
         try:
-            # Load the pickled data
-            with open(filepath, 'rb') as f:
-                data = pickle.load(f)
+            # Tensors in binary dumps are memory-mapped, not read up front
+            filepath, offset = location
+            data = load_dump(filepath, offset)
             
-            print(f"✓ Loaded dump: {os.path.basename(filepath)}")
+            print(f"✓ Loaded dump: {self._describe_location(location)}")
             
-            # Send inference request
-            self.last_request_id = self._send_inference(data["inputs"], data["model"])
+            # Send inference request, checking against the recorded outputs if the dump has them
+            self.last_request_id = self._send_inference(data["inputs"], data["model"], recorded=data.get("outputs"),
+                                                        description=f"replay {self._describe_location(location)}", timeout=timeout)
             
         except Exception as e:
             print(f"✗ Error loading or replaying dump: {e}")
             traceback.print_exc()
     
+    def do_replay_many(self, arg):
+        """Replay many dumps concurrently. Usage: replay_many [concurrency=<n>] [timeout=<s>] [json=<file>] <selection> [...]
+
+        The selection is a glob ("*.dump"), request ids or file names, or find_dumps conditions
+        (e.g. model=particlenet_AK4_PT error~CUDA). Reports the status and latency of every
+        request, then the overall throughput and p50/p90/p99 latency.
+        """
+        usage = "Usage: replay_many [concurrency=<n>] [timeout=<s>] [json=<file>] <selection> [...]"
+        parsed = self._parse_replay_args(arg, {"concurrency": 8 * self._num_endpoints(), "timeout": None, "json": None}, usage)
+        if parsed is None:
+            return
+        options, locations = parsed
+
+        try:
+            concurrency = int(options["concurrency"])
+            if (concurrency < 1):
+                raise ValueError("concurrency must be positive")
+        except ValueError as e:
+            print(f"✗ Invalid input: {e}")
+            print(usage)
+            return
+
+        print(f"✓ Replaying {len(locations)} dumps with concurrency {concurrency}")
+        self._run_replay(replay_dumps, locations, options, concurrency=concurrency)
+
+    def do_replay_timed(self, arg):
+        """Replay dumps on their original schedule. Usage: replay_timed [speed=<factor>] [timeout=<s>] [json=<file>] <selection> [...]
+
+        Dumps are re-sent at the times the server originally executed them, compressed by the
+        speed factor (speed=2 replays twice as fast), and requests the dynamic batcher grouped
+        into one execute call are sent together. Select a window with find_dumps conditions,
+        e.g. replay_timed speed=2 model=particlenet_AK4_PT time>=2024-05-01T10:00 time<2024-05-01T10:05
+        """
+        usage = "Usage: replay_timed [speed=<factor>] [timeout=<s>] [json=<file>] <selection> [...]"
+        parsed = self._parse_replay_args(arg, {"speed": 1.0, "timeout": None, "json": None}, usage)
+        if parsed is None:
+            return
+        options, locations = parsed
+
+        try:
+            speed = float(options["speed"])
+            if (speed <= 0):
+                raise ValueError("speed must be positive")
+        except ValueError as e:
+            print(f"✗ Invalid input: {e}")
+            print(usage)
+            return
+
+        print(f"✓ Replaying {len(locations)} dumps on their original schedule at {speed:g}x speed")
+        self._run_replay(replay_schedule, locations, options, speed=speed)
+
+    def do_diff_replay(self, arg):
+        """Replay dumps and compare outputs with the recorded ones. Usage: diff_replay [concurrency=<n>] [atol=<x>] [rtol=<x>] [top=<n>] [labels=<file>] [json=<file>] <selection> [...]
+
+        Only dumps written with the dump_outputs model parameter hold recorded outputs. Reports
+        the maximum absolute and relative error of each output, rows outside tolerance, argmax
+        label flips (labels are taken from the model's label file), and the worst rows.
+        """
+        usage = "Usage: diff_replay [concurrency=<n>] [atol=<x>] [rtol=<x>] [top=<n>] [labels=<file>] [json=<file>] <selection> [...]"
+        defaults = {"concurrency": 8 * self._num_endpoints(), "atol": 1e-5, "rtol": 1e-3, "top": 10, "labels": None, "timeout": None, "json": None}
+        parsed = self._parse_replay_args(arg, defaults, usage)
+        if parsed is None:
+            return
+        options, locations = parsed
+
+        try:
+            concurrency = int(options["concurrency"])
+            if (concurrency < 1):
+                raise ValueError("concurrency must be positive")
+            labels = load_labels(options["labels"]) if options["labels"] else None
+            diff = ReplayDiff(labels=labels, atol=float(options["atol"]), rtol=float(options["rtol"]), top=int(options["top"]))
+        except (ValueError, OSError) as e:
+            print(f"✗ Invalid input: {e}")
+            print(usage)
+            return
+
+        print(f"✓ Replaying and comparing {len(locations)} dumps with concurrency {concurrency}")
+        replayed = self._run_replay(replay_dumps, locations, dict(options, json=None), concurrency=concurrency, on_response=diff.add)
+        if replayed is None:
+            return
+        results, summary = replayed
+
+        models = {r["model"] for r in results if r["model"]}
+        if (diff.labels is None) and (len(models) == 1):
+            try:
+                diff.labels = find_labels(self.client, models.pop())
+            except Exception:
+                pass # labels are only cosmetic, report indices instead
+
+        report = diff.report()
+        print_diff_report(report)
+        if options["json"]:
+            with open(options["json"], "w") as f:
+                json.dump({"summary": summary, "diff": report, "results": results}, f, indent=2, default=float)
+            print(f"✓ Report written to {options['json']}")
+
+    def do_replay_offline(self, arg):
+        """Replay dumps on the CPU without Triton. Usage: replay_offline [workers=<n>] [threads=<n>] [backend=auto|torch|onnx] [config=<name>] [diff=true] [json=<file>] <selection> [...]
+
+        Loads model.pt or model.onnx from the local model repository (single_sonic_model/models)
+        into a pool of worker processes, one model copy each, and replays the selected dumps
+        there. Does not need a connection to the server. With diff=true, outputs are compared
+        with the recorded ones as in diff_replay.
+        """
+        usage = "Usage: replay_offline [workers=<n>] [threads=<n>] [backend=auto|torch|onnx] [config=<name>] [diff=true] [json=<file>] <selection> [...]"
+        defaults = {"workers": None, "threads": 1, "backend": "auto", "config": None, "repository": MODEL_REPOSITORY,
+                    "diff": "false", "timeout": None, "json": None}
+        parsed = self._parse_replay_args(arg, defaults, usage, need_client=False)
+        if parsed is None:
+            return
+        options, locations = parsed
+
+        try:
+            workers = int(options["workers"]) if options["workers"] is not None else os.cpu_count()
+            threads = int(options["threads"])
+            if (workers < 1) or (threads < 1):
+                raise ValueError("workers and threads must be positive")
+            if options["backend"] not in ("auto", "torch", "onnx"):
+                raise ValueError("backend must be auto, torch or onnx")
+        except ValueError as e:
+            print(f"✗ Invalid input: {e}")
+            print(usage)
+            return
+
+        diff = ReplayDiff() if options["diff"].lower() == "true" else None
+        print(f"✓ Replaying {len(locations)} dumps offline on {workers} workers with {threads} threads each")
+        try:
+            results, elapsed = replay_offline(
+                locations, options["repository"], options["config"], options["backend"], workers, threads,
+                on_result=print_result, on_response=diff.add if diff is not None else None
+            )
+        except Exception as e:
+            print(f"✗ Error during offline replay: {e}")
+            traceback.print_exc()
+            return
+
+        summary = summarize(results, elapsed)
+        print_summary(summary)
+        report = None
+        if diff is not None:
+            models = {r["model"] for r in results if r["model"]}
+            if (len(models) == 1):
+                try:
+                    diff.labels = model_labels(options["repository"], models.pop(), options["config"])
+                except Exception:
+                    pass # labels are only cosmetic, report indices instead
+            report = diff.report()
+            print_diff_report(report)
+
+        if options["json"]:
+            with open(options["json"], "w") as f:
+                json.dump({"summary": summary, "diff": report, "results": results}, f, indent=2, default=float)
+            print(f"✓ Report written to {options['json']}")
+
+    def do_bisect_dump(self, arg):
+        """Find the rows of a failing dump that make it fail. Usage: bisect_dump [engine=triton|offline] [concurrency=<n>] [match=<text>] [nonfinite=true] [timeout=<s>] [out=<dir>] <dump>
+
+        The batch is split along dimension 0 and the halves are replayed concurrently, recursing
+        into every half that still fails, down to the minimal set of failing rows, which is saved
+        as a new dump. A failure is an error (containing match= if given) or, with nonfinite=true,
+        NaN/inf outputs. engine=offline runs the model in-process from the local model repository
+        (options backend=, config=, threads= as for replay_offline) and needs no server.
+        """
+        usage = "Usage: bisect_dump [engine=triton|offline] [concurrency=<n>] [match=<text>] [nonfinite=true] [timeout=<s>] [out=<dir>] <dump>"
+        defaults = {"engine": "triton", "concurrency": 8 * self._num_endpoints(), "match": None, "nonfinite": "false",
+                    "timeout": None, "out": None, "backend": "auto", "config": None, "threads": None,
+                    "repository": MODEL_REPOSITORY, "json": None}
+        parsed = self._parse_replay_args(arg, defaults, usage, need_client=False)
+        if parsed is None:
+            return
+        options, locations = parsed
+
+        try:
+            if (len(locations) != 1):
+                raise ValueError(f"bisect_dump takes a single dump, {len(locations)} selected")
+            if options["engine"] not in ("triton", "offline"):
+                raise ValueError("engine must be triton or offline")
+            concurrency = int(options["concurrency"])
+            if (concurrency < 1):
+                raise ValueError("concurrency must be positive")
+            threads = int(options["threads"]) if options["threads"] is not None else max(1, (os.cpu_count() or 1) // concurrency)
+        except ValueError as e:
+            print(f"✗ Invalid input: {e}")
+            print(usage)
+            return
+        if (options["engine"] == "triton") and (self.client is None):
+            print("✗ Not connected to Triton server. Use engine=offline to bisect without it.")
+            return
+
+        try:
+            dump = load_dump(*locations[0])
+            rows = int(next(iter(dump["inputs"].values())).shape[0])
+            print(f"✓ Loaded dump: {self._describe_location(locations[0])} ({rows} rows)")
+            if (options["engine"] == "offline"):
+                runner = LocalRunner(LocalModel(options["repository"], dump["model"], options["config"], options["backend"], threads))
+            else:
+                runner = TritonRunner(self.client, dump["model"], options["timeout"])
+
+            bisector = Bisector(runner, dump["inputs"], concurrency, options["match"], options["nonfinite"].lower() == "true",
+                                on_round=print_bisect_round)
+            start = time.perf_counter()
+            failing, message = bisector.bisect()
+            elapsed = time.perf_counter() - start
+        except Exception as e:
+            print(f"✗ Error during bisection: {e}")
+            traceback.print_exc()
+            return
+
+        if failing is None:
+            print(f"✗ The dump does not fail when replayed ({bisector.requests} request(s), {elapsed:.1f} s)")
+            return
+        path = write_bisected_dump(dump, failing, message, options["out"] or os.path.dirname(locations[0][0]))
+        print(f"✓ {len(failing)} failing row(s) found in {bisector.requests} requests over {bisector.rounds} rounds ({elapsed:.1f} s): {failing}")
+        print(f"✓ Error: {message}")
+        print(f"✓ Saved as {os.path.basename(path)}")
+
     def do_request_random(self, arg):
-        """Send random inference input. Usage: request_random <model_name> <input_name> <shape> [<input_name> <shape> ...]"""
+        """
+        Send random inference input. Usage: request_random <model_name> <input_name> <shape> [<input_name> <shape> ...]
+                                            request_random <model_name> profile=<file> [rows=<n>]
+        With profile=, the request is drawn from a traffic profile written by synthetic_corpus.py fit,
+        with realistic particle counts, masks and feature values, and its batch size drawn from the
+        profile unless rows= is given. Both forms take timeout=<s> and send the request as a job.
+        """
         if self.client is None:
             print("✗ Not connected to Triton server. Cannot send request.")
             return
 
+        try:
+            arg, timeout = self._pop_timeout(arg)
+        except ValueError as e:
+            print(f"✗ Invalid input: {e}")
+            return
+
+        if any(token.startswith("profile=") for token in shlex.split(arg or "")):
+            self._request_from_profile(arg, timeout)
+            return
+
         try:
             model_name, input_shapes = self._parse_random_request_args(arg)
         except ValueError as e:
@@ -111,45 +386,164 @@ class TritonReplayREPL(cmd.Cmd):
 
                 random_inputs[inp.name] = values
 
-            self.last_request_id = self._send_inference(random_inputs, model_name)
+            self.last_request_id = self._send_inference(random_inputs, model_name, description=f"request_random {model_name}", timeout=timeout)
 
         except Exception as e:
             print(f"✗ Error creating or sending random request: {e}")
             traceback.print_exc()
 
+    def _request_from_profile(self, arg, timeout):
+        usage = "Usage: request_random <model_name> profile=<file> [rows=<n>]"
+        tokens = shlex.split(arg)
+        options = dict(token.split("=", 1) for token in tokens[1:] if "=" in token)
+        if (len(tokens) < 2) or tokens[0].count("=") or (set(options) - {"profile", "rows"}) or (len(options) != len(tokens) - 1):
+            print(f"✗ {usage}")
+            return
+        model_name = tokens[0]
+
+        try:
+            rows = int(options["rows"]) if "rows" in options else None
+            profile = load_profile(options["profile"])
+        except (OSError, ValueError) as e:
+            print(f"✗ Invalid input: {e}")
+            return
+
+        try:
+            model_config = self.client.get_model_config(model_name)
+            input_names = {inp.name for inp in model_config.config.input}
+            if (input_names != set(profile["inputs"])):
+                print(f"✗ Profile of '{profile['model']}' does not match the inputs of model '{model_name}'")
+                return
+
+            inputs = next(generate_requests(profile, 1, self.rng, rows))
+            shapes = ", ".join(f"{name}{list(arr.shape)}" for name, arr in inputs.items())
+            print(f"Drawn from profile of {profile['model']} ({profile['dumps']} dumps): {shapes}")
+            self.last_request_id = self._send_inference(inputs, model_name, description=f"request_random {model_name} profile", timeout=timeout)
+        except Exception as e:
+            print(f"✗ Error creating or sending random request: {e}")
+            traceback.print_exc()
+
+    def do_jobs(self, arg):
+        """List the requests sent by replay and request_random. Usage: jobs [<id>|clear]
+
+        With an id, also prints the job's outputs. "jobs clear" forgets finished jobs.
+        """
+        command = arg.strip()
+        if (command == "clear"):
+            print(f"✓ Cleared {self.jobs.clear()} finished job(s)")
+            return
+        if command:
+            job = self._get_job(command)
+            if job is not None:
+                print(job.summary())
+                for line in job.lines:
+                    print(f"    {line}")
+            return
+
+        jobs = self.jobs.all()
+        if not jobs:
+            print("No jobs.")
+            return
+        for job in jobs:
+            print(job.summary())
+        print(f"{len(self.jobs.running())} of {len(jobs)} job(s) running")
+
+    def do_wait(self, arg):
+        """Wait for jobs to finish. Usage: wait [<id> ...]
+
+        Without ids, waits for every running job. Ctrl+C stops waiting, the jobs keep running.
+        """
+        if arg.strip():
+            jobs = [self._get_job(token) for token in arg.split()]
+            if None in jobs:
+                return
+        else:
+            jobs = self.jobs.running()
+            if not jobs:
+                print("No running jobs.")
+                return
+
+        try:
+            for job in jobs:
+                if job.done.is_set():
+                    # Finished before the wait, print its outcome again since the notice may have scrolled away
+                    print(job.summary())
+                    for line in job.lines:
+                        print(f"    {line}")
+                # Short waits keep Ctrl+C responsive
+                while not job.done.wait(0.1):
+                    pass
+        except KeyboardInterrupt:
+            print("\n✗ Stopped waiting, jobs are still running")
+            return
+        print(f"✓ {len(jobs)} job(s) finished")
+
+    def do_cancel(self, arg):
+        """Cancel running jobs. Usage: cancel <id> [<id> ...] | cancel all"""
+        if not arg.strip():
+            print("Usage: cancel <id> [<id> ...] | cancel all")
+            return
+        if (arg.strip() == "all"):
+            jobs = self.jobs.running()
+        else:
+            jobs = [self._get_job(token) for token in arg.split()]
+            if None in jobs:
+                return
+
+        for job in jobs:
+            if job.cancel():
+                print(f"✓ Cancelling job [{job.id}]")
+            else:
+                print(f"✗ Job [{job.id}] is not running ({job.state})")
+
+    def do_set_timeout(self, arg):
+        """Set the default timeout of replay and request_random requests. Usage: set_timeout <seconds>|none"""
+        value = arg.strip().lower()
+        try:
+            if (value == "none"):
+                self.request_timeout = None
+            else:
+                self.request_timeout = float(value)
+                if (self.request_timeout <= 0):
+                    raise ValueError("timeout must be positive")
+        except ValueError as e:
+            print(f"✗ Invalid input: {e}")
+            print("Usage: set_timeout <seconds>|none")
+            return
+        print(f"✓ Default request timeout: {'none' if self.request_timeout is None else f'{self.request_timeout:g} s'}")
+
     def do_inspect_dump(self, arg):
         """Get information from an input dump. Usage: inspect_dump <filename>"""
         if not arg:
             print("Usage: inspect_dump <filename>")
             return
         
-        filename = arg.strip()
-        filepath = os.path.join(self.dump_dir, filename)
-
-        if not filepath.endswith('.pkl'):
-            filepath += '.pkl'
-        
-        if not os.path.isfile(filepath):
-            print(f"✗ File not found: {filepath}")
+        location = self._resolve_dump_path(arg.strip())
+        if location is None:
             return
         
         try:
-            with open(filepath, 'rb') as f:
-                dump = pickle.load(f)
+            # Only the header is read for binary dumps, tensor data is never touched
+            filepath, offset = location
+            dump = load_dump_info(filepath, offset)
             
-            print(f"✓ Loaded dump: {os.path.basename(filepath)}\n")
+            print(f"✓ Loaded dump: {self._describe_location(location)}\n")
 
             print(f"Request id: {dump.get('id', 'MISSING')}")
             print(f"Model name: {dump.get('model', 'MISSING')}")
             print(f"Error message: {dump.get('message', 'none')}")
+            if "batch_id" in dump:
+                start = datetime.datetime.fromtimestamp(dump["execute_start"]).isoformat(sep=" ", timespec="milliseconds")
+                duration = (dump["execute_end"] - dump["execute_start"]) * 1000
+                print(f"Executed: {start} for {duration:.1f} ms, as request {dump['batch_index'] + 1} of {dump['batch_requests']} in batch {dump['batch_id']}")
 
-            dump_inputs = dump.get('inputs', {})
+            dump_inputs = dump["tensors"].get('inputs', {})
             if len(dump_inputs) == 0:
                 print("No input tensors found!")
             else:
                 print("Input information:")
-                for name, val in dump_inputs.items():
-                    print(f"  Input {name}: shape: {val.shape}, dtype: {val.dtype}")
+                for name, (shape, dtype) in dump_inputs.items():
+                    print(f"  Input {name}: shape: {shape}, dtype: {dtype}")
                 print() # extra newline
         
         except Exception as e:
@@ -188,25 +582,166 @@ class TritonReplayREPL(cmd.Cmd):
             return
         
         self.dump_dir = arg
+        self.dump_log_index = DumpLogIndex(self.dump_dir)
+        if self.catalog is not None:
+            self.catalog.close()
+            self.catalog = None
         print(f"✓ Dumps directory set to: {self.dump_dir}")
 
     def do_list_dumps(self, arg):
-        """List available dump files in the current dumps directory."""
+        """List dumps in the current dumps directory. Usage: list_dumps [page=<n>] [limit=<n>]"""
+        catalog = self._get_catalog()
+        if catalog is None:
+            return
+
+        try:
+            conditions, options = parse_query(shlex.split(arg))
+            if conditions:
+                raise ValueError("list_dumps only takes page= and limit=, use find_dumps to filter")
+        except ValueError as e:
+            print(f"✗ Invalid input: {e}")
+            return
+
+        rows, total = catalog.query([], limit=options["limit"], page=options["page"], order="file")
+        if (total == 0):
+            print(f"No dump files found in {self.dump_dir}")
+            return
+
+        print(f"✓ Dumps in {self.dump_dir}:")
+        for row in rows:
+            print(f"  {row['name']} ({row['nbytes']} bytes)")
+        self._print_page_footer(total, options)
+
+    def do_find_dumps(self, arg):
+        """Search the dump catalog. Usage: find_dumps [<field><op><value> ...] [order=<field>] [limit=<n>] [page=<n>]
+
+        Fields: id, model, error (or message), file, failed, batch, size, time, dtype.
+        Operators: = != ~ (contains) !~ (does not contain) > >= < <=
+        Times are epoch seconds or ISO dates. Order by time, id, model, batch, size or file,
+        prefixed with - for descending.
+        Example: find_dumps model=particlenet_AK4_PT error~"CUDA" batch>1000 order=-time
+        """
+        catalog = self._get_catalog()
+        if catalog is None:
+            return
+
+        try:
+            conditions, options = parse_query(shlex.split(arg))
+            rows, total = catalog.query(conditions, **options)
+        except ValueError as e:
+            print(f"✗ Invalid input: {e}")
+            return
+
+        if (total == 0):
+            print("No dumps match the query.")
+            return
+
+        print(f"{'dump':<40} {'model':<24} {'batch':>6} {'bytes':>12}  {'time':<19}  message")
+        for row in rows:
+            time_str = datetime.datetime.fromtimestamp(row["timestamp"]).strftime("%Y-%m-%d %H:%M:%S") if row["timestamp"] else "?"
+            batch_str = str(row["batch"]) if (row["batch"] is not None) else "?"
+            message = (row["message"] or "")[:60]
+            print(f"{row['name']:<40} {row['model'] or '?':<24} {batch_str:>6} {row['nbytes']:>12}  {time_str:<19}  {message}")
+        self._print_page_footer(total, options)
+
+    def do_gc_dumps(self, arg):
+        """Delete the blobs of dedup mode dumps that no dump references. Usage: gc_dumps [min_age=<minutes>] [dry_run=true]
+
+        Without dump_quota_mb, a dedup mode server never deletes blobs, so the tensor chunks of
+        deleted dumps stay in <dump dir>/blobs until collected. Blobs modified in the last min_age
+        minutes (default 10) are kept, as a running server may not have written their dump yet.
+        """
+        usage = "Usage: gc_dumps [min_age=<minutes>] [dry_run=true]"
+        options = {"min_age": "10", "dry_run": "false"}
+        try:
+            for token in shlex.split(arg):
+                key, sep, value = token.partition("=")
+                if not sep or key not in options:
+                    raise ValueError(f"Unknown option '{token}'")
+                options[key] = value
+            min_age = float(options["min_age"]) * 60
+        except ValueError as e:
+            print(f"✗ Invalid input: {e}")
+            print(usage)
+            return
+        dry_run = options["dry_run"].lower() == "true"
+
         if not os.path.isdir(self.dump_dir):
             print(f"✗ Dumps directory not found: {self.dump_dir}")
             return
-        
-        files = [f for f in os.listdir(self.dump_dir) if f.endswith('.pkl')]
-        
-        if not files:
-            print(f"No dump files found in {self.dump_dir}")
+
+        stats = collect_blobs(self.dump_dir, min_age=min_age, dry_run=dry_run)
+        if (stats["blobs"] == 0):
+            print(f"No blobs found in {self.dump_dir}")
             return
-        
-        print(f"✓ Dump files in {self.dump_dir}:")
-        for f in sorted(files):
-            filepath = os.path.join(self.dump_dir, f)
-            size = os.path.getsize(filepath)
-            print(f"  {f} ({size} bytes)")
+
+        verb = "Would remove" if dry_run else "Removed"
+        print(f"✓ {stats['dumps']} dump(s) reference {stats['referenced']} of {stats['blobs']} blob(s)")
+        print(f"✓ {verb} {stats['removed']} unreferenced blob(s), {stats['removed_nbytes'] / 1e6:.1f} MB")
+        if stats["recent"]:
+            print(f"  Kept {stats['recent']} unreferenced blob(s) younger than {options['min_age']} minute(s)")
+        if stats["unreadable"]:
+            print(f"  Skipped {stats['unreadable']} unreadable dump file(s)")
+        if stats["kept_nbytes"]:
+            ratio = stats["logical_nbytes"] / stats["kept_nbytes"]
+            print(f"  {stats['logical_nbytes'] / 1e6:.1f} MB of tensors stored in {stats['kept_nbytes'] / 1e6:.1f} MB of blobs ({ratio:.1f}x)")
+
+    def do_stats(self, arg):
+        """Summarize a model's execute() stage timing and request counters. Usage: stats <model_name> [url=<metrics_url>]
+
+        Stage timing is only exported by Python backend models with the stage_timing parameter
+        enabled. Metrics are read from Triton's metrics endpoint (default http://localhost:8002/metrics).
+        """
+        tokens = shlex.split(arg)
+        for token in [t for t in tokens if t.startswith("url=")]:
+            self.metrics_url = token[len("url="):]
+            tokens.remove(token)
+        if (len(tokens) != 1):
+            print("Usage: stats <model_name> [url=<metrics_url>]")
+            return
+        model_name = tokens[0]
+
+        try:
+            samples = parse_metrics(fetch_metrics(self.metrics_url))
+        except Exception as e:
+            print(f"✗ Could not fetch metrics from {self.metrics_url}: {e}")
+            return
+
+        stages = stage_summary(samples, model_name)
+        if stages:
+            calls = max(stage["count"] for stage in stages.values())
+            print(f"Stage timing for {model_name} ({calls} execute calls, ms per call, quantiles estimated from histogram buckets):")
+            print(f"  {'stage':<10} {'calls':>8} {'mean':>9} {'p50':>9} {'p90':>9} {'p99':>9}")
+            order = sorted(stages, key=lambda s: STAGE_ORDER.index(s) if s in STAGE_ORDER else len(STAGE_ORDER))
+            for name in order:
+                stage = stages[name]
+                print(f"  {name:<10} {stage['count']:>8} {stage['mean_ms']:>9.3f} {stage['p50_ms']:>9.3f} {stage['p90_ms']:>9.3f} {stage['p99_ms']:>9.3f}")
+        else:
+            print(f"No stage timing exported for {model_name} (enable the stage_timing model parameter).")
+
+        totals = {}
+        dump_outcomes = {}
+        for name, labels, value in model_counters(samples, model_name):
+            if (name == "replay_dump_records_total"):
+                dump_outcomes[labels.get("outcome", "?")] = value
+            else:
+                totals[name] = totals.get(name, 0.0) + value # summed over model versions
+
+        if totals:
+            requests = totals.get("nv_inference_request_success", 0) + totals.get("nv_inference_request_failure", 0)
+            execs = totals.get("nv_inference_exec_count", 0)
+            print(f"Triton counters for {model_name}:")
+            print(f"  Requests: {int(totals.get('nv_inference_request_success', 0))} ok, {int(totals.get('nv_inference_request_failure', 0))} failed, "
+                  f"{int(execs)} executions ({totals.get('nv_inference_count', 0) / execs if execs else 0:.1f} rows per execution)")
+            if (requests > 0):
+                for label, key in (("request", "nv_inference_request_duration_us"), ("queue", "nv_inference_queue_duration_us"),
+                                   ("compute input", "nv_inference_compute_input_duration_us"),
+                                   ("compute infer", "nv_inference_compute_infer_duration_us"),
+                                   ("compute output", "nv_inference_compute_output_duration_us")):
+                    if key in totals:
+                        print(f"  Mean {label} time: {totals[key] / requests / 1000:.3f} ms")
+        if dump_outcomes:
+            print("  Dumps: " + ", ".join(f"{outcome} {int(count)}" for outcome, count in sorted(dump_outcomes.items())))
 
     def do_get_models(self, arg):
         """Print model repository index from the Triton server."""
@@ -242,25 +777,91 @@ class TritonReplayREPL(cmd.Cmd):
                 server_live = self.client.is_server_live()
                 server_ready = self.client.is_server_ready()
                 print(f"  Triton server: Connected (live={server_live}, ready={server_ready})")
+                if (len(self.client) > 1):
+                    print(f"  Balancing: {self.client.policy}")
+                for url, sent, outstanding in self.client.endpoint_stats():
+                    print(f"    {url}: {sent} requests sent, {outstanding} outstanding")
             except Exception as e:
                 print(f"  Triton server: Connection error: {e}")
         else:
             print(f"  Triton server: Not connected")
+        print(f"  Transport: {'system shared memory' if self.shm_pool is not None else 'gRPC'}")
+        print(f"  Request timeout: {'none' if self.request_timeout is None else f'{self.request_timeout:g} s'}")
+        print(f"  Jobs: {len(self.jobs.running())} running, {len(self.jobs.all())} total")
         
         if self.last_request_id:
             print(f"  Last request ID: {self.last_request_id}")
         else:
             print("  No requests have been sent yet.")
     
+    def do_shm(self, arg):
+        """Send replay and request_random tensors through system shared memory. Usage: shm on|off|status
+
+        Only works with a Triton server on the same host. Regions are registered on first use,
+        reused across requests and grown as needed, and unregistered by "shm off", reconnect
+        and quit. Tensors that cannot use shared memory, and all requests if registering fails,
+        go over gRPC.
+        """
+        command = arg.strip().lower()
+        if (command == "on"):
+            if self.client is None:
+                print("✗ Not connected to Triton server.")
+                return
+            if self.shm_pool is None:
+                self.shm_pool = SharedMemoryPool(self.client)
+            print("✓ Sending tensors through system shared memory")
+        elif (command == "off"):
+            if self.shm_pool is not None:
+                self._cancel_jobs()
+                self.shm_pool.release()
+                self.shm_pool = None
+            print("✓ Sending tensors over gRPC")
+        elif (command in ("", "status")):
+            if self.shm_pool is None:
+                print("Transport: gRPC")
+                return
+            print(f"Transport: system shared memory, {len(self.shm_pool.regions)} region(s) registered")
+            for key, (name, _, byte_size) in sorted(self.shm_pool.regions.items()):
+                print(f"  {key}: {name} ({byte_size / 1e6:.2f} MB)")
+        else:
+            print("Usage: shm on|off|status")
+
     def do_reconnect(self, arg):
-        """Reconnect to the Triton server."""
+        """Reconnect to the Triton server(s). Usage: reconnect [<host:port> ...] [balance=round_robin|least_outstanding]
+
+        With several endpoints, requests are spread over them with the given balancing policy.
+        Without endpoints, reconnects to the current ones. Cached model configs are dropped.
+        """
+        usage = "Usage: reconnect [<host:port> ...] [balance=round_robin|least_outstanding]"
+        endpoints, balance = [], self.balance
+        for token in shlex.split(arg):
+            key, sep, value = token.partition("=")
+            if sep and (key == "balance"):
+                balance = value
+            else:
+                endpoints.extend(url for url in token.split(",") if url)
+
+        if balance not in BALANCE_POLICIES:
+            print(f"✗ Invalid input: unknown balancing policy '{balance}'")
+            print(usage)
+            return
+
+        self.endpoints = endpoints or self.endpoints
+        self.balance = balance
         self._connect_client()
     
     def do_quit(self, arg):
         """Quit the REPL."""
+        self._cancel_jobs()
+        if self.shm_pool is not None:
+            self.shm_pool.release()
+            self.shm_pool = None
         if self.client:
             self.client.close()
             self.client = None
+        if self.catalog is not None:
+            self.catalog.close()
+            self.catalog = None
         print("Goodbye!")
         return True
     
@@ -273,61 +874,256 @@ class TritonReplayREPL(cmd.Cmd):
         print()
         return self.do_quit(arg)
     
+    def preloop(self):
+        self.at_prompt = True
+
+    def precmd(self, line):
+        self.at_prompt = False
+        return line
+
+    def postcmd(self, stop, line):
+        self.at_prompt = not stop
+        return stop
+
     def emptyline(self):
         """Do nothing on empty input."""
         pass
 
     def _connect_client(self):
         """Connect to the Triton server."""
+        # Requests in flight and regions belong to the old connection, drop them before it goes away
+        self._cancel_jobs()
+        if self.shm_pool is not None:
+            self.shm_pool.release()
         if self.client:
             self.client.close()
             self.client = None
 
         try:
-            self.client = grpcclient.InferenceServerClient("localhost:8001")
-            print(f"✓ Connected to Triton server at localhost:8001")
+            self.client = ClientPool(self.endpoints, self.balance)
+            if (len(self.endpoints) == 1):
+                print(f"✓ Connected to Triton server at {self.endpoints[0]}")
+            else:
+                print(f"✓ Connected to {len(self.endpoints)} Triton servers ({self.balance}): {', '.join(self.endpoints)}")
         except Exception as e:
             print(f"✗ Failed to connect to Triton server: {e}")
             self.client = None
+
+        if self.shm_pool is not None:
+            self.shm_pool = SharedMemoryPool(self.client) if (self.client is not None) else None
     
-    def _send_inference(self, data, model_name, req_id=None):
-        """Send inference request to Triton with the loaded data."""
+    def _num_endpoints(self):
+        return len(self.client) if (self.client is not None) else 1
 
-        input_names, output_names = self._get_model_io(self.client.get_model_config(model_name))
+    def _send_inference(self, data, model_name, req_id=None, recorded=None, description=None, timeout=None):
+        """
+        Send an inference request with the loaded data as a job, without waiting for the response.
+        The outputs are reported, and compared to `recorded` if given, when the job finishes.
+        """
 
-        # Create Triton inputs for given data
-        inputs = []
-        for name in input_names:
-            tensor_data = data[name]
-            triton_dtype = tcutils.np_to_triton_dtype(tensor_data.dtype)
-            inputs.append(grpcclient.InferInput(name, tensor_data.shape, triton_dtype))
-            inputs[-1].set_data_from_numpy(tensor_data)
+        model_config = self.client.get_model_config(model_name)
+        input_names, output_names = get_model_io(model_config)
+
+        # Create Triton inputs for given data, in shared memory if enabled, in a slot of this request's own
+        shm_pool, slot = self.shm_pool, None
+        inputs, shm_handles = None, {}
+        if shm_pool is not None:
+            slot = shm_pool.acquire_slot()
+            try:
+                rows = int(data[input_names[0]].shape[0]) if input_names else 0
+                inputs = shm_pool.build_inputs(data, input_names, slot)
+                outputs, shm_handles = shm_pool.build_outputs(model_config, output_names, rows, slot)
+            except Exception as e:
+                print(f"✗ Shared memory transport failed, falling back to gRPC: {e}")
+                inputs, shm_handles = None, {}
 
-        outputs = [grpcclient.InferRequestedOutput(name) for name in output_names]
+        if inputs is None:
+            inputs = build_inputs(data, input_names)
+            outputs = [grpcclient.InferRequestedOutput(name) for name in output_names]
         
         if (req_id is None):
             req_id = str(uuid.uuid4())
         
-        print(f"✓ Sending inference request with id: {req_id}")
+        job = self.jobs.add(description or model_name, model_name, req_id, timeout)
+        callback = functools.partial(self._on_job_done, job, output_names, recorded, shm_pool, slot, shm_handles)
         try:
-            result = self.client.infer(model_name, inputs, outputs=outputs, request_id=req_id)
-            print(f"✓ Inference successful for request id: {req_id}")
-            for out in output_names:
-                output_data = result.as_numpy(out)
-                print(f"Output '{out}': shape={output_data.shape}, dtype={output_data.dtype}")
-        
+            job.context = self.client.async_infer(model_name, inputs, callback, outputs=outputs, request_id=req_id, client_timeout=timeout)
         except Exception as e:
+            if slot is not None:
+                shm_pool.release_slot(slot)
+            self.jobs.finish(job, error=e)
             print(f"✗ Inference failed for request id: {req_id} with error: {e}")
             traceback.print_exc()
-        
+            return req_id
+
+        limit = f", timeout {timeout:g} s" if timeout is not None else ""
+        print(f"✓ [{job.id}] Sent inference request with id: {req_id}{limit}")
         return req_id
 
-    def _get_model_io(self, model_config):
-        """Extract input and output names and dtypes from model config."""
-        input_names = [inp.name for inp in model_config.config.input]
-        output_names = [out.name for out in model_config.config.output]
-        return input_names, output_names
-    
+    def _on_job_done(self, job, output_names, recorded, shm_pool, slot, shm_handles, result, error):
+        """gRPC callback of a job: collect its report lines, free its shared-memory slot and print a notice."""
+        lines = []
+        try:
+            if error is None:
+                for out in output_names:
+                    output_data = shm_pool.read_output(result, out, shm_handles) if shm_handles else result.as_numpy(out)
+                    lines.append(f"Output '{out}': shape={output_data.shape}, dtype={output_data.dtype}")
+                    if recorded and (out in recorded):
+                        try:
+                            row_abs, _, row_outside, labels = compare_outputs(recorded[out], output_data)
+                            flips = int((labels[0] != labels[1]).sum()) if labels is not None else 0
+                            mark = "✓" if (not row_outside.any()) and (flips == 0) else "✗"
+                            lines.append(f"  {mark} vs recorded: max abs err {row_abs.max(initial=0.0):.3g}, "
+                                         f"{int(row_outside.sum())} rows outside tolerance, {flips} label flips")
+                        except ValueError as e:
+                            lines.append(f"  ✗ vs recorded: {e}")
+        except Exception as e:
+            error = e
+        finally:
+            if slot is not None:
+                shm_pool.release_slot(slot)
+
+        self.jobs.finish(job, error, lines)
+        self._notify([job.summary()] + [f"    {line}" for line in lines])
+
+    def _notify(self, lines):
+        """Print lines from a callback thread, redrawing the prompt and any half-typed command under them."""
+        with self.print_lock:
+            if self.at_prompt:
+                sys.stdout.write("\n")
+            sys.stdout.write("\n".join(lines) + "\n")
+            if self.at_prompt:
+                sys.stdout.write(self.prompt + (readline.get_line_buffer() if readline is not None else ""))
+            sys.stdout.flush()
+
+    def _cancel_jobs(self, timeout=5.0):
+        """Cancel running jobs and wait (up to `timeout` seconds) for their callbacks, before their connection or regions go away."""
+        running = self.jobs.running()
+        for job in running:
+            job.cancel()
+        deadline = time.perf_counter() + timeout
+        for job in running:
+            job.done.wait(max(0.0, deadline - time.perf_counter()))
+        if running:
+            print(f"✓ Cancelled {len(running)} running job(s)")
+
+    def _get_job(self, token):
+        """Look up a job by id, printing the problem and returning None if there is no such job."""
+        try:
+            job = self.jobs.get(int(token.strip("[]")))
+        except ValueError:
+            job = None
+        if job is None:
+            print(f"✗ No job '{token}'")
+        return job
+
+    def _pop_timeout(self, arg):
+        """Split a timeout=<s> option (or timeout=none) off command arguments, returning (other arguments, timeout)."""
+        tokens = shlex.split(arg or "")
+        timeout = self.request_timeout
+        rest = []
+        for token in tokens:
+            if token.startswith("timeout="):
+                value = token.partition("=")[2]
+                timeout = None if (value.lower() == "none") else float(value)
+                if (timeout is not None) and (timeout <= 0):
+                    raise ValueError("timeout must be positive")
+            else:
+                rest.append(token)
+        return shlex.join(rest), timeout
+
+    def _resolve_dump_path(self, name):
+        """
+        Find a dump by file name or request ID, returning (file path, offset of the record in the
+        file), or printing an error and returning None if there is no such dump.
+        """
+        location = resolve_dump(self.dump_dir, name, self.dump_log_index)
+        if location is None:
+            filepath = os.path.join(self.dump_dir, name)
+            if not filepath.endswith((DUMP_EXTENSION, LEGACY_EXTENSION)):
+                filepath += DUMP_EXTENSION
+            print(f"✗ File not found: {filepath}")
+        return location
+
+    def _parse_replay_args(self, arg, options, usage, need_client=True):
+        """
+        Split replay command arguments into key=value options (updating the given defaults) and a
+        dump selection, returning (options, locations), or None after printing the problem.
+        """
+        if need_client and (self.client is None):
+            print("✗ Not connected to Triton server. Cannot replay.")
+            return None
+
+        try:
+            selection = []
+            for token in shlex.split(arg):
+                key, sep, value = token.partition("=")
+                if sep and key in options:
+                    options[key] = value
+                else:
+                    selection.append(token)
+
+            if options["timeout"] is not None:
+                options["timeout"] = float(options["timeout"])
+
+            catalog = self._get_catalog() if any(any(op in t for op in "=~<>") for t in selection) else None
+            locations = select_dumps(self.dump_dir, selection, catalog=catalog, log_index=self.dump_log_index)
+        except ValueError as e:
+            print(f"✗ Invalid input: {e}")
+            print(usage)
+            return None
+
+        if not locations:
+            print("No dumps selected.")
+            return None
+        return options, locations
+
+    def _run_replay(self, replay, locations, options, **kwargs):
+        """
+        Run replay_dumps or replay_schedule over the locations, then print and save the summary.
+        Returns (results, summary), or None if the replay could not run.
+        """
+        try:
+            results, elapsed = replay(self.client, locations, timeout=options["timeout"], on_result=print_result, **kwargs)
+        except Exception as e:
+            print(f"✗ Error during bulk replay: {e}")
+            traceback.print_exc()
+            return None
+
+        summary = summarize(results, elapsed)
+        print_summary(summary)
+        if options["json"]:
+            write_report(options["json"], results, summary)
+            print(f"✓ Report written to {options['json']}")
+
+        if results and results[-1]["request_id"]:
+            self.last_request_id = results[-1]["request_id"]
+        return results, summary
+
+    def _get_catalog(self):
+        """Open the catalog for the current dumps directory if needed, and bring it up to date."""
+        if not os.path.isdir(self.dump_dir):
+            print(f"✗ Dumps directory not found: {self.dump_dir}")
+            return None
+
+        if self.catalog is None:
+            self.catalog = DumpCatalog(self.dump_dir)
+
+        added = self.catalog.refresh()
+        if (added > 0):
+            print(f"✓ Cataloged {added} new dump(s)")
+        return self.catalog
+
+    def _print_page_footer(self, total, options):
+        pages = (total + options["limit"] - 1) // options["limit"]
+        print(f"Page {options['page']} of {pages} ({total} dumps)")
+
+    def _describe_location(self, location):
+        filepath, offset = location
+        if (offset == 0):
+            return os.path.basename(filepath)
+        return f"{os.path.basename(filepath)} @ {offset}"
+
     def _parse_random_request_args(self, arg):
         """Parse request_random args into model name and {input_name: shape_tuple}."""
         if not arg or not arg.strip():
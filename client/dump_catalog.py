@@ -0,0 +1,294 @@
+import os
+import re
+import json
+import sqlite3
+import datetime
+
+import model_prep_path # puts model_prep/ on sys.path
+from dump_format import DUMP_EXTENSION, LEGACY_EXTENSION, SEGMENT_EXTENSION, INDEX_EXTENSION, load_dump_info
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dumps (
+    path TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    id TEXT,
+    model TEXT,
+    timestamp REAL,
+    message TEXT,
+    failed INTEGER,
+    batch INTEGER,
+    nbytes INTEGER,
+    PRIMARY KEY (path, offset)
+);
+CREATE TABLE IF NOT EXISTS tensors (
+    path TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    grp TEXT NOT NULL,
+    name TEXT NOT NULL,
+    shape TEXT,
+    dtype TEXT
+);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER,
+    size INTEGER,
+    consumed INTEGER
+);
+CREATE INDEX IF NOT EXISTS dumps_id ON dumps (id);
+CREATE INDEX IF NOT EXISTS dumps_model ON dumps (model);
+CREATE INDEX IF NOT EXISTS dumps_timestamp ON dumps (timestamp);
+CREATE INDEX IF NOT EXISTS dumps_batch ON dumps (batch);
+CREATE INDEX IF NOT EXISTS tensors_dump ON tensors (path, offset);
+"""
+
+# Query field -> (column, type)
+QUERY_FIELDS = {
+    "id": ("id", str),
+    "model": ("model", str),
+    "error": ("message", str),
+    "message": ("message", str),
+    "file": ("name", str),
+    "failed": ("failed", bool),
+    "batch": ("batch", int),
+    "size": ("nbytes", int),
+    "time": ("timestamp", "time"),
+    "dtype": (None, str), # matches if any input tensor has this dtype
+}
+
+QUERY_ORDERS = {"time": "timestamp", "id": "id", "model": "model", "batch": "batch", "size": "nbytes", "file": "name"}
+
+_CONDITION_PATTERN = re.compile(r"^([A-Za-z_]+)(!=|>=|<=|!~|=|~|>|<)(.*)$")
+
+def _parse_time(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+def parse_query(tokens):
+    """
+    Parse query tokens such as ['model=particlenet_AK4_PT', 'error~CUDA', 'batch>1000', 'limit=20']
+    into a list of (field, op, value) conditions and a dict of options (limit, page, order).
+    Operators are =, !=, ~ (contains), !~ (does not contain), >, >=, < and <=.
+    """
+    conditions = []
+    options = {"limit": 50, "page": 1, "order": "time"}
+
+    for token in tokens:
+        match = _CONDITION_PATTERN.match(token)
+        if match is None:
+            raise ValueError(f"Cannot parse condition '{token}', expected <field><op><value>")
+        field, op, value = match.groups()
+
+        if field in ("limit", "page"):
+            options[field] = int(value)
+            if (options[field] < 1):
+                raise ValueError(f"'{field}' must be positive")
+        elif (field == "order"):
+            if (value.lstrip("-") not in QUERY_ORDERS):
+                raise ValueError(f"Cannot order by '{value}', expected one of {sorted(QUERY_ORDERS)} (prefix with - for descending)")
+            options["order"] = value
+        elif field in QUERY_FIELDS:
+            conditions.append((field, op, value))
+        else:
+            raise ValueError(f"Unknown field '{field}', expected one of {sorted(QUERY_FIELDS)}")
+
+    return conditions, options
+
+class DumpCatalog:
+    """
+    SQLite catalog of the dumps in a directory: request id, model, timestamp, error message,
+    batch size, size on disk, and the shape and dtype of every tensor. Only dump headers are
+    read to fill it, and refresh() only looks at dump files and log indexes that changed since
+    the previous refresh, so queries over large dump directories stay fast.
+    """
+
+    def __init__(self, dump_dir, db_path=None):
+        self.dump_dir = dump_dir
+        if db_path is None:
+            db_path = self.default_db_path(dump_dir)
+        self.db_path = db_path
+
+        self.conn = sqlite3.connect(db_path)
+
+        # The catalog can always be rebuilt from the dumps, so durability is traded for speed. Keeping
+        # the journal in memory also means no journal files appear in (and touch the mtime of) the dump directory.
+        self.conn.execute("PRAGMA journal_mode=MEMORY")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.executescript(_SCHEMA)
+        # Catalogs written before log indexes were read up to the last complete entry lack this column
+        if "consumed" not in [row[1] for row in self.conn.execute("PRAGMA table_info(sources)")]:
+            self.conn.execute("ALTER TABLE sources ADD COLUMN consumed INTEGER")
+        self._dir_mtime_ns = None
+
+    @staticmethod
+    def default_db_path(dump_dir):
+        """Keep the catalog next to the dumps if possible, otherwise in the user's cache directory."""
+        if os.access(dump_dir, os.W_OK):
+            return os.path.join(dump_dir, ".dump_catalog.sqlite")
+
+        cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "sonic-inference-replay")
+        os.makedirs(cache_dir, exist_ok=True)
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", os.path.abspath(dump_dir))
+        return os.path.join(cache_dir, f"{safe_name}.sqlite")
+
+    def close(self):
+        self.conn.close()
+
+    def refresh(self):
+        """Bring the catalog up to date with the dump directory. Returns the number of records added."""
+        if not os.path.isdir(self.dump_dir):
+            return 0
+
+        known = {path: (mtime_ns, size, consumed) for path, mtime_ns, size, consumed in self.conn.execute("SELECT path, mtime_ns, size, consumed FROM sources")}
+        dir_mtime_ns = os.stat(self.dump_dir).st_mtime_ns
+        added = 0
+
+        with self.conn:
+            if (dir_mtime_ns != self._dir_mtime_ns):
+                # Files were added, removed or replaced, so the whole directory needs a look
+                seen = set()
+                for entry in os.scandir(self.dump_dir):
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.name.endswith((DUMP_EXTENSION, LEGACY_EXTENSION, INDEX_EXTENSION)):
+                        seen.add(entry.path)
+                        added += self._refresh_source(entry.path, entry.stat(), known.get(entry.path))
+
+                for path in set(known) - seen:
+                    self._forget_source(path)
+                self._dir_mtime_ns = dir_mtime_ns
+            else:
+                # Only log indexes can change without touching the directory
+                for path in known:
+                    if path.endswith(INDEX_EXTENSION) and os.path.isfile(path):
+                        added += self._refresh_source(path, os.stat(path), known[path])
+
+        return added
+
+    def query(self, conditions, limit=50, page=1, order="time"):
+        """
+        Return (rows, total) for the dumps matching all conditions from parse_query(). Each row is
+        a dict with the catalog columns; rows are paged by limit, starting from page 1.
+        """
+        where = []
+        params = []
+        for field, op, value in conditions:
+            clause, clause_params = self._condition_sql(field, op, value)
+            where.append(clause)
+            params += clause_params
+        where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
+        total = self.conn.execute(f"SELECT COUNT(*) FROM dumps {where_sql}", params).fetchone()[0]
+
+        direction = "DESC" if order.startswith("-") else "ASC"
+        order_sql = f"ORDER BY {QUERY_ORDERS[order.lstrip('-')]} {direction}, name ASC"
+        cursor = self.conn.execute(
+            f"SELECT path, offset, name, id, model, timestamp, message, failed, batch, nbytes FROM dumps {where_sql} {order_sql} LIMIT ? OFFSET ?",
+            params + [limit, (page - 1) * limit]
+        )
+        columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor], total
+
+    def tensors(self, path, offset):
+        """Return [(group, name, shape, dtype)] for the tensors of one cataloged dump."""
+        rows = self.conn.execute("SELECT grp, name, shape, dtype FROM tensors WHERE path = ? AND offset = ?", (path, offset))
+        return [(grp, name, tuple(json.loads(shape)), dtype) for grp, name, shape, dtype in rows]
+
+    def lookup(self, req_id):
+        """Return (path, offset) of the latest dump with the given request id, or None."""
+        row = self.conn.execute("SELECT path, offset FROM dumps WHERE id = ? ORDER BY timestamp DESC LIMIT 1", (req_id,)).fetchone()
+        return tuple(row) if row else None
+
+    def _condition_sql(self, field, op, value):
+        column, kind = QUERY_FIELDS[field]
+
+        if (field == "dtype"):
+            negate = "NOT " if op.startswith("!") else ""
+            return (f"{negate}EXISTS (SELECT 1 FROM tensors t WHERE t.path = dumps.path AND t.offset = dumps.offset AND t.dtype = ?)", [value])
+
+        if (kind == bool):
+            value = 1 if value.lower() in ("1", "true", "yes") else 0
+        elif (kind == int):
+            value = int(value)
+        elif (kind == "time"):
+            value = _parse_time(value)
+
+        if (op == "~"):
+            return f"{column} LIKE ?", [f"%{value}%"]
+        elif (op == "!~"):
+            return f"{column} NOT LIKE ?", [f"%{value}%"]
+        return f"{column} {op} ?", [value]
+
+    def _refresh_source(self, path, st, known):
+        if known and (known[:2] == (st.st_mtime_ns, st.st_size)):
+            return 0
+
+        if path.endswith(INDEX_EXTENSION):
+            added, consumed = self._refresh_log_index(path, known)
+        else:
+            self._forget_source(path)
+            added = self._add_dump(path, 0, st.st_size, st.st_mtime)
+            consumed = st.st_size
+
+        self.conn.execute(
+            "INSERT OR REPLACE INTO sources (path, mtime_ns, size, consumed) VALUES (?, ?, ?, ?)",
+            (path, st.st_mtime_ns, st.st_size, consumed)
+        )
+        return added
+
+    def _refresh_log_index(self, idx_path, known):
+        """
+        Catalog the entries appended to a log index since it was last seen. Returns the number of
+        entries added and the offset just past the last complete entry, which is where the next
+        refresh resumes: the server may be halfway through writing the entry after it.
+        """
+        seg_path = idx_path[:-len(INDEX_EXTENSION)] + SEGMENT_EXTENSION
+        consumed = (known[2] or 0) if known else 0
+        added = 0
+
+        with open(idx_path, "rb") as f:
+            f.seek(consumed)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                _, offset, length = line.decode("utf-8").rstrip("\n").split("\t")[:3]
+                added += self._add_dump(seg_path, int(offset), int(length), None)
+                consumed += len(line)
+        return added, consumed
+
+    def _add_dump(self, path, offset, nbytes, mtime):
+        try:
+            info = load_dump_info(path, offset)
+        except Exception:
+            return 0 # unreadable or partially written, skip it
+
+        tensors = info.get("tensors", {})
+        inputs = tensors.get("inputs", {})
+        first_shape = next(iter(inputs.values()))[0] if inputs else ()
+        timestamp = info.get("timestamp", mtime)
+        message = info.get("message", "none")
+
+        name = os.path.basename(path) if (offset == 0) and not path.endswith(SEGMENT_EXTENSION) else f"{os.path.basename(path)}@{offset}"
+        self.conn.execute(
+            "INSERT OR REPLACE INTO dumps (path, offset, name, id, model, timestamp, message, failed, batch, nbytes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, offset, name, info.get("id"), info.get("model"), timestamp, message, int(message != "none"), first_shape[0] if first_shape else None, nbytes)
+        )
+        self.conn.execute("DELETE FROM tensors WHERE path = ? AND offset = ?", (path, offset))
+        self.conn.executemany(
+            "INSERT INTO tensors (path, offset, grp, name, shape, dtype) VALUES (?, ?, ?, ?, ?, ?)",
+            [(path, offset, grp, tname, json.dumps([int(d) for d in shape]), str(dtype))
+             for grp, group_tensors in tensors.items() for tname, (shape, dtype) in group_tensors.items()]
+        )
+        return 1
+
+    def _forget_source(self, path):
+        paths = [path]
+        if path.endswith(INDEX_EXTENSION):
+            paths.append(path[:-len(INDEX_EXTENSION)] + SEGMENT_EXTENSION)
+
+        for p in paths:
+            self.conn.execute("DELETE FROM dumps WHERE path = ?", (p,))
+            self.conn.execute("DELETE FROM tensors WHERE path = ?", (p,))
+        self.conn.execute("DELETE FROM sources WHERE path = ?", (path,))
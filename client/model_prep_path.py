@@ -0,0 +1,13 @@
+"""
+Makes the modules in model_prep/ that the client tools share with the server-side model code
+(the dump format, dump stores and model config helpers) importable. Client modules import this
+before any of them, so they work whether run as scripts or imported from elsewhere.
+"""
+
+import os
+import sys
+
+MODEL_PREP_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model_prep"))
+
+if MODEL_PREP_DIR not in sys.path:
+    sys.path.insert(0, MODEL_PREP_DIR)
@@ -0,0 +1,264 @@
+"""
+Offline replay of dumps without a Triton server.
+
+Usage:
+    python client/offline_engine.py [--model-repository DIR] [--config-name dump_always] [--backend auto|torch|onnx]
+                                    [--workers N] [--threads-per-worker 1] [--diff] [--json report.json]
+                                    [--dump-dir DIR] <selection> [<selection> ...]
+
+Dumps are replayed on the CPU against the same model.pt / model.onnx the Python backend models
+in model_prep/ load, found in the local model repository (single_sonic_model/models by
+default). Dumps are fanned out over a pool of worker processes, each holding its own copy of
+the model, with one intra-op thread per worker by default so the pool uses every core without
+oversubscribing them. Selections work as in bulk_replay.py, and with --diff the outputs are
+compared against the recorded ones as in replay_diff.py. This backs the REPL's replay_offline
+command.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+import concurrent.futures
+import numpy as np
+from google.protobuf import text_format
+from tritonclient.grpc import model_config_pb2
+from tritonclient import utils as tcutils
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+try:
+    import onnxruntime as rt
+except ImportError:
+    rt = None
+
+import model_prep_path # puts model_prep/ on sys.path
+from dump_format import DumpLogIndex, load_dump
+from bulk_replay import print_result, print_summary, select_dumps, summarize, write_report
+from replay_diff import MODEL_REPOSITORY, ReplayDiff, load_labels, print_diff_report
+
+MODEL_FILES = {"torch": "model.pt", "onnx": "model.onnx"}
+
+def load_model_config(model_dir, config_name=None):
+    """Parse a model's config.pbtxt (or configs/<config_name>.pbtxt) into a ModelConfig message."""
+    if config_name:
+        path = os.path.join(model_dir, "configs", f"{config_name}.pbtxt")
+    else:
+        path = os.path.join(model_dir, "config.pbtxt")
+    with open(path) as f:
+        return text_format.Parse(f.read(), model_config_pb2.ModelConfig())
+
+def find_model_file(model_dir, backend="auto"):
+    """
+    Return (backend, path) of the model file in the latest version directory that has one.
+    With backend "auto", model.pt is preferred over model.onnx.
+    """
+    backends = ["torch", "onnx"] if (backend == "auto") else [backend]
+    versions = sorted((int(d) for d in os.listdir(model_dir) if d.isdigit()), reverse=True)
+    for version in versions:
+        for name in backends:
+            path = os.path.join(model_dir, str(version), MODEL_FILES[name])
+            if os.path.isfile(path):
+                return name, path
+    raise FileNotFoundError(f"No {' or '.join(MODEL_FILES[b] for b in backends)} found in {model_dir}")
+
+def model_labels(model_repository, model_name, config_name=None):
+    """Labels of the model's first output with a label_filename, or None."""
+    model_dir = os.path.join(model_repository, model_name)
+    for out in load_model_config(model_dir, config_name).output:
+        if out.label_filename:
+            path = os.path.join(model_dir, out.label_filename)
+            return load_labels(path) if os.path.isfile(path) else None
+    return None
+
+class LocalModel:
+    """
+    A model from the local model repository, loaded for CPU inference the same way the Python
+    backend models load it: TorchScript through torch.jit, ONNX through an onnxruntime session.
+    """
+
+    def __init__(self, model_repository, model_name, config_name=None, backend="auto", threads=1):
+        model_dir = os.path.join(model_repository, model_name)
+        config = load_model_config(model_dir, config_name)
+        self.name = model_name
+        self.backend, self.model_path = find_model_file(model_dir, backend)
+
+        output_dtypes = {
+            out.name: tcutils.triton_to_np_dtype(model_config_pb2.DataType.Name(out.data_type)[len("TYPE_"):])
+            for out in config.output
+        }
+
+        if (self.backend == "torch"):
+            if torch is None:
+                raise ImportError("Offline replay of TorchScript models requires the 'torch' package")
+            torch.set_num_threads(threads)
+            self.model = torch.jit.load(self.model_path, map_location="cpu")
+            self.model.eval()
+
+            # Same "__<number>" ordering convention as model_prep/torch_model.py
+            self.input_names = sorted((inp.name for inp in config.input), key=lambda name: int(name.split("__")[-1]))
+            self.output_names = sorted((out.name for out in config.output), key=lambda name: int(name.split("__")[-1]))
+        else:
+            if rt is None:
+                raise ImportError("Offline replay of ONNX models requires the 'onnxruntime' package")
+            sess_options = rt.SessionOptions()
+            sess_options.intra_op_num_threads = threads
+            sess_options.inter_op_num_threads = 1
+            sess_options.graph_optimization_level = rt.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self.sess = rt.InferenceSession(self.model_path, sess_options=sess_options, providers=["CPUExecutionProvider"])
+            self.input_names = [inp.name for inp in self.sess.get_inputs()]
+            self.output_names = [out.name for out in self.sess.get_outputs()]
+
+        self.output_dtypes = [output_dtypes.get(name, np.float32) for name in self.output_names]
+
+    def infer(self, inputs):
+        """Run one forward pass on a dict of numpy inputs, returning a dict of numpy outputs."""
+        if (self.backend == "torch"):
+            with torch.no_grad():
+                # Dump tensors are read-only memory maps, torch needs its own writable copies
+                output_tensors = self.model(*[torch.from_numpy(np.array(inputs[name])) for name in self.input_names])
+            if (len(self.output_names) == 1):
+                output_tensors = (output_tensors,)
+            outputs = [tensor.numpy() for tensor in output_tensors]
+        else:
+            outputs = self.sess.run(self.output_names, {name: np.asarray(inputs[name]) for name in self.input_names})
+
+        return {name: outputs[idx].astype(self.output_dtypes[idx]) for idx, name in enumerate(self.output_names)}
+
+class OfflineResponse:
+    """Stands in for a Triton InferResult, so replay_diff.ReplayDiff can check offline outputs."""
+
+    def __init__(self, outputs):
+        self.outputs = outputs
+
+    def as_numpy(self, name):
+        return self.outputs.get(name)
+
+# Per-process worker state, set up by _init_worker
+_worker = {}
+
+def _init_worker(model_repository, config_name, backend, threads):
+    _worker.update(model_repository=model_repository, config_name=config_name, backend=backend, threads=threads, models={})
+
+def _replay_in_worker(path, offset, return_outputs):
+    result = {"dump": path if (offset == 0) else f"{path}@{offset}", "dump_id": None, "request_id": None,
+              "model": None, "rows": 0, "status": None, "error": None, "latency": None}
+    outputs = None
+    try:
+        dump = load_dump(path, offset)
+        model_name = dump["model"]
+        result["dump_id"] = dump.get("id")
+        result["model"] = model_name
+
+        # Models are loaded on first use, so every worker holds one copy of each model it has seen
+        if model_name not in _worker["models"]:
+            _worker["models"][model_name] = LocalModel(_worker["model_repository"], model_name, _worker["config_name"],
+                                                       _worker["backend"], _worker["threads"])
+        model = _worker["models"][model_name]
+        result["rows"] = int(dump["inputs"][model.input_names[0]].shape[0]) if model.input_names else 0
+
+        start = time.perf_counter()
+        try:
+            outputs = model.infer(dump["inputs"])
+            result["status"] = "ok"
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = f"Error during inference: {e}"
+        result["latency"] = time.perf_counter() - start
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"Could not load dump or model: {e}"
+
+    return result, (outputs if return_outputs else None)
+
+def replay_offline(locations, model_repository=MODEL_REPOSITORY, config_name=None, backend="auto",
+                   workers=None, threads_per_worker=1, on_result=None, on_response=None):
+    """
+    Replay dumps in-process on a pool of `workers` processes (default: one per core), each with
+    its own copy of the model. Returns the per-dump result dicts (in the order of locations, with
+    the same fields as bulk_replay.replay_dumps) and the wall time in seconds. on_result and
+    on_response work as for replay_dumps(); on_response gets an OfflineResponse.
+    """
+    results = [None] * len(locations)
+    workers = workers or os.cpu_count()
+
+    # Spawned workers do not inherit the parent's torch/onnxruntime thread pools
+    context = multiprocessing.get_context("spawn")
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                                initargs=(model_repository, config_name, backend, threads_per_worker)) as pool:
+        futures = {
+            pool.submit(_replay_in_worker, path, offset, on_response is not None): idx
+            for idx, (path, offset) in enumerate(locations)
+        }
+        for future in concurrent.futures.as_completed(futures):
+            idx = futures[future]
+            result, outputs = future.result()
+
+            if (result["status"] == "ok") and (on_response is not None):
+                try:
+                    on_response(result, load_dump(*locations[idx]), OfflineResponse(outputs))
+                except Exception as e:
+                    result["status"] = "error"
+                    result["error"] = f"Could not check response: {e}"
+
+            results[idx] = result
+            if on_result is not None:
+                on_result(result)
+
+    return results, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay dumps in-process on the CPU, without a Triton server.")
+    parser.add_argument("selection", nargs="+", help="Glob, request ids/file names, or catalog conditions")
+    parser.add_argument("--dump-dir", default=os.path.join(os.path.dirname(__file__), "..", "replay_dumps"), help="Directory holding the dumps")
+    parser.add_argument("--model-repository", default=MODEL_REPOSITORY, help="Triton model repository holding the models")
+    parser.add_argument("--config-name", default=None, help="Use configs/<name>.pbtxt instead of config.pbtxt")
+    parser.add_argument("--backend", choices=["auto", "torch", "onnx"], default="auto", help="Model file to load (auto prefers model.pt)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per core)")
+    parser.add_argument("--threads-per-worker", type=int, default=1, help="Intra-op threads in each worker")
+    parser.add_argument("--diff", action="store_true", help="Compare outputs against the outputs recorded in the dumps")
+    parser.add_argument("--json", help="Write per-dump results and summary to this JSON file")
+    parser.add_argument("--quiet", action="store_true", help="Only print the summary")
+    args = parser.parse_args()
+
+    try:
+        locations = select_dumps(args.dump_dir, args.selection, log_index=DumpLogIndex(args.dump_dir))
+    except ValueError as e:
+        print(f"✗ {e}")
+        return 1
+    print(f"✓ Selected {len(locations)} dumps")
+
+    diff = ReplayDiff() if args.diff else None
+    results, elapsed = replay_offline(
+        locations, args.model_repository, args.config_name, args.backend, args.workers, args.threads_per_worker,
+        on_result=None if args.quiet else print_result, on_response=diff.add if diff is not None else None
+    )
+
+    summary = summarize(results, elapsed)
+    print_summary(summary)
+    if diff is not None:
+        models = {r["model"] for r in results if r["model"]}
+        if (len(models) == 1):
+            try:
+                diff.labels = model_labels(args.model_repository, models.pop(), args.config_name)
+            except Exception:
+                pass # labels are only cosmetic, report indices instead
+        print_diff_report(diff.report())
+
+    if args.json:
+        if diff is not None:
+            with open(args.json, "w") as f:
+                json.dump({"summary": summary, "diff": diff.report(), "results": results}, f, indent=2, default=float)
+        else:
+            write_report(args.json, results, summary)
+        print(f"✓ Report written to {args.json}")
+    return 0 if (summary["failed"] == 0) else 2
+
+if (__name__ == "__main__"):
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""
+Bookkeeping for requests the REPL has in flight.
+
+replay and request_random send their request with async_infer and return to the prompt at once.
+Each request becomes a job with a small integer id. The jobs, wait and cancel commands list jobs,
+block until one finishes, and cancel them. A job ends when the gRPC callback fires, with the
+error's status telling a timeout or a cancellation apart from other failures.
+"""
+
+import time
+import threading
+import collections
+
+JOB_STATES = ("running", "done", "failed", "timed out", "cancelled")
+
+# Status codes of tritonclient's InferenceServerException for the two ways a job can be cut short
+_ERROR_STATES = {"StatusCode.DEADLINE_EXCEEDED": "timed out", "StatusCode.CANCELLED": "cancelled"}
+
+class Job:
+    """One in-flight (or finished) request: what was sent, its state, and the report lines of its result."""
+
+    def __init__(self, job_id, description, model_name, request_id, timeout=None):
+        self.id = job_id
+        self.description = description
+        self.model_name = model_name
+        self.request_id = request_id
+        self.timeout = timeout
+        self.state = "running"
+        self.error = None
+        self.lines = []
+        self.started = time.perf_counter()
+        self.finished = None
+        self.context = None # CallContext returned by async_infer, used to cancel
+        self.done = threading.Event()
+
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    def cancel(self):
+        """Ask gRPC to cancel the request. Returns False if it has already finished."""
+        if self.done.is_set() or (self.context is None):
+            return False
+        self.context.cancel()
+        return True
+
+    def summary(self):
+        mark = {"running": "…", "done": "✓"}.get(self.state, "✗")
+        line = f"[{self.id}] {mark} {self.state} after {self.elapsed():.2f} s: {self.description} (request id {self.request_id})"
+        if self.error:
+            line += f"\n    {self.error}"
+        return line
+
+class JobTable:
+    """Jobs of a REPL session by id, safe to update from gRPC callback threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = collections.OrderedDict()
+        self.next_id = 1
+
+    def add(self, description, model_name, request_id, timeout=None):
+        with self.lock:
+            job = Job(self.next_id, description, model_name, request_id, timeout)
+            self.jobs[job.id] = job
+            self.next_id += 1
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def all(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def running(self):
+        return [job for job in self.all() if job.state == "running"]
+
+    def finish(self, job, error=None, lines=()):
+        """Record the outcome of a job, from its gRPC callback."""
+        with self.lock:
+            job.finished = time.perf_counter()
+            job.lines = list(lines)
+            if error is None:
+                job.state = "done"
+            else:
+                status = error.status() if callable(getattr(error, "status", None)) else None
+                job.state = _ERROR_STATES.get(status, "failed")
+                job.error = str(error)
+        job.done.set()
+
+    def clear(self):
+        """Forget finished jobs. Returns how many were removed."""
+        with self.lock:
+            finished = [job_id for job_id, job in self.jobs.items() if job.state != "running"]
+            for job_id in finished:
+                del self.jobs[job_id]
+        return len(finished)
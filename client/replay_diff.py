@@ -0,0 +1,245 @@
+"""
+Compare the outputs of replayed dumps against the outputs recorded in production.
+
+Usage:
+    python client/replay_diff.py [--url localhost:8001[,...]] [--balance POLICY] [--dump-dir DIR] [--concurrency 16]
+                                 [--atol 1e-5] [--rtol 1e-3] [--top 10] [--labels FILE] [--json diff.json] <selection> [...]
+
+Only dumps written with the server's dump_outputs parameter enabled hold recorded outputs. Every
+output is compared element-wise: the report gives the maximum absolute and relative error, the
+number of rows outside tolerance, argmax label flips for classifier outputs, and the worst rows.
+The same functions back the REPL's diff_replay command.
+
+Exits with 0 if every output is within tolerance, 2 if any output is not or any replayed request
+failed, and 1 if nothing could be compared.
+"""
+
+import os
+import sys
+import json
+import heapq
+import argparse
+import threading
+import collections
+import numpy as np
+
+import model_prep_path # puts model_prep/ on sys.path
+from dump_format import DumpLogIndex
+from bulk_replay import print_summary, replay_dumps, select_dumps, summarize
+from client_pool import BALANCE_POLICIES, ClientPool
+
+MODEL_REPOSITORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "single_sonic_model", "models")
+
+def load_labels(path):
+    """Read a Triton label file, one class label per line."""
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+def find_labels(client, model_name, model_repository=MODEL_REPOSITORY):
+    """
+    Look up the labels of the model's first output with a label_filename in its config, in the
+    local copy of the model repository. Returns None if the model has no labels or the file
+    cannot be found.
+    """
+    for out in client.get_model_config(model_name).config.output:
+        if out.label_filename:
+            path = os.path.join(model_repository, model_name, out.label_filename)
+            return load_labels(path) if os.path.isfile(path) else None
+    return None
+
+def compare_outputs(recorded, replayed, atol=1e-5, rtol=1e-3):
+    """
+    Compare one output tensor row by row. Returns the per-row maximum absolute and relative
+    errors, a per-row mask of rows with any element outside |replayed - recorded| <= atol +
+    rtol * |recorded|, and the recorded and replayed argmax labels for classifier outputs
+    (batch, classes), or None otherwise. A NaN on one side only counts as an infinite error.
+    """
+    recorded = np.asarray(recorded, dtype=np.float64)
+    replayed = np.asarray(replayed, dtype=np.float64)
+    if (recorded.shape != replayed.shape):
+        raise ValueError(f"shape changed from {recorded.shape} to {replayed.shape}")
+
+    rows = recorded.shape[0] if recorded.ndim > 0 else 1
+    recorded_rows = recorded.reshape(rows, -1)
+    replayed_rows = replayed.reshape(rows, -1)
+
+    both_nan = np.isnan(recorded_rows) & np.isnan(replayed_rows)
+    abs_err = np.where(both_nan, 0.0, np.abs(replayed_rows - recorded_rows))
+    abs_err = np.nan_to_num(abs_err, nan=np.inf)
+    magnitude = np.abs(np.nan_to_num(recorded_rows))
+    rel_err = abs_err / np.maximum(magnitude, 1e-12)
+
+    row_abs = abs_err.max(axis=1, initial=0.0)
+    row_rel = rel_err.max(axis=1, initial=0.0)
+    row_outside = (abs_err > atol + rtol * magnitude).any(axis=1)
+
+    labels = None
+    if (recorded.ndim == 2) and (recorded.shape[1] > 1):
+        labels = (recorded.argmax(axis=1), replayed.argmax(axis=1))
+    return row_abs, row_rel, row_outside, labels
+
+class ReplayDiff:
+    """
+    Accumulates the comparison of replayed against recorded outputs over many dumps. add() is
+    meant to be passed (through on_response) to replay_dumps() and is safe to call from the gRPC
+    callback threads.
+    """
+
+    def __init__(self, labels=None, atol=1e-5, rtol=1e-3, top=10):
+        self.labels = labels
+        self.atol = atol
+        self.rtol = rtol
+        self.top = top
+        self.lock = threading.Lock()
+        self.compared = 0
+        self.no_outputs = 0
+        self.outputs = {}
+        self.worst = [] # min-heap of the `top` worst rows
+
+    def add(self, result, dump, response):
+        recorded_outputs = dump.get("outputs")
+        if not recorded_outputs:
+            with self.lock:
+                self.no_outputs += 1
+            result["diff"] = None
+            return
+
+        diffs = {}
+        for name, recorded in recorded_outputs.items():
+            replayed = response.as_numpy(name)
+            if replayed is None:
+                raise ValueError(f"Output '{name}' missing from the response")
+            diffs[name] = compare_outputs(recorded, replayed, self.atol, self.rtol)
+
+        with self.lock:
+            self.compared += 1
+            result["diff"] = {}
+            for name, (row_abs, row_rel, row_outside, labels) in diffs.items():
+                stats = self.outputs.setdefault(name, {"rows": 0, "max_abs": 0.0, "max_rel": 0.0, "rows_outside_tol": 0,
+                                                       "flips": 0, "transitions": collections.Counter()})
+                stats["rows"] += len(row_abs)
+                stats["max_abs"] = max(stats["max_abs"], float(row_abs.max(initial=0.0)))
+                stats["max_rel"] = max(stats["max_rel"], float(row_rel.max(initial=0.0)))
+                stats["rows_outside_tol"] += int(row_outside.sum())
+
+                flips = np.zeros(len(row_abs), dtype=bool)
+                if labels is not None:
+                    flips = labels[0] != labels[1]
+                    stats["flips"] += int(flips.sum())
+                    stats["transitions"].update(zip(labels[0][flips].tolist(), labels[1][flips].tolist()))
+
+                result["diff"][name] = {"max_abs": float(row_abs.max(initial=0.0)), "flips": int(flips.sum())}
+
+                # Only rows that could make it into the worst list are looked at individually
+                candidates = np.argsort(row_abs)[::-1][:self.top]
+                for row in candidates:
+                    entry = {
+                        "dump": result["dump"], "dump_id": result["dump_id"], "output": name, "row": int(row),
+                        "max_abs": float(row_abs[row]), "max_rel": float(row_rel[row]),
+                        "recorded_label": int(labels[0][row]) if labels is not None else None,
+                        "replayed_label": int(labels[1][row]) if labels is not None else None,
+                    }
+                    item = (entry["max_abs"], id(entry), entry)
+                    if (len(self.worst) < self.top):
+                        heapq.heappush(self.worst, item)
+                    elif (item[0] > self.worst[0][0]):
+                        heapq.heapreplace(self.worst, item)
+                    else:
+                        break
+
+    def report(self):
+        """Return the accumulated comparison as a JSON-serializable dict."""
+        with self.lock:
+            outputs = {}
+            for name, stats in self.outputs.items():
+                outputs[name] = dict(stats, transitions=[
+                    {"from": self._label(a), "to": self._label(b), "count": count}
+                    for (a, b), count in stats["transitions"].most_common()
+                ])
+            return {
+                "compared": self.compared,
+                "no_recorded_outputs": self.no_outputs,
+                "atol": self.atol,
+                "rtol": self.rtol,
+                "outputs": outputs,
+                "worst_rows": [
+                    dict(entry, recorded_label=self._label(entry["recorded_label"]), replayed_label=self._label(entry["replayed_label"]))
+                    if entry["recorded_label"] is not None else dict(entry)
+                    for _, _, entry in sorted(self.worst, key=lambda item: -item[0])
+                ],
+            }
+
+    def _label(self, idx):
+        idx = int(idx)
+        if (self.labels is not None) and (idx < len(self.labels)):
+            return self.labels[idx]
+        return str(idx)
+
+def print_diff_report(report):
+    print(f"Compared {report['compared']} dumps against their recorded outputs", end="")
+    if report["no_recorded_outputs"]:
+        print(f" ({report['no_recorded_outputs']} replayed dumps had no recorded outputs)", end="")
+    print()
+
+    for name, stats in report["outputs"].items():
+        outside = "✓" if (stats["rows_outside_tol"] == 0) and (stats["flips"] == 0) else "✗"
+        print(f"  {outside} {name}: {stats['rows']} rows, max abs err {stats['max_abs']:.3g}, max rel err {stats['max_rel']:.3g}, "
+              f"{stats['rows_outside_tol']} rows outside atol={report['atol']:g} rtol={report['rtol']:g}, {stats['flips']} label flips")
+        for transition in stats["transitions"][:5]:
+            print(f"      {transition['from']} -> {transition['to']}: {transition['count']}")
+
+    if report["worst_rows"]:
+        print("  Worst rows:")
+        for entry in report["worst_rows"]:
+            labels = f", label {entry['recorded_label']} -> {entry['replayed_label']}" if entry["recorded_label"] is not None else ""
+            print(f"    {entry['dump']} (id {entry['dump_id']}) {entry['output']}[{entry['row']}]: "
+                  f"abs err {entry['max_abs']:.3g}, rel err {entry['max_rel']:.3g}{labels}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay dumps and compare the outputs against the recorded ones.")
+    parser.add_argument("selection", nargs="+", help="Glob, request ids/file names, or catalog conditions")
+    parser.add_argument("--url", default="localhost:8001", help="Triton gRPC endpoint, or comma-separated endpoints to spread requests over")
+    parser.add_argument("--balance", choices=BALANCE_POLICIES, default="round_robin", help="How requests are spread over several endpoints")
+    parser.add_argument("--dump-dir", default=os.path.join(os.path.dirname(__file__), "..", "replay_dumps"), help="Directory holding the dumps")
+    parser.add_argument("--concurrency", type=int, default=None, help="Maximum requests in flight (default: 8 per endpoint)")
+    parser.add_argument("--atol", type=float, default=1e-5, help="Absolute tolerance")
+    parser.add_argument("--rtol", type=float, default=1e-3, help="Relative tolerance")
+    parser.add_argument("--top", type=int, default=10, help="Number of worst rows to report")
+    parser.add_argument("--labels", help="Label file (default: label_filename of the model config, looked up in the local model repository)")
+    parser.add_argument("--json", help="Write the comparison report to this JSON file")
+    args = parser.parse_args()
+
+    try:
+        locations = select_dumps(args.dump_dir, args.selection, log_index=DumpLogIndex(args.dump_dir))
+    except ValueError as e:
+        print(f"✗ {e}")
+        return 1
+    print(f"✓ Selected {len(locations)} dumps")
+
+    urls = [url for url in args.url.split(",") if url]
+    concurrency = args.concurrency or 8 * len(urls)
+    with ClientPool(urls, args.balance) as client:
+        labels = load_labels(args.labels) if args.labels else None
+        diff = ReplayDiff(labels=labels, atol=args.atol, rtol=args.rtol, top=args.top)
+        results, elapsed = replay_dumps(client, locations, concurrency=concurrency, on_response=diff.add)
+        if (labels is None) and diff.outputs:
+            models = {r["model"] for r in results if r["model"]}
+            diff.labels = find_labels(client, models.pop()) if len(models) == 1 else None
+
+    summary = summarize(results, elapsed)
+    print_summary(summary)
+    report = diff.report()
+    print_diff_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"summary": summary, "diff": report}, f, indent=2, default=float)
+        print(f"✓ Report written to {args.json}")
+
+    if (report["compared"] == 0) or not report["outputs"]:
+        print("✗ No dumps were compared, were they written with dump_outputs enabled?")
+        return 1
+    clean = all(stats["rows_outside_tol"] == 0 and stats["flips"] == 0 for stats in report["outputs"].values())
+    return 0 if (clean and summary["failed"] == 0) else 2
+
+if (__name__ == "__main__"):
+    sys.exit(main())
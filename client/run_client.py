@@ -1,50 +1,265 @@
+"""
+Send requests with random inputs to a Triton server.
+
+Without --load, a single request is sent and its output printed:
+    python client/run_client.py [--batch-size 10] [--particles 100] [--sv-particles 10]
+
+With --load, the client becomes a load generator that sweeps over batch sizes and particle
+counts, running each point for a warmup period followed by a measured duration:
+    python client/run_client.py --load --batch-sizes 1,10,200 --particles 50,100 --concurrency 8 \\
+                                --warmup 5 --duration 30 --json results.json --csv results.csv
+
+Load is either closed loop (--concurrency workers, each sending its next request as soon as the
+previous one returns) or open loop (--rate requests per second, sent on schedule regardless of
+how long responses take). Inputs are drawn from a pool generated before each point, so
+client-side random number generation does not skew the measurements.
+
+With --profile (written by synthetic_corpus.py fit), inputs are drawn from the particle count
+and feature distributions of recorded traffic instead of fixed --particles counts of Gaussian
+noise, with masks that match the counts. Batch sizes still come from --batch-size(s).
+"""
+
+import csv
+import sys
+import json
+import time
 import uuid
+import argparse
+import threading
+import functools
 import numpy as np
 import tritonclient.grpc as grpcclient
+from tritonclient import utils as tcutils
+from synthetic_corpus import generate_requests, load_profile
+
+# Latency histogram bin edges in ms, log-spaced from 0.1 ms to 100 s
+HISTOGRAM_EDGES_MS = np.logspace(-1, 5, 61)
+
+def get_input_specs(client, model_name):
+    """Return [(name, dims without the batch axis, numpy dtype)] for the model's inputs, and the output names."""
+    metadata = client.get_model_metadata(model_name)
+    specs = [(inp.name, list(inp.shape)[1:], tcutils.triton_to_np_dtype(inp.datatype)) for inp in metadata.inputs]
+    return specs, [out.name for out in metadata.outputs]
+
+def input_shape(name, dims, batch_size, particles, sv_particles):
+    """
+    Fill in the variable (-1) dims of an input. Secondary vertex inputs ("sv_" prefix) use the
+    number of secondary vertices, all other inputs use the number of particles.
+    """
+    count = sv_particles if name.startswith("sv_") else particles
+    return [batch_size] + [count if (dim == -1) else dim for dim in dims]
+
+def make_input_pool(specs, batch_size, particles, sv_particles, pool_size, rng, profile=None):
+    """
+    Pre-generate pool_size sets of Triton inputs, ready to be sent. With a profile, inputs are
+    drawn from it and the particle counts are ignored.
+    """
+    if profile is not None:
+        drawn = generate_requests(profile, pool_size, rng, rows=batch_size)
+    pool = []
+    for _ in range(pool_size):
+        request = next(drawn) if profile is not None else None
+        inputs = []
+        for name, dims, dtype in specs:
+            if request is not None:
+                values = request[name].astype(dtype, copy=False)
+            else:
+                values = rng.standard_normal(input_shape(name, dims, batch_size, particles, sv_particles)).astype(dtype)
+            inputs.append(grpcclient.InferInput(name, list(values.shape), tcutils.np_to_triton_dtype(np.dtype(dtype))))
+            inputs[-1].set_data_from_numpy(values)
+        pool.append(inputs)
+    return pool
+
+def read_profile(path, specs):
+    """Load a traffic profile, checking that it has the inputs of the model."""
+    profile = load_profile(path)
+    missing = sorted({name for name, _, _ in specs} - set(profile["inputs"]))
+    if missing:
+        raise ValueError(f"Profile of '{profile['model']}' has no inputs {', '.join(missing)}")
+    return profile
+
+def run_closed_loop(url, model_name, pool, outputs, concurrency, warmup, duration):
+    """Each worker sends requests back to back. Returns [(send offset, latency, ok)] in seconds."""
+    records = []
+    start = time.perf_counter()
+    end = start + warmup + duration
+
+    def worker(worker_idx):
+        with grpcclient.InferenceServerClient(url) as client:
+            idx = worker_idx
+            while time.perf_counter() < end:
+                sent = time.perf_counter()
+                try:
+                    client.infer(model_name, pool[idx % len(pool)], outputs=outputs)
+                    ok = True
+                except Exception:
+                    ok = False
+                records.append((sent - start, time.perf_counter() - sent, ok))
+                idx += concurrency
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return records
+
+def run_open_loop(client, model_name, pool, outputs, rate, warmup, duration, max_outstanding):
+    """
+    Send requests at a fixed rate with async_infer. Requests that would exceed max_outstanding
+    in flight are skipped and recorded as failures, since the client can no longer keep the rate.
+    Returns [(send offset, latency, ok)] in seconds.
+    """
+    records = []
+    outstanding = threading.BoundedSemaphore(max_outstanding)
+    interval = 1.0 / rate
+    start = time.perf_counter()
+    end = start + warmup + duration
+
+    def callback(sent, result, error):
+        records.append((sent - start, time.perf_counter() - sent, error is None))
+        outstanding.release()
+
+    next_send = start
+    idx = 0
+    while next_send < end:
+        now = time.perf_counter()
+        if (now < next_send):
+            time.sleep(next_send - now)
+
+        sent = time.perf_counter()
+        if outstanding.acquire(blocking=False):
+            client.async_infer(model_name, pool[idx % len(pool)], functools.partial(callback, sent), outputs=outputs)
+        else:
+            records.append((sent - start, float("nan"), False))
+
+        idx += 1
+        next_send = start + idx * interval
+
+    # Wait for everything still in flight
+    for _ in range(max_outstanding):
+        outstanding.acquire()
+    return records
+
+def summarize_point(records, warmup, duration, batch_size):
+    """Turn the records of one sweep point into throughput, latency percentiles and a histogram."""
+    measured = [(latency, ok) for sent, latency, ok in records if sent >= warmup]
+    latencies_ms = np.array([latency * 1000 for latency, ok in measured if ok])
+    summary = {
+        "requests": len(measured),
+        "errors": sum(1 for _, ok in measured if not ok),
+        "throughput_rps": len(latencies_ms) / duration,
+        "throughput_rows_per_s": len(latencies_ms) * batch_size / duration,
+    }
+
+    if (latencies_ms.size > 0):
+        for p in (50, 90, 95, 99):
+            summary[f"latency_ms_p{p}"] = float(np.percentile(latencies_ms, p))
+        summary["latency_ms_mean"] = float(latencies_ms.mean())
+        summary["latency_ms_max"] = float(latencies_ms.max())
+
+    counts, _ = np.histogram(latencies_ms, bins=HISTOGRAM_EDGES_MS)
+    summary["histogram"] = {"edges_ms": HISTOGRAM_EDGES_MS.tolist(), "counts": counts.tolist()}
+    return summary
+
+def run_load(args):
+    rng = np.random.default_rng(args.seed)
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",")]
+    # Particle counts come from the profile when there is one, so there is nothing to sweep
+    particle_counts = [int(p) for p in args.particles.split(",")] if not args.profile else ["profile"]
+    results = []
+
+    with grpcclient.InferenceServerClient(args.url) as client:
+        specs, output_names = get_input_specs(client, args.model)
+        outputs = [grpcclient.InferRequestedOutput(name) for name in output_names]
+        profile = read_profile(args.profile, specs) if args.profile else None
+
+        for batch_size in batch_sizes:
+            for particles in particle_counts:
+                pool = make_input_pool(specs, batch_size, particles, args.sv_particles, args.pool_size, rng, profile)
+
+                if args.rate is not None:
+                    records = run_open_loop(client, args.model, pool, outputs, args.rate, args.warmup, args.duration, args.max_outstanding)
+                else:
+                    records = run_closed_loop(args.url, args.model, pool, outputs, args.concurrency, args.warmup, args.duration)
+
+                point = {
+                    "model": args.model,
+                    "batch_size": batch_size,
+                    "particles": particles,
+                    "sv_particles": args.sv_particles if profile is None else "profile",
+                    "mode": "open" if args.rate is not None else "closed",
+                    "concurrency": args.concurrency if args.rate is None else None,
+                    "rate": args.rate,
+                    "duration_s": args.duration,
+                }
+                point.update(summarize_point(records, args.warmup, args.duration, batch_size))
+                results.append(point)
+
+                p50 = point.get("latency_ms_p50", float("nan"))
+                p99 = point.get("latency_ms_p99", float("nan"))
+                print(f"batch {batch_size:>5}, particles {particles:>4}: {point['throughput_rps']:8.1f} req/s, "
+                      f"{point['throughput_rows_per_s']:10.1f} rows/s, p50 {p50:7.2f} ms, p99 {p99:7.2f} ms, "
+                      f"{point['errors']} errors")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+        print(f"✓ Results written to {args.json}")
+
+    if args.csv:
+        columns = [k for k in results[0] if k != "histogram"] if results else []
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(results)
+        print(f"✓ Results written to {args.csv}")
+
+def run_single(args):
+    with grpcclient.InferenceServerClient(args.url) as client:
+        specs, output_names = get_input_specs(client, args.model)
+        profile = read_profile(args.profile, specs) if args.profile else None
+        inputs = make_input_pool(specs, args.batch_size, int(args.particles.split(",")[0]), args.sv_particles, 1,
+                                 np.random.default_rng(args.seed), profile)[0]
+        outputs = [grpcclient.InferRequestedOutput(name) for name in output_names]
+
+        req_id = str(uuid.uuid4())
+        print(f"Sending request with id: {req_id}")
+
+        result = client.infer(args.model, inputs, outputs=outputs, request_id=req_id)
+
+    print("Got outputs:")
+    for name in output_names:
+        print(result.as_numpy(name))
+
+def main():
+    parser = argparse.ArgumentParser(description="Send random requests to a Triton server, or generate load.")
+    parser.add_argument("--url", default="localhost:8001", help="Triton gRPC endpoint")
+    parser.add_argument("--model", default="particlenet_AK4_PT", help="Model to send requests to")
+    parser.add_argument("--batch-size", type=int, default=10, help="Batch size of the single request")
+    parser.add_argument("--particles", default="100", help="Particle count(s) for the variable input dimension, comma-separated for a sweep")
+    parser.add_argument("--sv-particles", type=int, default=10, help="Secondary vertex count for sv_* inputs")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for the generated inputs")
+    parser.add_argument("--profile", default=None, help="Draw inputs from this traffic profile (see synthetic_corpus.py) instead of --particles")
+
+    load = parser.add_argument_group("load generation")
+    load.add_argument("--load", action="store_true", help="Run as a load generator instead of sending one request")
+    load.add_argument("--batch-sizes", default="1,10,200", help="Comma-separated batch sizes to sweep")
+    load.add_argument("--concurrency", type=int, default=1, help="Closed loop: number of concurrent workers")
+    load.add_argument("--rate", type=float, default=None, help="Open loop: target requests per second (overrides --concurrency)")
+    load.add_argument("--max-outstanding", type=int, default=256, help="Open loop: maximum requests in flight")
+    load.add_argument("--warmup", type=float, default=5.0, help="Seconds of unmeasured load before each sweep point")
+    load.add_argument("--duration", type=float, default=30.0, help="Seconds measured at each sweep point")
+    load.add_argument("--pool-size", type=int, default=16, help="Number of pre-generated input sets per sweep point")
+    load.add_argument("--json", help="Write results, including latency histograms, to this JSON file")
+    load.add_argument("--csv", help="Write summary results to this CSV file")
+    args = parser.parse_args()
+
+    if args.load:
+        run_load(args)
+    else:
+        run_single(args)
+    return 0
 
-batch_size = 10
-
-with grpcclient.InferenceServerClient("localhost:8001") as client:
-    # model_config = client.get_model_config("particlenet_AK4_PT")
-    # print(f"Config type: {type(model_config)}")
-    # print(model_config)
-    
-    # print("Model inputs:")
-    # print([inp.name for inp in model_config.config.input])
-    # print("\nModel outputs:")
-    # print([out.name for out in model_config.config.output])
-
-    inputs = [
-        grpcclient.InferInput("pf_points__0", [batch_size, 2, 100], "FP32"),
-        grpcclient.InferInput("pf_features__1", [batch_size, 20, 100], "FP32"),
-        grpcclient.InferInput("pf_mask__2", [batch_size, 1, 100], "FP32"),
-        grpcclient.InferInput("sv_points__3", [batch_size, 2, 10], "FP32"),
-        grpcclient.InferInput("sv_features__4", [batch_size, 11, 10], "FP32"),
-        grpcclient.InferInput("sv_mask__5", [batch_size, 1, 10], "FP32"),
-    ]
-
-    outputs = [grpcclient.InferRequestedOutput("softmax__0")]
-
-    pf_points = np.random.randn(batch_size, 2, 100).astype(np.float32)
-    pf_features = np.random.randn(batch_size, 20, 100).astype(np.float32)
-    pf_mask = np.random.randn(batch_size, 1, 100).astype(np.float32)
-    sv_points = np.random.randn(batch_size, 2, 10).astype(np.float32)
-    sv_features = np.random.randn(batch_size, 11, 10).astype(np.float32)
-    sv_mask = np.random.randn(batch_size, 1, 10).astype(np.float32)
-
-    inputs[0].set_data_from_numpy(pf_points)
-    inputs[1].set_data_from_numpy(pf_features)
-    inputs[2].set_data_from_numpy(pf_mask)
-    inputs[3].set_data_from_numpy(sv_points)
-    inputs[4].set_data_from_numpy(sv_features)
-    inputs[5].set_data_from_numpy(sv_mask)
-
-    req_id = str(uuid.uuid4())
-    print(f"Sending request with id: {req_id}")
-
-    result = client.infer("particlenet_AK4_PT", inputs, outputs=outputs, request_id=req_id)
-
-    output_data = result.as_numpy("softmax__0")
-
-print("Got outputs:")
-print(output_data)
+if (__name__ == "__main__"):
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""
+System shared-memory transport for sending requests to a Triton server on the same host.
+
+Instead of serializing tensors into the gRPC message, inputs are written to shared-memory
+regions registered with the server, and outputs are written back by the server into regions of
+their own, so a 5000-row dump crosses the process boundary without being copied into and out of
+protobuf messages. Regions are kept in a pool, one per input or output name and slot, and are
+reused across requests and grown when a larger request comes along. Every request in flight
+holds its own slot (acquire_slot() / release_slot()), so the REPL's concurrent jobs never write
+into each other's regions. Only the slot bookkeeping is thread-safe: regions are created and
+released from the REPL's thread, and callbacks only read outputs and give their slot back.
+"""
+
+import os
+import threading
+import numpy as np
+from tritonclient import grpc as grpcclient
+from tritonclient import utils as tcutils
+import tritonclient.utils.shared_memory as shm
+
+class SharedMemoryPool:
+    """
+    Registered system shared-memory regions of a client, keyed by tensor. Tensors that cannot go
+    through shared memory (BYTES tensors, empty tensors, and outputs whose size is not known from
+    the model config before the request) are sent over gRPC as usual.
+    """
+
+    def __init__(self, client, prefix=None):
+        self.client = client
+        self.prefix = prefix or f"triton_replay_{os.getpid()}"
+        self.regions = {} # key -> (region name, handle, byte size)
+        self.lock = threading.Lock()
+        self.busy_slots = set()
+
+    def region(self, key, byte_size):
+        """Return (region name, handle) of a registered region of at least byte_size bytes under key."""
+        entry = self.regions.get(key)
+        if (entry is not None) and (entry[2] >= byte_size):
+            return entry[0], entry[1]
+
+        # Grow by at least a quarter so slowly increasing requests do not re-register every time
+        if entry is not None:
+            byte_size = max(byte_size, int(1.25 * entry[2]))
+            self._release(key)
+
+        name = f"{self.prefix}_{key}"
+        handle = shm.create_shared_memory_region(name, f"/{name}", byte_size)
+        try:
+            self.client.register_system_shared_memory(name, f"/{name}", byte_size)
+        except Exception:
+            shm.destroy_shared_memory_region(handle)
+            raise
+        self.regions[key] = (name, handle, byte_size)
+        return name, handle
+
+    def acquire_slot(self):
+        """Reserve the lowest free slot for a request, so its regions are not reused until release_slot()."""
+        with self.lock:
+            slot = min(set(range(len(self.busy_slots) + 1)) - self.busy_slots)
+            self.busy_slots.add(slot)
+        return slot
+
+    def release_slot(self, slot):
+        with self.lock:
+            self.busy_slots.discard(slot)
+
+    def build_inputs(self, data, input_names, slot=0):
+        """Create Triton inputs for the given {input_name: array} data, placed in shared memory."""
+        inputs = []
+        for name in input_names:
+            tensor_data = np.ascontiguousarray(data[name])
+            triton_dtype = tcutils.np_to_triton_dtype(tensor_data.dtype)
+            inputs.append(grpcclient.InferInput(name, tensor_data.shape, triton_dtype))
+
+            if (triton_dtype == "BYTES") or (tensor_data.nbytes == 0):
+                inputs[-1].set_data_from_numpy(tensor_data)
+                continue
+            region_name, handle = self.region(f"{slot}_input_{name}", tensor_data.nbytes)
+            shm.set_shared_memory_region(handle, [tensor_data])
+            inputs[-1].set_shared_memory(region_name, tensor_data.nbytes)
+        return inputs
+
+    def build_outputs(self, model_config, output_names, rows, slot=0):
+        """
+        Create the requested outputs for a request of `rows` rows. Returns the outputs and
+        {output_name: handle} of those placed in shared memory, to be passed to read_output().
+        """
+        config = model_config.config
+        output_configs = {out.name: out for out in config.output}
+        outputs, handles = [], {}
+        for name in output_names:
+            outputs.append(grpcclient.InferRequestedOutput(name))
+
+            out = output_configs[name]
+            dims = ([rows] if config.max_batch_size > 0 else []) + list(out.dims)
+            triton_dtype = grpcclient.model_config_pb2.DataType.Name(out.data_type)[len("TYPE_"):]
+            if (triton_dtype == "STRING") or any(dim < 0 for dim in dims):
+                continue
+            byte_size = int(np.prod(dims)) * np.dtype(tcutils.triton_to_np_dtype(triton_dtype)).itemsize
+            if (byte_size == 0):
+                continue
+
+            region_name, handle = self.region(f"{slot}_output_{name}", byte_size)
+            outputs[-1].set_shared_memory(region_name, byte_size)
+            handles[name] = handle
+        return outputs, handles
+
+    def read_output(self, result, name, handles):
+        """Read an output of an InferResult, from shared memory if it was placed there."""
+        if name not in handles:
+            return result.as_numpy(name)
+        output = result.get_output(name)
+        contents = shm.get_contents_as_numpy(handles[name], tcutils.triton_to_np_dtype(output.datatype), list(output.shape))
+        # The region is overwritten by the next request in the same slot
+        return contents.copy()
+
+    def release(self):
+        """Unregister and destroy all regions. The pool can still be used afterwards."""
+        for key in list(self.regions):
+            self._release(key)
+
+    def _release(self, key):
+        name, handle, _ = self.regions.pop(key)
+        try:
+            self.client.unregister_system_shared_memory(name)
+        except Exception:
+            pass # the server may be gone already, the region is destroyed on our side regardless
+        shm.destroy_shared_memory_region(handle)
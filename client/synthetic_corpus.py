@@ -0,0 +1,318 @@
+"""
+Synthetic input corpora fitted to the statistics of production dumps.
+
+Usage:
+    python client/synthetic_corpus.py fit [--dump-dir DIR] [--model-repository DIR] [--max-dumps N]
+                                          --profile profile.json <selection> [<selection> ...]
+    python client/synthetic_corpus.py generate --profile profile.json --requests 10000 --out-dir DIR
+                                               [--rows N] [--log] [--seed 0]
+
+"fit" reads a selection of dumps (as in bulk_replay.py, e.g. model=particlenet_AK4_PT) and
+learns a profile of the traffic. The profile holds the batch size histogram and the histogram
+of per-row particle counts, taken jointly over the pf_ and sv_ groups so their correlation is
+kept. It also holds the padded length of each group's inputs, and the mean and standard
+deviation of every feature channel over the real (unmasked) entries. Inputs are grouped by the
+prefix of their name before the first "_", and each group's mask input gives the count of real
+entries in every row.
+
+"generate" draws requests from a profile, in vectorized chunks, and writes them as dumps that
+the replay tools read like any other. Masks hold ones for the real entries and zeros for the
+padding, consistent with the drawn counts, and padded features are zero as in production. With
+--log the dumps go to log segments instead of one file per request. The same generator backs
+the REPL's request_random profile=<file> and run_client.py --profile.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import numpy as np
+
+import model_prep_path # puts model_prep/ on sys.path
+from dump_format import DumpLogIndex, load_dump
+from replay_dump import FileDumpStore, LogDumpStore
+from bulk_replay import select_dumps
+from replay_diff import MODEL_REPOSITORY
+from offline_engine import load_model_config
+
+PROFILE_VERSION = 1
+
+# Requests drawn at once by generate_requests()
+CHUNK_REQUESTS = 64
+
+def input_group(name):
+    """Inputs sharing a variable-length axis share the prefix before the first "_" (pf_, sv_)."""
+    return name.split("_", 1)[0]
+
+def _histogram(values):
+    values, counts = np.unique(np.asarray(values), return_counts=True, axis=0)
+    return {"values": values.tolist(), "counts": counts.tolist()}
+
+def _variable_axes_from_config(model_repository, model_name):
+    """{input_name: [batched axes]} with -1 dims in the local model config, or None without one."""
+    try:
+        config = load_model_config(os.path.join(model_repository, model_name))
+    except OSError:
+        return None
+    return {inp.name: [axis + 1 for axis, dim in enumerate(inp.dims) if dim == -1] for inp in config.input}
+
+def fit_profile(locations, model_repository=MODEL_REPOSITORY):
+    """
+    Learn a traffic profile from the dumps at the given (path, offset) locations, which must all
+    be of the same model. Variable-length axes are taken from the model config in the local model
+    repository, or are the axes whose length differs between dumps if there is no config.
+    """
+    dumps = [load_dump(path, offset) for path, offset in locations]
+    if not dumps:
+        raise ValueError("No dumps to fit")
+    models = {dump["model"] for dump in dumps}
+    if (len(models) > 1):
+        raise ValueError(f"Dumps of several models selected ({', '.join(sorted(models))}), fit one model at a time")
+    model_name = models.pop()
+
+    input_names = list(dumps[0]["inputs"])
+    variable_axes = _variable_axes_from_config(model_repository, model_name)
+    if variable_axes is None:
+        variable_axes = {
+            name: [axis for axis in range(1, dumps[0]["inputs"][name].ndim)
+                   if len({dump["inputs"][name].shape[axis] for dump in dumps}) > 1]
+            for name in input_names
+        }
+
+    # Inputs with one variable-length axis are grouped, and the group's mask (if any) gives the counts
+    groups = {}
+    for name in input_names:
+        axes = variable_axes.get(name, [])
+        if (len(axes) > 1):
+            raise ValueError(f"Input '{name}' has several variable-length axes, which profiles do not support")
+        if axes:
+            group = groups.setdefault(input_group(name), {"inputs": [], "mask": None, "axis": axes[0]})
+            group["inputs"].append(name)
+            if ("mask" in name):
+                group["mask"] = name
+    group_names = sorted(groups)
+
+    batch_sizes, lengths, row_counts = [], {g: [] for g in group_names}, []
+    moments = {name: None for name in input_names}
+    for dump in dumps:
+        inputs = {name: np.asarray(dump["inputs"][name]) for name in input_names}
+        rows = inputs[input_names[0]].shape[0]
+        batch_sizes.append(rows)
+
+        # real[g] is a (rows, length) boolean array of the entries of group g that are not padding
+        real = {}
+        for g in group_names:
+            group = groups[g]
+            length = inputs[group["inputs"][0]].shape[group["axis"]]
+            lengths[g].append(length)
+            if group["mask"] is not None:
+                mask = np.moveaxis(inputs[group["mask"]], group["axis"], -1).reshape(rows, -1, length)
+                real[g] = (mask != 0).any(axis=1)
+            else:
+                real[g] = np.ones((rows, length), dtype=bool)
+        row_counts.append(np.stack([real[g].sum(axis=1) for g in group_names], axis=1) if group_names else np.zeros((rows, 0), int))
+
+        for name in input_names:
+            arr = inputs[name].astype(np.float64)
+            g = input_group(name)
+            if (g in groups) and (name in groups[g]["inputs"]):
+                if (name == groups[g]["mask"]):
+                    continue
+                # Channels are all axes but the batch and variable ones, weighted by the real entries
+                values = np.moveaxis(arr, groups[g]["axis"], -1).reshape(rows, -1, arr.shape[groups[g]["axis"]])
+                weights = real[g][:, None, :]
+                n = np.broadcast_to(weights, values.shape).sum(axis=(0, 2))
+                total = (values * weights).sum(axis=(0, 2))
+                total_sq = (values ** 2 * weights).sum(axis=(0, 2))
+            else:
+                values = arr.reshape(rows, -1)
+                n = np.full(values.shape[1], rows)
+                total = values.sum(axis=0)
+                total_sq = (values ** 2).sum(axis=0)
+            if moments[name] is None:
+                moments[name] = [n, total, total_sq]
+            else:
+                for acc, value in zip(moments[name], (n, total, total_sq)):
+                    acc += value
+
+    profile_inputs = {}
+    for name in input_names:
+        arr = dumps[0]["inputs"][name]
+        g = input_group(name)
+        grouped = (g in groups) and (name in groups[g]["inputs"])
+        entry = {
+            "dtype": np.dtype(arr.dtype).str,
+            "dims": [-1 if (grouped and axis == groups[g]["axis"]) else int(arr.shape[axis]) for axis in range(1, arr.ndim)],
+            "group": g if grouped else None,
+            "mask": grouped and (name == groups[g]["mask"]),
+        }
+        if moments[name] is not None:
+            n, total, total_sq = moments[name]
+            mean = total / np.maximum(n, 1)
+            entry["mean"] = mean.tolist()
+            entry["std"] = np.sqrt(np.maximum(total_sq / np.maximum(n, 1) - mean ** 2, 0.0)).tolist()
+        profile_inputs[name] = entry
+
+    return {
+        "version": PROFILE_VERSION,
+        "model": model_name,
+        "dumps": len(dumps),
+        "rows": int(sum(batch_sizes)),
+        "batch_sizes": _histogram(batch_sizes),
+        "groups": {g: {"inputs": groups[g]["inputs"], "mask": groups[g]["mask"], "axis": groups[g]["axis"],
+                       "lengths": _histogram(lengths[g])} for g in group_names},
+        "counts": dict(groups=group_names, **_histogram(np.concatenate(row_counts))),
+        "inputs": profile_inputs,
+    }
+
+def save_profile(path, profile):
+    with open(path, "w") as f:
+        json.dump(profile, f, indent=2)
+
+def load_profile(path):
+    with open(path) as f:
+        profile = json.load(f)
+    if (profile.get("version") != PROFILE_VERSION):
+        raise ValueError(f"Unsupported profile version {profile.get('version')} in {path}")
+    return profile
+
+def _sample(histogram, size, rng):
+    values = np.asarray(histogram["values"])
+    counts = np.asarray(histogram["counts"], dtype=np.float64)
+    return values[rng.choice(len(values), size=size, p=counts / counts.sum())]
+
+def generate_requests(profile, num_requests, rng, rows=None):
+    """
+    Yield num_requests {input_name: array} requests drawn from a profile. The number of rows of
+    each request is drawn from the batch size histogram unless `rows` is given. Requests are
+    drawn CHUNK_REQUESTS at a time, with one random draw per input for the whole chunk.
+    """
+    group_names = profile["counts"]["groups"]
+    for chunk_start in range(0, num_requests, CHUNK_REQUESTS):
+        num = min(CHUNK_REQUESTS, num_requests - chunk_start)
+        request_rows = np.full(num, rows) if rows is not None else _sample(profile["batch_sizes"], num, rng)
+        total_rows = int(request_rows.sum())
+        bounds = np.concatenate([[0], np.cumsum(request_rows)])
+
+        # Per-row counts are drawn jointly over the groups, padded lengths per request
+        counts = _sample(profile["counts"], total_rows, rng).reshape(total_rows, len(group_names))
+        lengths = {}
+        for g_idx, g in enumerate(group_names):
+            drawn = _sample(profile["groups"][g]["lengths"], num, rng)
+            longest = [counts[bounds[i]:bounds[i + 1], g_idx].max(initial=0) for i in range(num)]
+            lengths[g] = np.maximum(drawn, longest)
+
+        chunk = {}
+        real = {}
+        for g_idx, g in enumerate(group_names):
+            max_length = int(lengths[g].max(initial=0))
+            real[g] = np.arange(max_length)[None, :] < counts[:, g_idx][:, None]
+
+        for name, entry in profile["inputs"].items():
+            dtype = np.dtype(entry["dtype"])
+            g = entry["group"]
+            if g is None:
+                shape = (total_rows,) + tuple(entry["dims"])
+                flat = rng.standard_normal((total_rows, int(np.prod(entry["dims"], dtype=int))))
+                chunk[name] = (flat * np.asarray(entry["std"]) + np.asarray(entry["mean"])).reshape(shape).astype(dtype)
+                continue
+
+            # Lay the chunk out with the variable axis last, then move it back into place
+            max_length = real[g].shape[1]
+            channels = [dim for dim in entry["dims"] if dim != -1]
+            axis = profile["groups"][g]["axis"]
+            if entry["mask"]:
+                values = np.broadcast_to(real[g][:, None, :], (total_rows, int(np.prod(channels, dtype=int)), max_length))
+            else:
+                values = rng.standard_normal((total_rows, int(np.prod(channels, dtype=int)), max_length))
+                values = values * np.asarray(entry["std"])[None, :, None] + np.asarray(entry["mean"])[None, :, None]
+                values = values * real[g][:, None, :]
+            values = values.reshape((total_rows,) + tuple(channels) + (max_length,)).astype(dtype)
+            chunk[name] = np.moveaxis(values, -1, axis)
+
+        for i in range(num):
+            request = {}
+            for name, entry in profile["inputs"].items():
+                arr = chunk[name][bounds[i]:bounds[i + 1]]
+                g = entry["group"]
+                if g is not None:
+                    index = [slice(None)] * arr.ndim
+                    index[profile["groups"][g]["axis"]] = slice(0, int(lengths[g][i]))
+                    arr = arr[tuple(index)]
+                request[name] = np.ascontiguousarray(arr)
+            yield request
+
+def write_corpus(profile, out_dir, num_requests, rng, rows=None, log=False, on_progress=None):
+    """Write num_requests synthetic requests to out_dir as dumps. Returns the number of bytes written."""
+    os.makedirs(out_dir, exist_ok=True)
+    store = LogDumpStore(out_dir, f"synthetic-{os.getpid()}") if log else FileDumpStore(out_dir)
+    nbytes = 0
+    try:
+        for idx, inputs in enumerate(generate_requests(profile, num_requests, rng, rows)):
+            nbytes += store.write({
+                "id": f"synthetic-{uuid.uuid4()}",
+                "model": profile["model"],
+                "message": "none",
+                "timestamp": time.time(),
+                "synthetic": True,
+                "inputs": inputs,
+            })
+            if on_progress is not None:
+                on_progress(idx + 1)
+    finally:
+        store.close()
+    return nbytes
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit traffic profiles to dumps and generate synthetic corpora from them.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    fit = commands.add_parser("fit", help="Learn a profile from dumps")
+    fit.add_argument("selection", nargs="+", help="Glob, request ids/file names, or catalog conditions")
+    fit.add_argument("--dump-dir", default=os.path.join(os.path.dirname(__file__), "..", "replay_dumps"), help="Directory holding the dumps")
+    fit.add_argument("--model-repository", default=MODEL_REPOSITORY, help="Local model repository, for the variable-length axes")
+    fit.add_argument("--max-dumps", type=int, default=None, help="Fit on a random sample of at most this many dumps")
+    fit.add_argument("--seed", type=int, default=0, help="Random seed for the sample")
+    fit.add_argument("--profile", required=True, help="Write the profile to this JSON file")
+
+    generate = commands.add_parser("generate", help="Write synthetic dumps drawn from a profile")
+    generate.add_argument("--profile", required=True, help="Profile written by fit")
+    generate.add_argument("--requests", type=int, required=True, help="Number of requests to generate")
+    generate.add_argument("--rows", type=int, default=None, help="Rows per request (default: drawn from the profile)")
+    generate.add_argument("--out-dir", required=True, help="Directory to write the dumps to")
+    generate.add_argument("--log", action="store_true", help="Write log segments instead of one file per request")
+    generate.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    if (args.command == "fit"):
+        try:
+            locations = select_dumps(args.dump_dir, args.selection, log_index=DumpLogIndex(args.dump_dir))
+        except ValueError as e:
+            print(f"✗ {e}")
+            return 1
+        if (args.max_dumps is not None) and (len(locations) > args.max_dumps):
+            rng = np.random.default_rng(args.seed)
+            locations = [locations[i] for i in sorted(rng.choice(len(locations), size=args.max_dumps, replace=False))]
+
+        start = time.perf_counter()
+        try:
+            profile = fit_profile(locations, args.model_repository)
+        except ValueError as e:
+            print(f"✗ {e}")
+            return 1
+        save_profile(args.profile, profile)
+        print(f"✓ Fitted {profile['model']} on {profile['dumps']} dumps ({profile['rows']} rows) in {time.perf_counter() - start:.1f} s")
+        print(f"✓ Profile written to {args.profile}")
+        return 0
+
+    profile = load_profile(args.profile)
+    start = time.perf_counter()
+    nbytes = write_corpus(profile, args.out_dir, args.requests, np.random.default_rng(args.seed), args.rows, args.log)
+    elapsed = time.perf_counter() - start
+    print(f"✓ Wrote {args.requests} synthetic {profile['model']} requests ({nbytes / 1e6:.1f} MB) to {args.out_dir} in {elapsed:.1f} s")
+    return 0
+
+if (__name__ == "__main__"):
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""
+Fetch and summarize Triton's Prometheus metrics, including the per-stage execute() timing
+histograms exported by the Python backend models (see model_prep/stage_timing.py).
+"""
+
+import re
+import math
+import urllib.request
+
+DEFAULT_METRICS_URL = "http://localhost:8002/metrics"
+
+STAGE_METRIC_NAME = "replay_execute_stage_duration_ms"
+
+_SAMPLE_PATTERN = re.compile(r'^([A-Za-z_:][A-Za-z0-9_:]*)(?:\{(.*)\})?\s+(\S+)')
+_LABEL_PATTERN = re.compile(r'([A-Za-z_][A-Za-z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+def fetch_metrics(url=DEFAULT_METRICS_URL, timeout=5.0):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.read().decode("utf-8")
+
+def parse_metrics(text):
+    """Parse Prometheus text exposition into a list of (name, {label: value}, float value) samples."""
+    samples = []
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        match = _SAMPLE_PATTERN.match(line)
+        if match is None:
+            continue
+        name, labels, value = match.groups()
+        samples.append((name, dict(_LABEL_PATTERN.findall(labels or "")), float(value)))
+    return samples
+
+def _bucket_quantile(buckets, count, q):
+    """Estimate a quantile from cumulative (upper bound, count) buckets by linear interpolation."""
+    if (count == 0):
+        return math.nan
+    rank = q * count
+    lower, below = 0.0, 0.0
+    for bound, cumulative in buckets:
+        if (cumulative >= rank):
+            if math.isinf(bound):
+                return lower # past the last finite bucket, report its bound
+            in_bucket = cumulative - below
+            return lower + (bound - lower) * ((rank - below) / in_bucket if in_bucket > 0 else 0.0)
+        lower, below = bound, cumulative
+    return lower
+
+def stage_summary(samples, model_name):
+    """
+    Summarize the stage timing histograms of a model: {stage: {count, mean_ms, p50_ms, p90_ms,
+    p99_ms}}. Quantiles are estimated from the histogram buckets. Empty if the model does not
+    export stage timing.
+    """
+    stages = {}
+    for name, labels, value in samples:
+        if (labels.get("model") != model_name) or not name.startswith(STAGE_METRIC_NAME):
+            continue
+        stage = stages.setdefault(labels.get("stage", "?"), {"buckets": [], "sum": 0.0, "count": 0.0})
+        if name.endswith("_bucket"):
+            stage["buckets"].append((float(labels["le"]), value))
+        elif name.endswith("_sum"):
+            stage["sum"] = value
+        elif name.endswith("_count"):
+            stage["count"] = value
+
+    summary = {}
+    for stage, data in stages.items():
+        buckets = sorted(data["buckets"])
+        count = data["count"]
+        summary[stage] = {
+            "count": int(count),
+            "mean_ms": data["sum"] / count if count > 0 else math.nan,
+            "p50_ms": _bucket_quantile(buckets, count, 0.50),
+            "p90_ms": _bucket_quantile(buckets, count, 0.90),
+            "p99_ms": _bucket_quantile(buckets, count, 0.99),
+        }
+    return summary
+
+def model_counters(samples, model_name, prefixes=("nv_inference_", "replay_dump_records_total")):
+    """Return [(name, labels, value)] of the Triton inference and dump counters of a model."""
+    return [(name, labels, value) for name, labels, value in samples
+            if (labels.get("model") == model_name) and name.startswith(prefixes)]
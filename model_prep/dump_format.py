@@ -0,0 +1,556 @@
+"""
+Binary format for replay dumps, shared by the server-side dump writer and the client tools.
+
+A record is laid out as:
+
+    16-byte prefix:  magic (8 bytes), format version (uint32 LE), header length (uint32 LE)
+    header:          UTF-8 JSON with the scalar fields of the record (id, model, message, ...)
+                     and a "tensors" list giving group, name, dtype, shape, offset and nbytes
+    padding:         zeros up to the next multiple of ALIGNMENT
+    data section:    raw C-ordered tensor buffers, each starting at a multiple of ALIGNMENT
+
+Tensor offsets are relative to the start of the data section. Any field of the record that is
+a dict of numpy arrays (e.g. "inputs") is stored as a tensor group; everything else must be JSON
+serializable and is stored in the header. Reading a record maps the file with np.memmap, so
+tensors are paged in lazily instead of being copied, and no code is ever executed on load as it
+would be with pickle.
+
+Tensors may optionally be compressed with zstd or lz4, in which case their header entry also
+has "codec", "shuffle" and "raw_nbytes" fields and "nbytes" is the compressed size. Float
+tensors can be byte-shuffled before compression (all first bytes of each value, then all second
+bytes, ...), which usually compresses much better. Compressed tensors are decompressed on read.
+
+A tensor can also be stored outside the record, as fixed-size chunks in a content-addressed blob
+directory under "blobs/" next to the record (see BlobRef and write_blobs). Its header entry then
+has "chunks" (the blob keys, in order), "blob_dir" (relative to the record's directory),
+"chunk_nbytes" and "raw_nbytes" instead of data, and the record is written as format version 2.
+Identical chunks are stored once however many records reference them; collect_blobs deletes
+those no record references any more.
+"""
+
+import os
+import json
+import time
+import uuid
+import pickle
+import struct
+import hashlib
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+MAGIC = b"SONICDMP"
+FORMAT_VERSION = 2
+ALIGNMENT = 64
+DUMP_EXTENSION = ".dump"
+LEGACY_EXTENSION = ".pkl"
+SEGMENT_EXTENSION = ".seg"
+INDEX_EXTENSION = ".idx"
+BLOB_DIR = "blobs"
+BLOB_EXTENSION = ".blob"
+
+# Records without chunked tensors are still written as version 1, so older readers keep accepting them
+_INLINE_FORMAT_VERSION = 1
+
+_PREFIX = struct.Struct("<8sII")
+
+def _align(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def _byte_shuffle(raw, itemsize):
+    return raw.reshape(-1, itemsize).T.tobytes()
+
+def _byte_unshuffle(raw, itemsize):
+    return np.ascontiguousarray(raw.reshape(itemsize, -1).T).reshape(-1)
+
+class DumpCodec:
+    """
+    Compresses tensor buffers with zstd or lz4. Instances keep a compressor around and are not
+    thread-safe, so each writer thread should have its own.
+    """
+
+    DEFAULT_LEVELS = {"zstd": 3, "lz4": 0}
+
+    def __init__(self, name, level=None, shuffle=False):
+        if (name not in self.DEFAULT_LEVELS):
+            raise ValueError(f"Unknown dump compression codec '{name}', expected one of {sorted(self.DEFAULT_LEVELS)}")
+        if (name == "zstd") and (zstandard is None):
+            raise ImportError("zstd dump compression requires the 'zstandard' package")
+        if (name == "lz4") and (lz4 is None):
+            raise ImportError("lz4 dump compression requires the 'lz4' package")
+
+        self.name = name
+        self.level = level if (level is not None) else self.DEFAULT_LEVELS[name]
+        self.shuffle = shuffle
+        self._zstd_compressor = zstandard.ZstdCompressor(level=self.level) if (name == "zstd") else None
+
+    @classmethod
+    def from_string(cls, spec, shuffle=False):
+        """Parse a "<codec>[:<level>]" spec such as "zstd:3" or "lz4". Returns None for "none"."""
+        name, _, level = spec.lower().partition(":")
+        if (name in ("", "none")):
+            return None
+        return cls(name, int(level) if level else None, shuffle=shuffle)
+
+    def compress(self, arr):
+        """Compress a contiguous array, returning the payload and its header fields."""
+        raw = arr.reshape(-1).view(np.uint8)
+        shuffle = self.shuffle and (arr.dtype.kind == "f") and (arr.dtype.itemsize > 1)
+        data = _byte_shuffle(raw, arr.dtype.itemsize) if shuffle else raw
+
+        if (self.name == "zstd"):
+            payload = self._zstd_compressor.compress(data)
+        else:
+            payload = lz4.frame.compress(data, compression_level=self.level)
+
+        return payload, {"codec": self.name, "shuffle": shuffle, "raw_nbytes": arr.nbytes}
+
+def decompress_tensor(payload, entry):
+    """Decompress the stored bytes of a tensor, given its header entry, into a flat uint8 array."""
+    codec = entry["codec"]
+    if (codec == "zstd"):
+        if zstandard is None:
+            raise ImportError("Reading zstd-compressed dumps requires the 'zstandard' package")
+        raw = zstandard.ZstdDecompressor().decompress(payload, max_output_size=entry["raw_nbytes"])
+    elif (codec == "lz4"):
+        if lz4 is None:
+            raise ImportError("Reading lz4-compressed dumps requires the 'lz4' package")
+        raw = lz4.frame.decompress(payload)
+    else:
+        raise ValueError(f"Unknown codec '{codec}' in dump")
+
+    raw = np.frombuffer(raw, dtype=np.uint8)
+    if entry.get("shuffle", False):
+        raw = _byte_unshuffle(raw, np.dtype(entry["dtype"]).itemsize)
+    return raw
+
+def is_tensor_group(value):
+    """Whether a record field is stored as a tensor group: a non-empty dict of arrays (or BlobRefs)."""
+    return isinstance(value, dict) and bool(value) and all(isinstance(v, (np.ndarray, BlobRef)) for v in value.values())
+
+def blob_path(dump_dir, blob_dir, key):
+    """Path of the blob with the given key in blob_dir, relative to dump_dir."""
+    return os.path.join(dump_dir, blob_dir, key[:2], f"{key}{BLOB_EXTENSION}")
+
+class BlobRef:
+    """A tensor whose data is stored as chunks in a blob directory, to be written in its place."""
+
+    def __init__(self, dtype, shape, blob_dir, chunks, chunk_nbytes, codec_fields=None):
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        self.blob_dir = blob_dir
+        self.chunks = chunks
+        self.chunk_nbytes = chunk_nbytes
+        self.codec_fields = codec_fields or {}
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape, dtype=np.int64)) * self.dtype.itemsize
+
+def _write_blob(path, payload):
+    """Write a blob unless it exists, returning the number of bytes written."""
+    try:
+        # Refresh the mtime of a reused blob, so collect_blobs does not take it for an orphan
+        # between now and when the record referencing it is written
+        os.utime(path)
+        return 0
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+    os.replace(tmp_path, path) # a concurrent writer of the same key writes the same bytes
+    return len(payload)
+
+def write_blobs(dump_dir, blob_dir, arr, chunk_nbytes, codec=None):
+    """
+    Store a tensor as content-addressed chunks of chunk_nbytes (a multiple of ALIGNMENT) in
+    blob_dir (relative to dump_dir), skipping chunks that are already there. Returns the BlobRef
+    to write in the record and {key: size} of the blobs that were written.
+    """
+    if arr.dtype.hasobject:
+        raise ValueError("Cannot dump a tensor with object dtype")
+
+    arr = np.ascontiguousarray(arr)
+    raw = arr.reshape(-1).view(np.uint8)
+    chunks = []
+    codec_fields = {}
+    written = {}
+
+    for start in range(0, raw.nbytes, chunk_nbytes):
+        data = raw[start:start + chunk_nbytes]
+        key = hashlib.blake2b(data, digest_size=16).hexdigest()
+        payload = data
+        if codec is not None:
+            payload, fields = codec.compress(data.view(arr.dtype))
+            codec_fields = {"codec": fields["codec"], "shuffle": fields["shuffle"]}
+            # The same chunk compressed differently is a different blob
+            key += f"-{fields['codec']}" + ("-shuffle" if fields["shuffle"] else "")
+
+        nbytes = _write_blob(blob_path(dump_dir, blob_dir, key), payload)
+        if (nbytes > 0):
+            written[key] = nbytes
+        chunks.append(key)
+
+    return BlobRef(arr.dtype, arr.shape, blob_dir, chunks, chunk_nbytes, codec_fields), written
+
+def _read_blobs(path, t):
+    """Reassemble a chunked tensor from its blob directory, relative to the dump file at path."""
+    dump_dir = os.path.dirname(path)
+    dtype = np.dtype(t["dtype"])
+    raw_nbytes = t["raw_nbytes"]
+
+    def blob_file(key):
+        blob = blob_path(dump_dir, t.get("blob_dir", BLOB_DIR), key)
+        if not os.path.exists(blob):
+            raise ValueError(f"Blob {key} of tensor '{t['name']}' in {path} is missing")
+        return blob
+
+    if (raw_nbytes == 0):
+        return np.empty(t["shape"], dtype=dtype)
+    if (len(t["chunks"]) == 1) and ("codec" not in t):
+        return np.memmap(blob_file(t["chunks"][0]), dtype=np.uint8, mode="r", shape=(raw_nbytes,)).view(dtype).reshape(t["shape"])
+
+    raw = np.empty(raw_nbytes, dtype=np.uint8)
+    for i, key in enumerate(t["chunks"]):
+        start = i * t["chunk_nbytes"]
+        end = min(start + t["chunk_nbytes"], raw_nbytes)
+        payload = np.fromfile(blob_file(key), dtype=np.uint8)
+        if "codec" in t:
+            payload = decompress_tensor(payload, {**t, "raw_nbytes": end - start})
+        if (len(payload) != end - start):
+            raise ValueError(f"Blob {key} of tensor '{t['name']}' in {path} has the wrong size")
+        raw[start:end] = payload
+    return raw.view(dtype).reshape(t["shape"])
+
+def encode_record(record, codec=None):
+    """
+    Lay out a dump record for writing, compressing its tensors with codec if one is given.
+    Returns the list of buffers that make up the record, in order, and the total record length
+    in bytes. BlobRef tensors only add their chunk keys to the header.
+    """
+    header = {}
+    tensors = []
+    tensor_buffers = []
+    data_nbytes = 0
+    version = _INLINE_FORMAT_VERSION
+
+    for key, value in record.items():
+        if is_tensor_group(value):
+            for name, arr in value.items():
+                if isinstance(arr, BlobRef):
+                    entry = {
+                        "group": key,
+                        "name": name,
+                        "dtype": arr.dtype.str,
+                        "shape": list(arr.shape),
+                        "offset": 0,
+                        "nbytes": 0,
+                        "blob_dir": arr.blob_dir,
+                        "chunks": arr.chunks,
+                        "chunk_nbytes": arr.chunk_nbytes,
+                        "raw_nbytes": arr.nbytes
+                    }
+                    entry.update(arr.codec_fields)
+                    tensors.append(entry)
+                    version = FORMAT_VERSION
+                    continue
+
+                if arr.dtype.hasobject:
+                    raise ValueError(f"Cannot dump tensor '{name}' with object dtype")
+
+                arr = np.ascontiguousarray(arr)
+                offset = _align(data_nbytes)
+                entry = {
+                    "group": key,
+                    "name": name,
+                    "dtype": arr.dtype.str,
+                    "shape": list(arr.shape),
+                    "offset": offset
+                }
+
+                if (codec is not None) and (arr.nbytes > 0):
+                    payload, codec_fields = codec.compress(arr)
+                    entry.update(codec_fields)
+                else:
+                    payload = arr.reshape(-1).view(np.uint8)
+
+                entry["nbytes"] = len(payload)
+                tensors.append(entry)
+                tensor_buffers.append((offset - data_nbytes, payload))
+                data_nbytes = offset + len(payload)
+        else:
+            header[key] = value
+
+    header["tensors"] = tensors
+    header["data_nbytes"] = data_nbytes
+    header_bytes = json.dumps(header).encode("utf-8")
+
+    prefix = _PREFIX.pack(MAGIC, version, len(header_bytes))
+    data_start = _align(_PREFIX.size + len(header_bytes))
+
+    buffers = [prefix, header_bytes, bytes(data_start - _PREFIX.size - len(header_bytes))]
+    for pad, buf in tensor_buffers:
+        if pad > 0:
+            buffers.append(bytes(pad))
+        buffers.append(buf)
+
+    return buffers, data_start + data_nbytes
+
+def estimate_record_nbytes(record):
+    """Upper bound on the encoded size of a record, without encoding it."""
+    nbytes = 4096 # generous allowance for the prefix and header
+    for value in record.values():
+        if isinstance(value, dict):
+            nbytes += sum(_align(v.nbytes) for v in value.values() if isinstance(v, np.ndarray))
+    return nbytes
+
+def _writev_all(fd, buffers):
+    """Write all buffers to fd with as few vectored writes as possible, handling short writes."""
+    views = [memoryview(buf).cast("B") for buf in buffers if len(buf) > 0]
+    iov_max = os.sysconf("SC_IOV_MAX") if ("SC_IOV_MAX" in getattr(os, "sysconf_names", {})) else 1024
+
+    while views:
+        written = os.writev(fd, views[:iov_max])
+        while views and written >= len(views[0]):
+            written -= len(views[0])
+            views.pop(0)
+        if views and written > 0:
+            views[0] = views[0][written:]
+
+def write_record(fd, record, codec=None):
+    """Write a dump record at the current position of an open file descriptor. Returns its length."""
+    buffers, length = encode_record(record, codec)
+    _writev_all(fd, buffers)
+    return length
+
+def write_dump_file(path, record, codec=None):
+    """
+    Write a record to its own dump file. The record is written to a temporary file that is
+    renamed into place, so readers never see a partially written dump. The temporary name is
+    unique, so concurrent writers of the same request id never share a temporary file.
+    """
+    tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        length = write_record(fd, record, codec)
+    except BaseException:
+        os.close(fd)
+        os.remove(tmp_path)
+        raise
+    os.close(fd)
+
+    os.replace(tmp_path, path)
+    return length
+
+def read_header(path, offset=0):
+    """Read only the JSON header of the record starting at offset in a dump file."""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        prefix = f.read(_PREFIX.size)
+        if (len(prefix) < _PREFIX.size):
+            raise ValueError(f"Truncated dump record in {path} at offset {offset}")
+
+        magic, version, header_len = _PREFIX.unpack(prefix)
+        if (magic != MAGIC):
+            raise ValueError(f"Not a replay dump record: {path} at offset {offset}")
+        if (version > FORMAT_VERSION):
+            raise ValueError(f"Dump format version {version} is newer than supported version {FORMAT_VERSION}")
+
+        header = json.loads(f.read(header_len).decode("utf-8"))
+
+    header["data_start"] = _align(_PREFIX.size + header_len)
+    return header
+
+def read_record(path, offset=0):
+    """
+    Read the record starting at offset in a dump file. Uncompressed tensors are returned as
+    read-only views of a single memory map of the record, so this takes the same time regardless
+    of their size. Compressed tensors are decompressed into new arrays. A chunked tensor is a
+    memory map of its blob if it has a single uncompressed chunk, and a new array otherwise.
+    """
+    header = read_header(path, offset)
+    data_start = header.pop("data_start")
+    tensors = header.pop("tensors")
+    data_nbytes = header.pop("data_nbytes")
+
+    record = dict(header)
+    data = None
+    if (data_nbytes > 0):
+        data = np.memmap(path, dtype=np.uint8, mode="r", offset=offset + data_start, shape=(data_nbytes,))
+
+    for t in tensors:
+        dtype = np.dtype(t["dtype"])
+        if "chunks" in t:
+            arr = _read_blobs(path, t)
+        elif (t["nbytes"] == 0):
+            arr = np.empty(t["shape"], dtype=dtype)
+        elif "codec" in t:
+            payload = data[t["offset"]:t["offset"] + t["nbytes"]]
+            arr = decompress_tensor(payload, t).view(dtype).reshape(t["shape"])
+        else:
+            arr = data[t["offset"]:t["offset"] + t["nbytes"]].view(dtype).reshape(t["shape"])
+        record.setdefault(t["group"], {})[t["name"]] = arr
+
+    return record
+
+def load_dump(path, offset=0):
+    """Load a dump from either the binary format (at offset in the file) or a legacy pickle file."""
+    if path.endswith(LEGACY_EXTENSION):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    return read_record(path, offset)
+
+def load_dump_info(path, offset=0):
+    """
+    Load the scalar fields of a dump plus {group: {name: (shape, dtype)}} for its tensors,
+    without touching the tensor data of binary dumps.
+    """
+    if path.endswith(LEGACY_EXTENSION):
+        record = load_dump(path)
+        info = {k: v for k, v in record.items() if k != "inputs"}
+        info["tensors"] = {"inputs": {name: (val.shape, val.dtype) for name, val in record.get("inputs", {}).items()}}
+        return info
+
+    header = read_header(path, offset)
+    info = {k: v for k, v in header.items() if k not in ("tensors", "data_nbytes", "data_start")}
+    info["tensors"] = {}
+    for t in header["tensors"]:
+        info["tensors"].setdefault(t["group"], {})[t["name"]] = (tuple(t["shape"]), np.dtype(t["dtype"]))
+    return info
+
+def collect_blobs(dump_dir, min_age=600, dry_run=False):
+    """
+    Delete the blobs under dump_dir/blobs that no dump file in dump_dir references, along with
+    temporary files left behind by interrupted blob writes. Blobs modified in the last min_age
+    seconds are kept, since a server may have written (or reused) them for a record it has not
+    written yet.
+
+    Returns a dict of counts: dumps scanned, unreadable dumps, blobs, referenced blobs, removed
+    blobs, recent blobs kept, bytes removed, bytes of blobs kept, and logical_nbytes (the
+    uncompressed size of every chunked tensor of every dump, as if each were stored in full).
+    """
+    stats = {"dumps": 0, "unreadable": 0, "blobs": 0, "referenced": 0, "removed": 0, "recent": 0,
+             "removed_nbytes": 0, "kept_nbytes": 0, "logical_nbytes": 0}
+    blob_root = os.path.join(dump_dir, BLOB_DIR)
+    if not os.path.isdir(blob_root):
+        return stats
+
+    # Take the cutoff before reading the dumps: a blob written after it may belong to a dump written after the scan
+    cutoff = time.time() - min_age
+    referenced = set()
+    for entry in os.scandir(dump_dir):
+        if entry.name.startswith(".") or not entry.name.endswith(DUMP_EXTENSION):
+            continue
+        try:
+            header = read_header(entry.path)
+        except (OSError, ValueError):
+            stats["unreadable"] += 1
+            continue
+        stats["dumps"] += 1
+        for t in header["tensors"]:
+            if "chunks" in t:
+                referenced.update(os.path.normpath(blob_path(dump_dir, t.get("blob_dir", BLOB_DIR), key)) for key in t["chunks"])
+                stats["logical_nbytes"] += t["raw_nbytes"]
+
+    for root, _, files in os.walk(blob_root):
+        for name in files:
+            path = os.path.normpath(os.path.join(root, name))
+            is_blob = name.endswith(BLOB_EXTENSION) and not name.startswith(".")
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+
+            if is_blob:
+                stats["blobs"] += 1
+                if path in referenced:
+                    stats["referenced"] += 1
+                    stats["kept_nbytes"] += st.st_size
+                    continue
+            if (st.st_mtime > cutoff):
+                stats["recent"] += is_blob
+                stats["kept_nbytes"] += st.st_size
+                continue
+
+            if not dry_run:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+            stats["removed"] += is_blob
+            stats["removed_nbytes"] += st.st_size
+
+    return stats
+
+class DumpLogIndex:
+    """
+    Maps request ids to records in the segment files written by the server's "log" dump mode.
+    Index files are only read from where the previous refresh left off, so refreshing a large,
+    growing log is cheap. If a request id appears more than once, the latest record wins.
+
+    Read positions are kept per index file, together with the file's identity (inode, and
+    creation time where the platform has one). A server restarted after its segments were
+    deleted writes new segments under the same names, so an index file that is not the one
+    read before, or that is shorter than the position, is read again from the start.
+    """
+
+    def __init__(self, dump_dir):
+        self.dump_dir = dump_dir
+        self.entries = {} # request id -> (segment path, offset, length)
+        self._read_positions = {} # index path -> (file identity, bytes read)
+
+    def refresh(self):
+        """Pick up any index entries written since the last refresh."""
+        if not os.path.isdir(self.dump_dir):
+            return
+
+        seen = set()
+        for idx_file in sorted(f for f in os.listdir(self.dump_dir) if f.endswith(INDEX_EXTENSION)):
+            idx_path = os.path.join(self.dump_dir, idx_file)
+            seg_path = idx_path[:-len(INDEX_EXTENSION)] + SEGMENT_EXTENSION
+            seen.add(idx_path)
+
+            try:
+                f = open(idx_path, "rb")
+            except FileNotFoundError:
+                continue # deleted since listing the directory
+            with f:
+                st = os.fstat(f.fileno())
+                identity = (st.st_ino, getattr(st, "st_birthtime", None))
+                known, position = self._read_positions.get(idx_path, (identity, 0))
+                if (known != identity) or (st.st_size < position):
+                    # A new segment under an old name, forget the records of the old one
+                    self.entries = {k: v for k, v in self.entries.items() if v[0] != seg_path}
+                    position = 0
+
+                f.seek(position)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break # entry still being written, pick it up next time
+                    req_id, offset, length = line.decode("utf-8").rstrip("\n").split("\t")[:3]
+                    self.entries[req_id] = (seg_path, int(offset), int(length))
+                    position += len(line)
+                self._read_positions[idx_path] = (identity, position)
+
+        # Forget entries of segments that have been deleted
+        removed = set(self._read_positions) - seen
+        if removed:
+            removed_segments = {p[:-len(INDEX_EXTENSION)] + SEGMENT_EXTENSION for p in removed}
+            self.entries = {k: v for k, v in self.entries.items() if v[0] not in removed_segments}
+            for p in removed:
+                del self._read_positions[p]
+
+    def lookup(self, req_id):
+        """Return (segment path, offset, length) for a request id, or None if it is not logged."""
+        return self.entries.get(req_id)
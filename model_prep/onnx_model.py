@@ -1,89 +1,244 @@
 import os
-from enum import Enum
+import sys
 import json
+import time
 import numpy as np
-import pickle
 import onnxruntime as rt
 import triton_python_backend_utils as pb_utils
 
-class InputDumpSetting(Enum):
-    NEVER = 0
-    ALWAYS = 1
-    ON_FAILURE = 2
+from batching import BufferPool, RequestRunner, get_pad_buckets, get_variable_axes
+from replay_dump import UNKNOWN_ID, InputDumpSetting, DumpMetrics, DumpPolicy, DumpStats, DumpWriter, get_config_parameter, get_dump_setting
+from stage_timing import StageMetrics, StageTimer
+from model_cache import cache_path, publish, temporary_path
+from result_cache import ResultCache, ResultCacheMetrics
+
+# Stages of execute() timed when the stage_timing parameter is enabled
+STAGES = ("inputs", "cache", "fuse", "forward", "outputs", "split", "responses", "dump")
+
+EXECUTION_MODES = {"sequential": rt.ExecutionMode.ORT_SEQUENTIAL, "parallel": rt.ExecutionMode.ORT_PARALLEL}
 
 class TritonPythonModel:
     def initialize(self, args):
         # Location to dump replay data as configured
         self.replay_dump_dir = "/dumps"
-        num_cpus = os.cpu_count() # should make this another custom config parameter?
 
-        providers = ["CUDAExecutionProvider"]
-        sess_options = rt.SessionOptions()
-        sess_options.intra_op_num_threads = num_cpus
-        sess_options.graph_optimization_level = rt.GraphOptimizationLevel.ORT_ENABLE_ALL
+        model_config = json.loads(args["model_config"])
+        self.model_name = model_config["name"]
 
         model_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model.onnx")
-
-        self.sess = rt.InferenceSession(model_path, sess_options=sess_options, providers=providers)
+        self.sess = self._create_session(model_path, model_config, args)
 
         self.input_names = [inp.name for inp in self.sess.get_inputs()]
         self.output_names = [out.name for out in self.sess.get_outputs()]
 
-        model_config = json.loads(args["model_config"])
-        self.model_name = model_config["name"]
-
         self.output_dtypes = []
         for out_name in self.output_names:
             out_config = pb_utils.get_output_config_by_name(model_config, out_name)
             self.output_dtypes.append(pb_utils.triton_string_to_numpy(out_config["data_type"]))
 
-        # Configure input dumping based on custom model config parameter
-        self.input_dump_setting = InputDumpSetting.NEVER
-        config_dump_string = model_config.get("parameters", {}).get("dump_input", {}).get("string_value", "").lower()
-        if (config_dump_string == "always"):
-            self.input_dump_setting = InputDumpSetting.ALWAYS
-        elif (config_dump_string == "on_failure"):
-            self.input_dump_setting = InputDumpSetting.ON_FAILURE
+        # Requests in a dynamic batch are run as one forward pass, padding variable-length axes as needed
+        self.variable_axes = get_variable_axes(model_config)
+        fuse_string = get_config_parameter(model_config, "fuse_requests", "true").lower()
+        self.fuse_requests = (fuse_string == "true") and (model_config.get("max_batch_size", 0) > 0)
+
+        # Optionally pad variable-length axes up to a few bucket lengths, so the model sees few distinct shapes
+        particle_buckets = [int(v) for v in get_config_parameter(model_config, "pad_particle_buckets", "").split(",") if v.strip()]
+        sv_buckets = [int(v) for v in get_config_parameter(model_config, "pad_sv_buckets", "").split(",") if v.strip()]
+        self.pad_buckets = get_pad_buckets(model_config, particle_buckets, sv_buckets)
+
+        # Fused inputs are written to buffers reused across calls
+        self.buffer_pool = BufferPool()
+
+        # Configure input dumping based on custom model config parameters
+        self.input_dump_setting = get_dump_setting(model_config)
+        self.dump_stats = DumpStats()
+        self.dump_policy = DumpPolicy.from_config(model_config, self.dump_stats)
+
+        # Recording outputs as well lets replays be checked against what production returned
+        self.dump_outputs = get_config_parameter(model_config, "dump_outputs", "false").lower() == "true"
+
+        # Optional per-row cache of results, keyed by the model version and input bytes. It is never
+        # used when dumping on failure, where every request has to run to show whether it fails.
+        self.result_cache = None
+        self.result_cache_metrics = None
+        if (get_config_parameter(model_config, "result_cache", "false").lower() == "true"):
+            if (self.input_dump_setting == InputDumpSetting.ON_FAILURE):
+                print(f"Result cache of {self.model_name} disabled, dump_input is on_failure", flush=True)
+            else:
+                max_mb = float(get_config_parameter(model_config, "result_cache_mb", "256"))
+                self.result_cache = ResultCache(int(max_mb * 1e6), f"{self.model_name}:{args.get('model_version', '')}")
+                if hasattr(pb_utils, "MetricFamily"):
+                    self.result_cache_metrics = ResultCacheMetrics(pb_utils, self.model_name)
+
+        # Dumps are written by a background thread so responses are not held up by disk I/O
+        self.dump_writer = None
+        if (self.input_dump_setting != InputDumpSetting.NEVER):
+            self.dump_writer = DumpWriter.from_config(model_config, self.replay_dump_dir, args["model_instance_name"], self.dump_stats)
+
+        # Each execute() call gets an id, so dumps record which requests the dynamic batcher grouped together
+        self.instance_name = args["model_instance_name"]
+        self.execute_count = 0
+
+        # Export dump counters as Triton custom metrics, if the server supports them
+        self.dump_metrics = None
+        if (self.dump_writer is not None) and hasattr(pb_utils, "MetricFamily"):
+            self.dump_metrics = DumpMetrics(pb_utils, self.model_name)
+
+        # Per-stage timing of execute(), off by default. When off, stage_timer is None and each stage costs a single comparison.
+        self.stage_timer = None
+        self.stage_metrics = None
+        if (get_config_parameter(model_config, "stage_timing", "false").lower() == "true"):
+            self.stage_timer = StageTimer(STAGES)
+            if hasattr(pb_utils, "MetricFamily"):
+                self.stage_metrics = StageMetrics(pb_utils, self.model_name, STAGES)
+
+        # Runs the requests of each execute() call, fused into one forward pass where possible
+        self.runner = RequestRunner(self._forward, self.input_names, self.variable_axes, fuse=self.fuse_requests, pool=self.buffer_pool,
+                                    buckets=self.pad_buckets, timer=self.stage_timer, pb_utils=pb_utils, model_name=self.model_name)
 
     def execute(self, requests):
-        responses = []
+        execute_start = time.time()
+        self.execute_count += 1
+        batch_id = f"{self.instance_name}:{self.execute_count}"
 
-        for request in requests:
-            err_msg = "none"
-            request_inputs = {name: pb_utils.get_input_tensor_by_name(request, name).as_numpy() for name in self.input_names}
+        timer = self.stage_timer
+        if timer is not None:
+            timer.begin()
 
-            try:
-                pred_onnx = self.sess.run(self.output_names, request_inputs)
+        responses = []
+        all_inputs = [{name: pb_utils.get_input_tensor_by_name(request, name).as_numpy() for name in self.input_names} for request in requests]
+        if timer is not None:
+            timer.lap("inputs")
 
-                if (len(self.output_names) == 1):
-                    # outputs must be list
-                    outputs = [pb_utils.Tensor(self.output_names[0], pred_onnx[0].astype(self.output_dtypes[0]))]
-                else:
-                    outputs = []
-                    for idx, name in enumerate(self.output_names):
-                        outputs.append(pb_utils.Tensor(name, pred_onnx[idx].astype(self.output_dtypes[idx])))
+        if self.result_cache is not None:
+            all_outputs, err_msgs = self.result_cache.run(all_inputs, self.input_names, self.runner.run, timer)
+        else:
+            all_outputs, err_msgs = self.runner.run(all_inputs)
+        execute_end = time.time()
 
+        for batch_index, (request, request_inputs, request_outputs, err_msg) in enumerate(zip(requests, all_inputs, all_outputs, err_msgs)):
+            if (err_msg == "none"):
+                outputs = [pb_utils.Tensor(name, request_outputs[idx]) for idx, name in enumerate(self.output_names)]
                 response = pb_utils.InferenceResponse(output_tensors=outputs)
-            
-            except Exception as ex:
-                err_msg = f"Error during inference: {str(ex)}"
-                response = pb_utils.InferenceResponse(error = pb_utils.TritonError(err_msg))
-            
+            else:
+                response = pb_utils.InferenceResponse(error=pb_utils.TritonError(err_msg))
+            if timer is not None:
+                timer.lap("responses")
+
             # Dump inputs if configured
-            if (self.input_dump_setting == InputDumpSetting.ALWAYS) or (self.input_dump_setting == InputDumpSetting.ON_FAILURE and err_msg != "none"):
+            if (self.dump_writer is not None) and self.dump_policy.admit(err_msg != "none"):
                 req_id = request.request_id() # Returns a client-specified id or empty string
                 if (req_id == ""):
-                    req_id = "UNKNOWN_ID"
+                    req_id = UNKNOWN_ID
                 
+                # Input arrays may be backed by request memory that Triton frees once responses are sent,
+                # so the writer thread gets its own copies.
                 err_dict = {
                     "id": req_id,
                     "model": self.model_name,
                     "message": err_msg,
-                    "inputs": request_inputs
+                    "timestamp": time.time(),
+                    "execute_start": execute_start,
+                    "execute_end": execute_end,
+                    "batch_id": batch_id,
+                    "batch_index": batch_index,
+                    "batch_requests": len(requests),
+                    "inputs": {name: np.array(val, copy=True) for name, val in request_inputs.items()}
                 }
-                with open(f"{self.replay_dump_dir}/{req_id}.pkl", "wb") as f:
-                    pickle.dump(err_dict, f)
+                if self.dump_outputs and (err_msg == "none"):
+                    err_dict["outputs"] = {name: np.array(request_outputs[idx], copy=True) for idx, name in enumerate(self.output_names)}
+                self.dump_writer.submit(err_dict)
+                if timer is not None:
+                    timer.lap("dump")
             
             responses.append(response)
-        
+
+        if self.dump_metrics is not None:
+            self.dump_metrics.publish(self.dump_stats)
+        if self.result_cache_metrics is not None:
+            self.result_cache_metrics.publish(self.result_cache)
+        if (timer is not None) and (self.stage_metrics is not None):
+            self.stage_metrics.observe(timer.finish())
         return responses
+
+    def _create_session(self, model_path, model_config, args):
+        """
+        Build the ONNX Runtime session as configured by the ort_* parameters. The optimized graph
+        is saved to the cache on the first load and read back on later ones, skipping optimization.
+        """
+        # Unless configured otherwise, the cores are split between all instances of the model
+        num_instances = sum(int(group.get("count", 1)) * max(1, len(group.get("gpus", [])))
+                            for group in model_config.get("instance_group", [])) or 1
+        intra_op_threads = int(get_config_parameter(model_config, "ort_intra_op_threads", str(max(1, os.cpu_count() // num_instances))))
+        inter_op_threads = int(get_config_parameter(model_config, "ort_inter_op_threads", "1"))
+        execution_mode = get_config_parameter(model_config, "ort_execution_mode", "sequential").lower()
+        if execution_mode not in EXECUTION_MODES:
+            raise ValueError(f"Unknown ort_execution_mode '{execution_mode}', expected 'sequential' or 'parallel'")
+
+        provider_names = [name.strip() for name in get_config_parameter(model_config, "ort_providers", "CUDAExecutionProvider").split(",") if name.strip()]
+        providers = []
+        for name in provider_names:
+            # GPU instances run on the device Triton placed them on
+            if (name == "CUDAExecutionProvider") and (args.get("model_instance_kind") == "GPU"):
+                providers.append((name, {"device_id": int(args.get("model_instance_device_id", 0))}))
+            else:
+                providers.append(name)
+
+        sess_options = rt.SessionOptions()
+        sess_options.intra_op_num_threads = intra_op_threads
+        sess_options.inter_op_num_threads = inter_op_threads
+        sess_options.execution_mode = EXECUTION_MODES[execution_mode]
+        sess_options.graph_optimization_level = rt.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        cache_dir = get_config_parameter(model_config, "ort_cache_dir", os.path.join(os.path.dirname(model_path), "ort_cache"))
+        if (cache_dir.lower() == "none"):
+            return rt.InferenceSession(model_path, sess_options=sess_options, providers=providers)
+
+        # Fully optimized graphs contain provider-specific nodes, so the providers are part of the key
+        cached = cache_path(cache_dir, model_path, [rt.__version__, ",".join(provider_names)], ".ort.onnx")
+        start = time.perf_counter()
+        if os.path.isfile(cached):
+            try:
+                sess_options.graph_optimization_level = rt.GraphOptimizationLevel.ORT_DISABLE_ALL
+                sess = rt.InferenceSession(cached, sess_options=sess_options, providers=providers)
+                print(f"Loaded optimized ONNX graph for {self.model_name} from {cached} in {time.perf_counter() - start:.2f} s", flush=True)
+                return sess
+            except Exception as ex:
+                print(f"Could not load cached ONNX graph {cached}, optimizing the model again: {ex}", file=sys.stderr, flush=True)
+                sess_options.graph_optimization_level = rt.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        temporary = None
+        try:
+            temporary = temporary_path(cached)
+            sess_options.optimized_model_filepath = temporary
+            sess = rt.InferenceSession(model_path, sess_options=sess_options, providers=providers)
+            publish(temporary, cached)
+            print(f"Optimized ONNX graph for {self.model_name} in {time.perf_counter() - start:.2f} s, cached in {cached}", flush=True)
+            return sess
+        except Exception as ex:
+            print(f"Could not cache the optimized ONNX graph in {cache_dir}: {ex}", file=sys.stderr, flush=True)
+            if (temporary is not None) and os.path.exists(temporary):
+                os.remove(temporary)
+
+        # Caching is only an optimization, fall back to a plain session
+        sess_options.optimized_model_filepath = ""
+        return rt.InferenceSession(model_path, sess_options=sess_options, providers=providers)
+
+    def _forward(self, inputs, reuse_buffers=False):
+        """Run the session on a dict of numpy inputs, returning a list of numpy outputs (reuse_buffers is unused)."""
+        timer = self.stage_timer
+        pred_onnx = self.sess.run(self.output_names, inputs)
+        if timer is not None:
+            timer.lap("forward")
+
+        # Skips the copy when the session already returns the configured dtype
+        outputs = [pred_onnx[idx].astype(self.output_dtypes[idx], copy=False) for idx in range(len(self.output_names))]
+        if timer is not None:
+            timer.lap("outputs")
+        return outputs
+
+    def finalize(self):
+        # Make sure every queued dump reaches disk before the model is unloaded
+        if self.dump_writer is not None:
+            self.dump_writer.close()
+            print(f"Dump counters for {self.model_name}: {self.dump_stats.snapshot()}", flush=True)
@@ -0,0 +1,150 @@
+"""
+Per-row cache of model results in the Python backend models, keyed by content hash.
+
+Replay and validation loops send the same inputs to a model again and again. With the cache,
+each row of a request is hashed (together with the model name and version), rows seen before
+are answered from memory, and only the rest go through the model. Because rows are cached on
+their own, a batch that repeats only some earlier rows still saves their share of the work.
+Memory is bounded, and the least recently used rows are evicted first.
+"""
+
+import hashlib
+import collections
+import numpy as np
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Outcomes counted by the cache, per row
+RESULT_CACHE_COUNTERS = ("hit", "miss", "evicted")
+
+# Rough per-entry overhead of the key, the OrderedDict slot and the tuple, in bytes
+_ENTRY_OVERHEAD = 200
+
+class ResultCache:
+    """
+    LRU map from row hashes to the tuple of that row's outputs, holding at most max_bytes of
+    output data. Hashes use xxh3-128 when the xxhash package is installed, blake2b otherwise.
+    Not thread-safe: each model instance keeps its own cache and uses it from execute() only.
+    """
+
+    def __init__(self, max_bytes, model_key):
+        self.max_bytes = max_bytes
+        self.model_key = model_key.encode()
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+        self.counts = dict.fromkeys(RESULT_CACHE_COUNTERS, 0)
+
+    def _hasher(self):
+        return xxhash.xxh3_128() if (xxhash is not None) else hashlib.blake2b(digest_size=16)
+
+    def row_keys(self, inputs, input_names):
+        """Hash every row of a request's {input_name: array} inputs."""
+        arrays = [np.ascontiguousarray(inputs[name]) for name in input_names]
+        keys = []
+        for row in range(arrays[0].shape[0]):
+            hasher = self._hasher()
+            hasher.update(self.model_key)
+            for arr in arrays:
+                # Shape and dtype are part of the key, so equal bytes of different tensors never collide
+                hasher.update(f"{arr.dtype.str}{arr.shape[1:]}".encode())
+                hasher.update(arr[row].data)
+            keys.append(hasher.digest())
+        return keys
+
+    def get(self, key):
+        """Return the cached outputs of a row, or None, counting the hit or miss."""
+        outputs = self.entries.get(key)
+        if outputs is None:
+            self.counts["miss"] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.counts["hit"] += 1
+        return outputs
+
+    def put(self, key, outputs):
+        """Cache copies of a row's outputs, evicting the least recently used rows to make room."""
+        if key in self.entries:
+            return
+        outputs = tuple(np.array(out, copy=True) for out in outputs)
+        size = sum(out.nbytes for out in outputs) + _ENTRY_OVERHEAD
+        if (size > self.max_bytes):
+            return
+
+        while self.entries and (self.nbytes + size > self.max_bytes):
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= sum(out.nbytes for out in evicted) + _ENTRY_OVERHEAD
+            self.counts["evicted"] += 1
+        self.entries[key] = outputs
+        self.nbytes += size
+
+    def run(self, all_inputs, input_names, run, timer=None):
+        """
+        Answer the rows of a batch of requests found in the cache from it, and run only the other
+        rows through run(list of {input_name: array}), which returns per-request outputs and
+        error messages, caching their results. Returns the same as run() for all the requests.
+        With a stage timer, the lookups and the scatter of results are timed as "cache".
+        """
+        row_keys = [self.row_keys(inputs, input_names) for inputs in all_inputs]
+        row_outputs = [[self.get(key) for key in keys] for keys in row_keys]
+        missed = [[row for row, outputs in enumerate(rows) if outputs is None] for rows in row_outputs]
+        if timer is not None:
+            timer.lap("cache")
+
+        # Requests that only partly hit run just the rows that missed
+        to_run = [idx for idx in range(len(all_inputs)) if missed[idx] or not row_keys[idx]]
+        run_inputs = [
+            all_inputs[idx] if (len(missed[idx]) == len(row_keys[idx])) else {name: value[missed[idx]] for name, value in all_inputs[idx].items()}
+            for idx in to_run
+        ]
+        run_outputs, run_errs = run(run_inputs) if run_inputs else ([], [])
+        ran = {idx: pos for pos, idx in enumerate(to_run)}
+
+        all_outputs = [None] * len(all_inputs)
+        err_msgs = ["none"] * len(all_inputs)
+        for idx, rows in enumerate(row_outputs):
+            if idx in ran:
+                pos = ran[idx]
+                if (run_errs[pos] != "none"):
+                    err_msgs[idx] = run_errs[pos]
+                    continue
+                outputs = run_outputs[pos]
+                for offset, row in enumerate(missed[idx]):
+                    rows[row] = tuple(out[offset] for out in outputs)
+                    self.put(row_keys[idx][row], rows[row])
+                if (len(missed[idx]) == len(rows)):
+                    all_outputs[idx] = outputs
+                    continue
+
+            # Stack cached and newly computed rows back into whole outputs
+            all_outputs[idx] = [np.stack([outputs[out_idx] for outputs in rows]) for out_idx in range(len(rows[0]))]
+
+        if timer is not None:
+            timer.lap("cache")
+        return all_outputs, err_msgs
+
+class ResultCacheMetrics:
+    """
+    Exports the cache counters as replay_result_cache_rows_total (labelled by model and outcome)
+    and the memory in use as the gauge replay_result_cache_bytes.
+    """
+
+    def __init__(self, pb_utils, model_name):
+        family_cls = pb_utils.MetricFamily
+        self.rows_family = family_cls(name="replay_result_cache_rows_total",
+                                      description="Rows answered from (hit) or missing in (miss) the result cache, and rows evicted from it",
+                                      kind=family_cls.COUNTER)
+        self.bytes_family = family_cls(name="replay_result_cache_bytes", description="Memory held by the result cache",
+                                       kind=family_cls.GAUGE)
+        self.counters = {kind: self.rows_family.Metric(labels={"model": model_name, "outcome": kind}) for kind in RESULT_CACHE_COUNTERS}
+        self.bytes_gauge = self.bytes_family.Metric(labels={"model": model_name})
+        self.published = dict.fromkeys(RESULT_CACHE_COUNTERS, 0)
+
+    def publish(self, cache):
+        for kind, count in cache.counts.items():
+            if (count > self.published[kind]):
+                self.counters[kind].increment(count - self.published[kind])
+                self.published[kind] = count
+        self.bytes_gauge.set(cache.nbytes)
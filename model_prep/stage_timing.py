@@ -0,0 +1,92 @@
+"""
+Per-stage timing of execute() in the Python backend models.
+
+A StageTimer splits the wall time of an execute() call into named stages (reading inputs,
+fusing, moving to the device, the forward pass, ...). Models keep `self.stage_timer = None`
+when timing is disabled and guard every lap with `if timer is not None`, so a disabled timer
+costs one comparison per stage. StageMetrics exports the per-call stage durations as a
+histogram through Triton's custom metrics.
+"""
+
+import time
+
+# Histogram bucket upper bounds in ms
+STAGE_BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0, 500.0, 1000.0, 2500.0, 5000.0)
+
+STAGE_METRIC_NAME = "replay_execute_stage_duration_ms"
+
+class StageTimer:
+    """
+    Accumulates the time spent in each stage of one execute() call. lap(stage) charges the time
+    since the previous lap (or begin()) to the stage; stages that are entered several times in a
+    call, e.g. once per request, add up. finish() returns the per-stage totals in ms.
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.totals = {}
+        self.last = 0.0
+
+    def begin(self):
+        self.totals = {}
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.totals[stage] = self.totals.get(stage, 0.0) + (now - self.last)
+        self.last = now
+
+    def skip(self):
+        """Restart the clock without charging the elapsed time to any stage."""
+        self.last = time.perf_counter()
+
+    def finish(self):
+        return {stage: seconds * 1000 for stage, seconds in self.totals.items()}
+
+class StageMetrics:
+    """
+    Exports stage durations as the histogram replay_execute_stage_duration_ms, labelled by model
+    and stage. Servers without histogram support in pb_utils get the same _bucket, _sum and
+    _count series built from counters, so readers see the same data either way.
+    """
+
+    def __init__(self, pb_utils, model_name, stages, buckets=STAGE_BUCKETS_MS):
+        self.buckets = buckets
+        family_cls = pb_utils.MetricFamily
+        description = "Time spent in each stage of execute() per call, in ms"
+
+        if hasattr(family_cls, "HISTOGRAM"):
+            self.native = True
+            self.family = family_cls(name=STAGE_METRIC_NAME, description=description, kind=family_cls.HISTOGRAM)
+            self.histograms = {
+                stage: self.family.Metric(labels={"model": model_name, "stage": stage}, buckets=list(buckets))
+                for stage in stages
+            }
+        else:
+            self.native = False
+            self.bucket_family = family_cls(name=f"{STAGE_METRIC_NAME}_bucket", description=description, kind=family_cls.COUNTER)
+            self.sum_family = family_cls(name=f"{STAGE_METRIC_NAME}_sum", description=description, kind=family_cls.COUNTER)
+            self.count_family = family_cls(name=f"{STAGE_METRIC_NAME}_count", description=description, kind=family_cls.COUNTER)
+
+            bounds = [str(b) for b in buckets] + ["+Inf"]
+            self.bucket_counters = {
+                stage: [self.bucket_family.Metric(labels={"model": model_name, "stage": stage, "le": le}) for le in bounds]
+                for stage in stages
+            }
+            self.sum_counters = {stage: self.sum_family.Metric(labels={"model": model_name, "stage": stage}) for stage in stages}
+            self.count_counters = {stage: self.count_family.Metric(labels={"model": model_name, "stage": stage}) for stage in stages}
+
+    def observe(self, durations_ms):
+        """Record one execute() call's {stage: duration in ms}."""
+        for stage, value in durations_ms.items():
+            if self.native:
+                self.histograms[stage].observe(value)
+                continue
+
+            # Buckets are cumulative: every bucket whose bound is at least the value is incremented
+            counters = self.bucket_counters[stage]
+            first = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            for counter in counters[first:]:
+                counter.increment(1)
+            self.sum_counters[stage].increment(value)
+            self.count_counters[stage].increment(1)
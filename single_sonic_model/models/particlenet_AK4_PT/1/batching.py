@@ -0,0 +1,210 @@
+import sys
+import bisect
+import numpy as np
+
+def get_variable_axes(model_config):
+    """
+    Map each input name to the axes of its batched array whose configured dim is -1.
+    Config dims do not include the batch dimension, so axis indices are shifted by one.
+    """
+    variable_axes = {}
+    for inp in model_config["input"]:
+        variable_axes[inp["name"]] = [axis + 1 for axis, dim in enumerate(inp["dims"]) if int(dim) == -1]
+    return variable_axes
+
+def get_pad_buckets(model_config, particle_buckets, sv_buckets):
+    """
+    Map each input with variable-length axes to the sorted lengths its axes are padded up to:
+    sv_buckets for inputs whose name starts with "sv_", particle_buckets for the others.
+    Returns None when no buckets are configured. Padding relies on the model ignoring zeroed
+    (masked) entries, which only holds when outputs have no variable-length axes themselves.
+    """
+    if not particle_buckets and not sv_buckets:
+        return None
+    for out in model_config["output"]:
+        if any(int(dim) == -1 for dim in out["dims"]):
+            raise ValueError(f"Cannot pad inputs to buckets: output '{out['name']}' has a variable-length axis")
+
+    buckets = {}
+    for inp in model_config["input"]:
+        if any(int(dim) == -1 for dim in inp["dims"]):
+            lengths = sv_buckets if inp["name"].startswith("sv_") else particle_buckets
+            if lengths:
+                buckets[inp["name"]] = sorted(lengths)
+    return buckets
+
+def bucket_length(length, buckets):
+    """Round length up to the smallest bucket holding it, keeping it as is past the largest bucket."""
+    idx = bisect.bisect_left(buckets, length)
+    return buckets[idx] if idx < len(buckets) else length
+
+class BufferPool:
+    """
+    Flat buffers that are kept across execute() calls and grown on demand, handed out as views of
+    the requested shape. Works with numpy arrays and torch tensors alike, since allocation is left
+    to the caller. A buffer handed out under a key is only valid until the next get() with that key.
+    """
+
+    def __init__(self):
+        self.buffers = {}
+
+    def get(self, key, shape, allocate):
+        """Return a view of the given shape on the buffer under key, calling allocate(num_elements) to (re)create it."""
+        size = int(np.prod(shape))
+        buf = self.buffers.get(key)
+        if (buf is None) or (len(buf) < size):
+            # Grow by at least a quarter so slowly increasing batches do not reallocate on every call
+            buf = allocate(max(size, int(1.25 * len(buf)) if buf is not None else 0, 1))
+            self.buffers[key] = buf
+        return buf[:size].reshape(shape)
+
+def _numpy_allocate(size, like):
+    return np.empty(size, dtype=like.dtype)
+
+def fuse_inputs(request_inputs, input_names, variable_axes, pool=None, allocate=_numpy_allocate, buckets=None):
+    """
+    Concatenate the inputs of several requests along the batch dimension.
+
+    request_inputs is a list of {input_name: array} dicts, one per request. Variable-length
+    axes are zero-padded to the longest length among the requests, which (with zeroed masks)
+    leaves the results for the real entries unchanged. Returns the fused {input_name: array}
+    dict and the number of rows contributed by each request.
+
+    Each request is copied once, straight into its place in the fused array. With a pool, fused
+    arrays are views on buffers reused across calls. allocate(num_elements, like) creates flat
+    buffers of the same kind as `like`, which lets torch callers fuse straight onto the device.
+
+    With buckets ({input_name: sorted lengths}, see get_pad_buckets), variable-length axes are
+    padded further, up to the next bucket, so the model only sees a few distinct shapes. This
+    also pads the inputs of a single request.
+    """
+    row_counts = [inputs[input_names[0]].shape[0] for inputs in request_inputs]
+
+    target_shapes = {}
+    for name in input_names:
+        arrays = [inputs[name] for inputs in request_inputs]
+        target_shape = list(arrays[0].shape)
+        target_shape[0] = sum(row_counts)
+        for axis in variable_axes.get(name, []):
+            length = max(arr.shape[axis] for arr in arrays)
+            target_shape[axis] = bucket_length(length, buckets[name]) if (buckets and name in buckets) else length
+        target_shapes[name] = tuple(target_shape)
+
+    fused = {}
+    for name in input_names:
+        arrays = [inputs[name] for inputs in request_inputs]
+        target_shape = target_shapes[name]
+
+        # A lone request is only copied if it needs padding
+        if (len(arrays) == 1) and (tuple(arrays[0].shape) == target_shape):
+            fused[name] = arrays[0]
+            continue
+
+        if pool is not None:
+            out = pool.get((name, str(arrays[0].dtype)), target_shape, lambda size: allocate(size, arrays[0]))
+        else:
+            out = allocate(int(np.prod(target_shape)), arrays[0]).reshape(target_shape)
+
+        # Only padded inputs need zeroing, everything else is overwritten below
+        if any(tuple(arr.shape[1:]) != target_shape[1:] for arr in arrays):
+            out[...] = 0
+
+        offset = 0
+        for arr in arrays:
+            out[(slice(offset, offset + arr.shape[0]),) + tuple(slice(0, dim) for dim in arr.shape[1:])] = arr
+            offset += arr.shape[0]
+        fused[name] = out
+
+    return fused, row_counts
+
+def split_outputs(outputs, row_counts):
+    """Slice a list of batched output arrays back into one list of outputs per request."""
+    offsets = [0]
+    for count in row_counts:
+        offsets.append(offsets[-1] + int(count))
+    return [[out[offsets[idx]:offsets[idx + 1]] for out in outputs] for idx in range(len(row_counts))]
+
+class RequestRunner:
+    """
+    Runs the requests of a dynamic batch through a backend's forward function, which takes an
+    {input_name: array} dict and a reuse_buffers flag and returns a list of outputs. Requests are
+    fused into a single forward pass where possible. If that fails, each request is rerun alone
+    so errors are attributed to the request causing them, and the failure is counted in the
+    fused_batch_fallbacks_total metric (when pb_utils supports metrics) and logged.
+
+    pool, allocate and buckets are passed on to fuse_inputs. With a stage timer, fusing and
+    splitting are timed as the "fuse" and "split" stages.
+    """
+
+    # A broken fused pass usually fails every batch the same way, so only some failures are logged
+    LOG_EVERY = 100
+
+    def __init__(self, forward, input_names, variable_axes, fuse=True, pool=None, allocate=_numpy_allocate, buckets=None,
+                 timer=None, pb_utils=None, model_name=""):
+        self.forward = forward
+        self.input_names = input_names
+        self.variable_axes = variable_axes
+        self.fuse = fuse
+        self.pool = pool
+        self.allocate = allocate
+        self.buckets = buckets
+        self.timer = timer
+        self.pb_utils = pb_utils
+        self.model_name = model_name
+
+        self.fallbacks = 0
+        self.fallback_metric = None
+        if fuse and (pb_utils is not None) and hasattr(pb_utils, "MetricFamily"):
+            self.fallback_family = pb_utils.MetricFamily(
+                name="fused_batch_fallbacks_total",
+                description="Dynamic batches whose fused forward pass failed and that were run one request at a time",
+                kind=pb_utils.MetricFamily.COUNTER
+            )
+            self.fallback_metric = self.fallback_family.Metric(labels={"model": model_name})
+
+    def pad(self, inputs):
+        """Pad the inputs of a single request up to their buckets, if bucketing is enabled."""
+        if self.buckets is None:
+            return inputs
+        padded, _ = fuse_inputs([inputs], self.input_names, self.variable_axes, self.pool, self.allocate, self.buckets)
+        if self.timer is not None:
+            self.timer.lap("fuse")
+        return padded
+
+    def run(self, all_inputs):
+        """Run every request of the batch, returning the per-request outputs and error messages."""
+        all_outputs = [None] * len(all_inputs)
+        err_msgs = ["none"] * len(all_inputs)
+
+        if self.fuse and (len(all_inputs) > 1):
+            try:
+                fused_inputs, row_counts = fuse_inputs(all_inputs, self.input_names, self.variable_axes, self.pool, self.allocate, self.buckets)
+                if self.timer is not None:
+                    self.timer.lap("fuse")
+
+                all_outputs = split_outputs(self.forward(fused_inputs, reuse_buffers=True), row_counts)
+                if self.timer is not None:
+                    self.timer.lap("split")
+                return all_outputs, err_msgs
+            except Exception as ex:
+                self._fuse_failed(ex, len(all_inputs)) # fall through to running requests one at a time
+
+        for idx, inputs in enumerate(all_inputs):
+            try:
+                all_outputs[idx] = self.forward(self.pad(inputs), reuse_buffers=(len(all_inputs) == 1))
+            except Exception as ex:
+                err_msgs[idx] = f"Error during inference: {str(ex)}"
+
+        return all_outputs, err_msgs
+
+    def _fuse_failed(self, ex, num_requests):
+        self.fallbacks += 1
+        if self.fallback_metric is not None:
+            self.fallback_metric.increment(1)
+        if (self.fallbacks == 1) or (self.fallbacks % self.LOG_EVERY == 0):
+            message = (f"Fused forward pass of {num_requests} requests of {self.model_name} failed ({self.fallbacks} so far), "
+                       f"running them one at a time: {ex}")
+            if hasattr(self.pb_utils, "Logger"):
+                self.pb_utils.Logger.log_warn(message)
+            else:
+                print(message, file=sys.stderr, flush=True)
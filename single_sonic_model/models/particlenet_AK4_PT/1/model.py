@@ -1,15 +1,22 @@
 import os
-from enum import Enum
+import sys
 import json
+import time
 import numpy as np
-import pickle
 import torch
 import triton_python_backend_utils as pb_utils
 
-class InputDumpSetting(Enum):
-    NEVER = 0
-    ALWAYS = 1
-    ON_FAILURE = 2
+from batching import BufferPool, RequestRunner, get_pad_buckets, get_variable_axes
+from replay_dump import UNKNOWN_ID, InputDumpSetting, DumpMetrics, DumpPolicy, DumpStats, DumpWriter, get_config_parameter, get_dump_setting
+from stage_timing import StageMetrics, StageTimer
+from model_cache import cache_path, publish, temporary_path
+from result_cache import ResultCache, ResultCacheMetrics
+
+# Stages of execute() timed when the stage_timing parameter is enabled
+STAGES = ("inputs", "cache", "fuse", "to_device", "forward", "outputs", "split", "responses", "dump")
+
+# Values of the torch_optimize parameter: load as is, torch.jit.freeze, or freeze and optimize_for_inference
+TORCH_OPTIMIZE_MODES = ("none", "freeze", "optimize")
 
 class TritonPythonModel:
     def initialize(self, args):
@@ -17,12 +24,11 @@ class TritonPythonModel:
         self.replay_dump_dir = "/dumps"
         self.device = torch.device("cuda:0")
 
-        model_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model.pt")
-        self.model = torch.jit.load(model_path, map_location=self.device).to(self.device)
-        self.model.eval()
-
         model_config = json.loads(args["model_config"])
         self.model_name = model_config["name"]
+
+        model_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model.pt")
+        self.model = self._load_model(model_path, model_config)
         
         self.input_names = [i["name"] for i in model_config["input"]]
         self.output_names = [i["name"] for i in model_config["output"]]
@@ -31,58 +37,324 @@ class TritonPythonModel:
         for out_name in self.output_names:
             out_config = pb_utils.get_output_config_by_name(model_config, out_name)
             self.output_dtypes.append(pb_utils.triton_string_to_numpy(out_config["data_type"]))
+        self.output_torch_dtypes = [torch.from_numpy(np.empty(0, dtype=dtype)).dtype for dtype in self.output_dtypes]
+
+        # "numpy" reads inputs with as_numpy() and returns numpy outputs. "dlpack" hands tensors between
+        # Triton and torch through DLPack instead, so outputs never leave the device in this code.
+        self.tensor_transfer = get_config_parameter(model_config, "tensor_transfer", "numpy").lower()
+        if self.tensor_transfer not in ("numpy", "dlpack"):
+            raise ValueError(f"Unknown tensor_transfer '{self.tensor_transfer}', expected 'numpy' or 'dlpack'")
+
+        # Fused inputs and host copies of outputs are written to buffers reused across calls
+        self.buffer_pool = BufferPool()
+
+        # Requests in a dynamic batch are run as one forward pass, padding variable-length axes as needed
+        self.variable_axes = get_variable_axes(model_config)
+        fuse_string = get_config_parameter(model_config, "fuse_requests", "true").lower()
+        self.fuse_requests = (fuse_string == "true") and (model_config.get("max_batch_size", 0) > 0)
+
+        # Optionally pad variable-length axes up to a few bucket lengths, so the model sees few distinct shapes
+        particle_buckets = [int(v) for v in get_config_parameter(model_config, "pad_particle_buckets", "").split(",") if v.strip()]
+        sv_buckets = [int(v) for v in get_config_parameter(model_config, "pad_sv_buckets", "").split(",") if v.strip()]
+        self.pad_buckets = get_pad_buckets(model_config, particle_buckets, sv_buckets)
+
+        # Configure input dumping based on custom model config parameters
+        self.input_dump_setting = get_dump_setting(model_config)
+        self.dump_stats = DumpStats()
+        self.dump_policy = DumpPolicy.from_config(model_config, self.dump_stats)
+
+        # Recording outputs as well lets replays be checked against what production returned
+        self.dump_outputs = get_config_parameter(model_config, "dump_outputs", "false").lower() == "true"
+
+        # Optional per-row cache of results, keyed by the model version and input bytes. It is never
+        # used when dumping on failure, where every request has to run to show whether it fails.
+        self.result_cache = None
+        self.result_cache_metrics = None
+        if (get_config_parameter(model_config, "result_cache", "false").lower() == "true"):
+            if (self.input_dump_setting == InputDumpSetting.ON_FAILURE):
+                print(f"Result cache of {self.model_name} disabled, dump_input is on_failure", flush=True)
+            elif (self.tensor_transfer == "dlpack"):
+                raise ValueError("result_cache needs tensor_transfer 'numpy', device tensors cannot be hashed")
+            else:
+                max_mb = float(get_config_parameter(model_config, "result_cache_mb", "256"))
+                self.result_cache = ResultCache(int(max_mb * 1e6), f"{self.model_name}:{args.get('model_version', '')}")
+                if hasattr(pb_utils, "MetricFamily"):
+                    self.result_cache_metrics = ResultCacheMetrics(pb_utils, self.model_name)
+
+        # Dumps are written by a background thread so responses are not held up by disk I/O
+        self.dump_writer = None
+        if (self.input_dump_setting != InputDumpSetting.NEVER):
+            self.dump_writer = DumpWriter.from_config(model_config, self.replay_dump_dir, args["model_instance_name"], self.dump_stats)
 
-        # Configure input dumping based on custom model config parameter
-        self.input_dump_setting = InputDumpSetting.NEVER
-        config_dump_string = model_config.get("parameters", {}).get("dump_input", {}).get("string_value", "").lower()
-        if (config_dump_string == "always"):
-            self.input_dump_setting = InputDumpSetting.ALWAYS
-        elif (config_dump_string == "on_failure"):
-            self.input_dump_setting = InputDumpSetting.ON_FAILURE
+        # Each execute() call gets an id, so dumps record which requests the dynamic batcher grouped together
+        self.instance_name = args["model_instance_name"]
+        self.execute_count = 0
+
+        # Export dump counters as Triton custom metrics, if the server supports them
+        self.dump_metrics = None
+        if (self.dump_writer is not None) and hasattr(pb_utils, "MetricFamily"):
+            self.dump_metrics = DumpMetrics(pb_utils, self.model_name)
+
+        # Per-stage timing of execute(), off by default. When off, stage_timer is None and each stage costs a single comparison.
+        self.stage_timer = None
+        self.stage_metrics = None
+        if (get_config_parameter(model_config, "stage_timing", "false").lower() == "true"):
+            self.stage_timer = StageTimer(STAGES)
+            if hasattr(pb_utils, "MetricFamily"):
+                self.stage_metrics = StageMetrics(pb_utils, self.model_name, STAGES)
+
+        # Runs the requests of each execute() call, fused into one forward pass where possible
+        self.runner = RequestRunner(self._forward, self.input_names, self.variable_axes, fuse=self.fuse_requests, pool=self.buffer_pool,
+                                    allocate=self._allocate, buckets=self.pad_buckets, timer=self.stage_timer, pb_utils=pb_utils, model_name=self.model_name)
+
+        # The instance reports ready once initialize() returns, so warm up before that
+        self._warmup(model_config)
 
     def execute(self, requests):
+        execute_start = time.time()
+        self.execute_count += 1
+        batch_id = f"{self.instance_name}:{self.execute_count}"
+
+        timer = self.stage_timer
+        if timer is not None:
+            timer.begin()
+
         responses = []
+        all_inputs = [self._read_inputs(request) for request in requests]
+        if timer is not None:
+            timer.lap("inputs")
 
-        with torch.no_grad():
-            for request in requests:
-                err_msg = "none"
-                request_inputs = {name: pb_utils.get_input_tensor_by_name(request, name).as_numpy() for name in self.input_names}
-                
-                try:
-                    model_inputs = [torch.from_numpy(request_inputs[name]).to(self.device) for name in self.input_names]
-                    output_tensors = self.model(*model_inputs)
-
-                    # Treat as single tensor if only one ouptut, or as tuple otherwise
-                    if (len(self.output_names) == 1):
-                        output_tensor = output_tensors.cpu().numpy().astype(self.output_dtypes[0])
-                        outputs = [pb_utils.Tensor(self.output_names[0], output_tensor)] # outputs must be list
-                    else:
-                        outputs = []
-                        for idx, name in enumerate(self.output_names):
-                            output_tensor = output_tensors[idx].cpu().numpy().astype(self.output_dtypes[idx])
-                            outputs.append(pb_utils.Tensor(name, output_tensor))
-                    
-                    response = pb_utils.InferenceResponse(output_tensors=outputs)
+        if self.result_cache is not None:
+            all_outputs, err_msgs = self.result_cache.run(all_inputs, self.input_names, self.runner.run, timer)
+        else:
+            all_outputs, err_msgs = self.runner.run(all_inputs)
+        execute_end = time.time()
 
-                except Exception as ex:
-                    err_msg = f"Error during inference: {str(ex)}"
-                    response = pb_utils.InferenceResponse(error=pb_utils.TritonError(err_msg))
-
-                # Dump inputs if configured
-                if (self.input_dump_setting == InputDumpSetting.ALWAYS) or (self.input_dump_setting == InputDumpSetting.ON_FAILURE and err_msg != "none"):
-                    req_id = request.request_id() # Returns a client-specified id or empty string
-                    if (req_id == ""):
-                        req_id = "UNKNOWN_ID"
-                    
-                    err_dict = {
-                        "id": req_id,
-                        "model": self.model_name,
-                        "message": err_msg,
-                        "inputs": request_inputs
-                    }
-                    with open(f"{self.replay_dump_dir}/{req_id}.pkl", "wb") as f:
-                        pickle.dump(err_dict, f)
+        for batch_index, (request, request_inputs, request_outputs, err_msg) in enumerate(zip(requests, all_inputs, all_outputs, err_msgs)):
+            if (err_msg == "none"):
+                outputs = [self._output_tensor(name, request_outputs[idx]) for idx, name in enumerate(self.output_names)]
+                response = pb_utils.InferenceResponse(output_tensors=outputs)
+            else:
+                response = pb_utils.InferenceResponse(error=pb_utils.TritonError(err_msg))
+            if timer is not None:
+                timer.lap("responses")
+
+            # Dump inputs if configured
+            if (self.dump_writer is not None) and self.dump_policy.admit(err_msg != "none"):
+                req_id = request.request_id() # Returns a client-specified id or empty string
+                if (req_id == ""):
+                    req_id = UNKNOWN_ID
                 
-                responses.append(response)
-        
+                # Input arrays may be backed by request memory that Triton frees once responses are sent,
+                # so the writer thread gets its own copies.
+                err_dict = {
+                    "id": req_id,
+                    "model": self.model_name,
+                    "message": err_msg,
+                    "timestamp": time.time(),
+                    "execute_start": execute_start,
+                    "execute_end": execute_end,
+                    "batch_id": batch_id,
+                    "batch_index": batch_index,
+                    "batch_requests": len(requests),
+                    "inputs": {name: self._host_copy(val) for name, val in request_inputs.items()}
+                }
+                if self.dump_outputs and (err_msg == "none"):
+                    err_dict["outputs"] = {name: self._host_copy(request_outputs[idx]) for idx, name in enumerate(self.output_names)}
+                self.dump_writer.submit(err_dict)
+                if timer is not None:
+                    timer.lap("dump")
+            
+            responses.append(response)
+
+        if self.dump_metrics is not None:
+            self.dump_metrics.publish(self.dump_stats)
+        if self.result_cache_metrics is not None:
+            self.result_cache_metrics.publish(self.result_cache)
+        if (timer is not None) and (self.stage_metrics is not None):
+            self.stage_metrics.observe(timer.finish())
         return responses
+
+    def _forward(self, inputs, reuse_buffers=False):
+        """
+        Run one forward pass on a dict of numpy arrays or torch tensors, returning a list of numpy
+        outputs, or of torch tensors on the device with DLPack transfer. With reuse_buffers, host
+        outputs may be views on pooled buffers that the next call overwrites.
+        """
+        timer = self.stage_timer
+        with torch.no_grad():
+            # from_numpy shares memory, and .to() is a no-op for tensors already on the device
+            model_inputs = [self._as_tensor(inputs[name]).to(self.device) for name in self.input_names]
+            if timer is not None:
+                self._synchronize()
+                timer.lap("to_device")
+
+            output_tensors = self.model(*model_inputs)
+            if timer is not None:
+                self._synchronize()
+                timer.lap("forward")
+
+        # Treat as single tensor if only one ouptut, or as tuple otherwise
+        if (len(self.output_names) == 1):
+            output_tensors = (output_tensors,)
+
+        outputs = [self._convert_output(idx, output_tensors[idx], reuse_buffers) for idx in range(len(self.output_names))]
+        if timer is not None:
+            timer.lap("outputs")
+        return outputs
+
+    def _load_model(self, model_path, model_config):
+        """
+        Load the TorchScript model, frozen and optimized for inference as set by torch_optimize.
+        The optimized module is saved to the cache on the first load and read back on later ones.
+        """
+        mode = get_config_parameter(model_config, "torch_optimize", "optimize").lower()
+        if mode not in TORCH_OPTIMIZE_MODES:
+            raise ValueError(f"Unknown torch_optimize '{mode}', expected one of {', '.join(TORCH_OPTIMIZE_MODES)}")
+
+        start = time.perf_counter()
+        cached = None
+        cache_dir = get_config_parameter(model_config, "torch_cache_dir", os.path.join(os.path.dirname(model_path), "torch_cache"))
+        if (mode != "none") and (cache_dir.lower() != "none"):
+            # Frozen modules hold their weights as constants on the device they were frozen on
+            cached = cache_path(cache_dir, model_path, [torch.__version__, self.device.type, mode], ".pt")
+            if os.path.isfile(cached):
+                try:
+                    model = torch.jit.load(cached, map_location=self.device)
+                    print(f"Loaded TorchScript model for {self.model_name} (torch_optimize={mode}) from {cached} in {time.perf_counter() - start:.2f} s", flush=True)
+                    return model
+                except Exception as ex:
+                    print(f"Could not load cached TorchScript model {cached}, optimizing the model again: {ex}", file=sys.stderr, flush=True)
+
+        model = torch.jit.load(model_path, map_location=self.device).to(self.device)
+        model.eval()
+        if (mode == "none"):
+            print(f"Loaded TorchScript model for {self.model_name} in {time.perf_counter() - start:.2f} s", flush=True)
+            return model
+
+        try:
+            model = torch.jit.freeze(model)
+            if (mode == "optimize"):
+                model = torch.jit.optimize_for_inference(model)
+        except Exception as ex:
+            # Freezing is only an optimization, the model still works as loaded
+            print(f"Could not {mode} TorchScript model for {self.model_name}, using it as loaded: {ex}", file=sys.stderr, flush=True)
+            return model
+
+        message = f"Loaded TorchScript model for {self.model_name} (torch_optimize={mode}) in {time.perf_counter() - start:.2f} s"
+        if cached is not None:
+            temporary = None
+            try:
+                temporary = temporary_path(cached)
+                torch.jit.save(model, temporary)
+                publish(temporary, cached)
+                message += f", cached in {cached}"
+            except Exception as ex:
+                print(f"Could not cache the TorchScript model (torch_optimize={mode}) in {cache_dir}: {ex}", file=sys.stderr, flush=True)
+                if (temporary is not None) and os.path.exists(temporary):
+                    os.remove(temporary)
+        print(message, flush=True)
+        return model
+
+    def _warmup(self, model_config):
+        """
+        Run the model on every shape bucket of warmup_batch_sizes x warmup_particles x
+        warmup_sv_particles (the padding buckets by default, if configured), so that the first
+        requests of each shape do not pay for TorchScript's profiling and specialization. Inputs
+        whose name starts with "sv_" get the SV count along their variable-length axes, all
+        others the particle count.
+        """
+        batch_sizes = [int(v) for v in get_config_parameter(model_config, "warmup_batch_sizes", "").split(",") if v.strip()]
+        if not batch_sizes:
+            return
+        # With bucketing, the buckets are the only lengths the model sees
+        default_particles = get_config_parameter(model_config, "pad_particle_buckets", "100")
+        default_sv = get_config_parameter(model_config, "pad_sv_buckets", "10")
+        particle_counts = [int(v) for v in get_config_parameter(model_config, "warmup_particles", default_particles).split(",") if v.strip()]
+        sv_counts = [int(v) for v in get_config_parameter(model_config, "warmup_sv_particles", default_sv).split(",") if v.strip()]
+        iterations = max(1, int(get_config_parameter(model_config, "warmup_iterations", "3")))
+
+        input_configs = {inp["name"]: inp for inp in model_config["input"]}
+        batched = model_config.get("max_batch_size", 0) > 0
+        rng = np.random.default_rng(0)
+
+        start = time.perf_counter()
+        for batch_size in batch_sizes:
+            for num_particles in particle_counts:
+                for num_sv in sv_counts:
+                    inputs = {}
+                    for name in self.input_names:
+                        inp = input_configs[name]
+                        length = num_sv if name.startswith("sv_") else num_particles
+                        shape = ([batch_size] if batched else []) + [length if int(dim) == -1 else int(dim) for dim in inp["dims"]]
+                        # Masks are all ones, as for inputs that fill every slot
+                        values = np.ones(shape) if ("mask" in name) else rng.standard_normal(shape)
+                        inputs[name] = values.astype(pb_utils.triton_string_to_numpy(inp["data_type"]))
+
+                    times = []
+                    try:
+                        for _ in range(iterations):
+                            iteration_start = time.perf_counter()
+                            self._forward(self.runner.pad(inputs), reuse_buffers=True)
+                            self._synchronize()
+                            times.append(time.perf_counter() - iteration_start)
+                    except Exception as ex:
+                        print(f"Warmup of {self.model_name} failed on batch {batch_size}, {num_particles} particles, {num_sv} SVs: {ex}", file=sys.stderr, flush=True)
+                        continue
+                    print(f"Warmup of {self.model_name} on batch {batch_size}, {num_particles} particles, {num_sv} SVs: "
+                          f"first {times[0] * 1000:.1f} ms, last {times[-1] * 1000:.1f} ms", flush=True)
+
+        print(f"Warmed up {self.model_name} in {time.perf_counter() - start:.2f} s", flush=True)
+
+    def _read_inputs(self, request):
+        if (self.tensor_transfer == "dlpack"):
+            return {name: torch.utils.dlpack.from_dlpack(pb_utils.get_input_tensor_by_name(request, name).to_dlpack()) for name in self.input_names}
+        return {name: pb_utils.get_input_tensor_by_name(request, name).as_numpy() for name in self.input_names}
+
+    def _as_tensor(self, value):
+        return torch.from_numpy(value) if isinstance(value, np.ndarray) else value
+
+    def _allocate(self, size, like):
+        # Torch inputs (DLPack transfer) are fused straight into a device buffer
+        if torch.is_tensor(like):
+            return torch.empty(size, dtype=like.dtype, device=self.device)
+        return np.empty(size, dtype=like.dtype)
+
+    def _convert_output(self, idx, tensor, reuse_buffers):
+        if (self.tensor_transfer == "dlpack"):
+            return tensor.to(self.output_torch_dtypes[idx]) # no-op when the dtype already matches
+
+        if (tensor.device.type != "cpu"):
+            if reuse_buffers:
+                host = self.buffer_pool.get(("output", idx), tuple(tensor.shape),
+                                            lambda size: torch.empty(size, dtype=tensor.dtype, pin_memory=True))
+                tensor = host.copy_(tensor)
+            else:
+                tensor = tensor.cpu()
+
+        # Skips the copy when the model already returns the configured dtype
+        return tensor.numpy().astype(self.output_dtypes[idx], copy=False)
+
+    def _output_tensor(self, name, value):
+        if torch.is_tensor(value):
+            return pb_utils.Tensor.from_dlpack(name, torch.utils.dlpack.to_dlpack(value.contiguous()))
+        return pb_utils.Tensor(name, value)
+
+    def _host_copy(self, value):
+        """Copy an input or output into a new numpy array, for the dump writer thread to own."""
+        if torch.is_tensor(value):
+            host = value.detach().cpu()
+            # .cpu() already copied tensors off the GPU, CPU tensors still share Triton's memory
+            return host.numpy() if (value.device.type != "cpu") else host.numpy().copy()
+        return np.array(value, copy=True)
+
+    def _synchronize(self):
+        # CUDA work is asynchronous, so stage timing waits for it to finish to charge it to the right stage
+        if (self.device.type == "cuda"):
+            torch.cuda.synchronize(self.device)
+
+    def finalize(self):
+        # Make sure every queued dump reaches disk before the model is unloaded
+        if self.dump_writer is not None:
+            self.dump_writer.close()
+            print(f"Dump counters for {self.model_name}: {self.dump_stats.snapshot()}", flush=True)
@@ -0,0 +1,35 @@
+"""
+On-disk cache of artifacts derived from a model file, such as optimized graphs, so the work of
+producing them is paid on the first load rather than on every one.
+
+Artifacts are keyed by a hash of the model file's contents plus whatever else they depend on
+(library versions, providers, ...), so replacing the model file or upgrading the runtime simply
+misses the cache. Entries are written to a temporary file and renamed into place, which lets
+several model instances start at once without reading a half-written artifact.
+"""
+
+import os
+import hashlib
+
+def file_digest(path, chunk_size=1 << 20):
+    """SHA-256 of a file's contents, as a hex string."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_path(cache_dir, model_path, key_parts, suffix):
+    """Path in cache_dir of the artifact derived from model_path with the given key parts."""
+    key = hashlib.sha256("\0".join([file_digest(model_path)] + [str(part) for part in key_parts]).encode()).hexdigest()
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(cache_dir, f"{name}.{key[:16]}{suffix}")
+
+def temporary_path(path):
+    """A temporary path next to path, unique to this process, to write an entry before publish()."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return f"{path}.{os.getpid()}.tmp"
+
+def publish(temporary, path):
+    """Atomically move a finished entry into place."""
+    os.replace(temporary, path)
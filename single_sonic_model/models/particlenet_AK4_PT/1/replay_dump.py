@@ -0,0 +1,643 @@
+import os
+import re
+import sys
+import time
+import uuid
+import queue
+import random
+import threading
+from enum import Enum
+from collections import OrderedDict
+
+from dump_format import (ALIGNMENT, BLOB_DIR, BLOB_EXTENSION, DUMP_EXTENSION, SEGMENT_EXTENSION, INDEX_EXTENSION,
+                         DumpCodec, blob_path, estimate_record_nbytes, is_tensor_group, read_header, write_blobs,
+                         write_dump_file, write_record)
+
+class InputDumpSetting(Enum):
+    NEVER = 0
+    ALWAYS = 1
+    ON_FAILURE = 2
+    SAMPLED = 3 # every failure, plus a random fraction of successful requests
+
+class DumpQueuePolicy(Enum):
+    BLOCK = 0 # execute() waits for room in the queue, no dumps are lost
+    DROP = 1  # dumps are discarded when the queue is full, execute() never waits
+
+# Outcomes counted by DumpStats, and exported as metric labels
+DUMP_COUNTERS = (
+    "dumped",
+    "dropped_sampling",
+    "dropped_rate_limit",
+    "dropped_queue_full",
+    "dropped_quota",
+    "evicted",
+    "write_errors",
+)
+
+# With a disk quota, log segments are capped to this fraction of it, since the quota is enforced by evicting whole segments
+LOG_SEGMENTS_PER_QUOTA = 8
+
+# Request id recorded for requests sent without one
+UNKNOWN_ID = "UNKNOWN_ID"
+
+def get_config_parameter(model_config, key, default=""):
+    """Read a custom string parameter from the model config, returning default if unset."""
+    value = model_config.get("parameters", {}).get(key, {}).get("string_value", "")
+    return value if value != "" else default
+
+def get_dump_setting(model_config):
+    """Parse the "dump_input" model config parameter into an InputDumpSetting."""
+    config_dump_string = get_config_parameter(model_config, "dump_input").lower()
+    if (config_dump_string == "always"):
+        return InputDumpSetting.ALWAYS
+    elif (config_dump_string == "on_failure"):
+        return InputDumpSetting.ON_FAILURE
+    elif (config_dump_string == "sampled"):
+        return InputDumpSetting.SAMPLED
+    return InputDumpSetting.NEVER
+
+def record_instance(record):
+    """The model instance that wrote a dump record, taken from its batch id ("<instance>:<execute count>")."""
+    return record.get("batch_id", "").rpartition(":")[0]
+
+def is_failure(record):
+    return record.get("message", "none") != "none"
+
+class DumpStats:
+    """Thread-safe counters of what happened to each request considered for dumping."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(DUMP_COUNTERS, 0)
+        self._drained = dict.fromkeys(DUMP_COUNTERS, 0)
+
+    def count(self, kind, n=1):
+        with self._lock:
+            self._counts[kind] += n
+
+    def snapshot(self):
+        """Return the current totals of all counters."""
+        with self._lock:
+            return dict(self._counts)
+
+    def drain(self):
+        """Return how much each counter has grown since the previous call to drain()."""
+        with self._lock:
+            deltas = {kind: self._counts[kind] - self._drained[kind] for kind in DUMP_COUNTERS}
+            self._drained = dict(self._counts)
+        return deltas
+
+class TokenBucket:
+    """Allows on average `rate` events per second, with bursts of up to `burst` events."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._last = time.monotonic()
+
+    def try_take(self, reserve=0.0):
+        """Take a token if at least `reserve` tokens would be left afterwards."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+        if (self.tokens - 1 >= reserve):
+            self.tokens -= 1
+            return True
+        return False
+
+class DumpPolicy:
+    """
+    Decides on the request path whether a request gets dumped, before any inputs are copied.
+    Failures always take priority over successful requests: successes are subject to sampling,
+    and may only use the part of the rate limit's burst that is not held in reserve for failures.
+    """
+
+    def __init__(self, setting, stats, sample_rate=1.0, rate_limit=None, rate_burst=None):
+        self.setting = setting
+        self.stats = stats
+        self.sample_rate = sample_rate
+        self._rng = random.Random()
+
+        self.bucket = None
+        self.success_reserve = 0.0
+        if rate_limit is not None:
+            burst = rate_burst if (rate_burst is not None) else max(2.0, rate_limit)
+            self.bucket = TokenBucket(rate_limit, burst)
+            self.success_reserve = max(0.0, min(burst / 2, burst - 1))
+
+    @classmethod
+    def from_config(cls, model_config, stats):
+        """
+        Build a policy from the "dump_input", "dump_sample_rate", "dump_rate_limit" and
+        "dump_rate_burst" config parameters.
+        """
+        sample_rate = float(get_config_parameter(model_config, "dump_sample_rate", "1.0"))
+        rate_limit = get_config_parameter(model_config, "dump_rate_limit", None)
+        rate_burst = get_config_parameter(model_config, "dump_rate_burst", None)
+        return cls(
+            get_dump_setting(model_config),
+            stats,
+            sample_rate=sample_rate,
+            rate_limit=float(rate_limit) if rate_limit is not None else None,
+            rate_burst=float(rate_burst) if rate_burst is not None else None
+        )
+
+    def admit(self, failed):
+        """Return True if a request with the given outcome should be dumped."""
+        if (self.setting == InputDumpSetting.NEVER):
+            return False
+        if (self.setting == InputDumpSetting.ON_FAILURE) and not failed:
+            return False
+
+        if (self.setting == InputDumpSetting.SAMPLED) and not failed:
+            if (self._rng.random() >= self.sample_rate):
+                self.stats.count("dropped_sampling")
+                return False
+
+        if self.bucket is not None:
+            if not self.bucket.try_take(reserve=0.0 if failed else self.success_reserve):
+                self.stats.count("dropped_rate_limit")
+                return False
+
+        return True
+
+class FileDumpStore:
+    """
+    Stores each dump record in its own file, named after the request id. With track_usage,
+    the store keeps the size of its dumps so that the oldest can be evicted to stay within a
+    disk quota; successful requests are always evicted before failures.
+
+    Several model instances may dump to the same directory. Given an instance_name, usage only
+    counts the dumps written by that instance, and only those are evicted, so the quota applies
+    to each instance separately. Without one, every dump in the directory is counted.
+    """
+
+    def __init__(self, dump_dir, codec=None, track_usage=False, instance_name=None):
+        self.dump_dir = dump_dir
+        self.codec = codec
+        self.track_usage = track_usage
+        self.instance_name = instance_name
+
+        # path -> size, oldest first, kept separately so successes can be evicted before failures
+        self._successes = OrderedDict()
+        self._failures = OrderedDict()
+        self._usage = 0
+
+        if track_usage:
+            self._scan()
+
+    def write(self, record):
+        """Write a record, returning the number of bytes it occupies on disk."""
+        path = self._dump_path(record)
+        size = write_dump_file(path, record, self.codec)
+        if self.track_usage:
+            self._track(path, size, is_failure(record))
+        return size
+
+    def usage(self):
+        return self._usage
+
+    def evict_oldest(self, include_failures):
+        """Delete the oldest dump of a successful request (or failed one, if allowed). Returns False if there is none."""
+        if self._successes:
+            entries = self._successes
+        elif include_failures and self._failures:
+            entries = self._failures
+        else:
+            return False
+
+        path, size = entries.popitem(last=False)
+        self._usage -= size
+        self._remove(path)
+        return True
+
+    def close(self):
+        pass
+
+    def _dump_path(self, record):
+        return os.path.join(self.dump_dir, f"{record['id']}{DUMP_EXTENSION}")
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _track(self, path, size, failed):
+        # A repeated request id overwrites the earlier dump
+        for entries in (self._successes, self._failures):
+            old_size = entries.pop(path, None)
+            if old_size is not None:
+                self._usage -= old_size
+
+        (self._failures if failed else self._successes)[path] = size
+        self._usage += size
+
+    def _scan(self):
+        """Account for the dumps of this instance already in the directory, oldest first."""
+        existing = []
+        for f in os.listdir(self.dump_dir):
+            if f.endswith(DUMP_EXTENSION) and not f.startswith("."):
+                path = os.path.join(self.dump_dir, f)
+                try:
+                    st = os.stat(path)
+                    header = read_header(path)
+                except (OSError, ValueError):
+                    continue
+                if (self.instance_name is not None) and (record_instance(header) != self.instance_name):
+                    continue
+                existing.append((st.st_mtime, path, st.st_size, header))
+
+        for _, path, size, header in sorted(existing, key=lambda e: e[:2]):
+            self._track_existing(path, size, header)
+
+    def _track_existing(self, path, size, header):
+        self._track(path, size, header.get("message", "none") != "none")
+
+class DedupDumpStore(FileDumpStore):
+    """
+    Stores tensors as content-addressed chunks of chunk_nbytes in a blob directory, and each
+    record as a small manifest file listing the chunks of its tensors. A chunk that is already
+    stored is not written again, so requests resent with the same inputs cost one manifest each.
+    Requests without an id get a unique manifest name instead of overwriting each other.
+
+    Each model instance has its own blob directory (blobs/<instance_name>), so that it is the
+    only writer of its blobs and can delete them itself. With track_usage, the store counts
+    how many of its manifests reference each blob, and a blob is deleted as soon as the last
+    manifest referencing it is evicted or overwritten. Usage is then the size of its manifests
+    plus the size of every blob in the instance's blob directory.
+    """
+
+    def __init__(self, dump_dir, instance_name, chunk_nbytes=1024 * 1024, codec=None, track_usage=False):
+        if (chunk_nbytes <= 0) or (chunk_nbytes % ALIGNMENT != 0):
+            raise ValueError(f"Dump chunk size must be a positive multiple of {ALIGNMENT} bytes, got {chunk_nbytes}")
+        self.chunk_nbytes = chunk_nbytes
+        self.blob_dir = os.path.join(BLOB_DIR, instance_name)
+
+        self._chunks = {}     # manifest path -> set of blob keys it references
+        self._refs = {}       # blob key -> number of tracked manifests referencing it
+        self._blob_sizes = {} # blob key -> size on disk
+        super().__init__(dump_dir, codec=codec, track_usage=track_usage, instance_name=instance_name)
+
+    def write(self, record):
+        """Write the blobs of a record that are not stored yet and its manifest, returning the bytes written."""
+        manifest = {}
+        new_blobs = {}
+        for key, value in record.items():
+            if is_tensor_group(value):
+                refs = {}
+                for name, arr in value.items():
+                    refs[name], written = write_blobs(self.dump_dir, self.blob_dir, arr, self.chunk_nbytes, self.codec)
+                    new_blobs.update(written)
+                manifest[key] = refs
+            else:
+                manifest[key] = value
+
+        path = self._dump_path(record)
+        size = write_dump_file(path, manifest)
+        if self.track_usage:
+            for key, nbytes in new_blobs.items():
+                self._usage += nbytes - self._blob_sizes.get(key, 0)
+                self._blob_sizes[key] = nbytes
+            chunks = {key for refs in manifest.values() if is_tensor_group(refs) for ref in refs.values() for key in ref.chunks}
+            self._reference(path, chunks)
+            self._track(path, size, is_failure(record))
+        return size + sum(new_blobs.values())
+
+    def _dump_path(self, record):
+        name = record["id"]
+        if (name == UNKNOWN_ID):
+            name = f"{UNKNOWN_ID}-{uuid.uuid4().hex[:12]}"
+        return os.path.join(self.dump_dir, f"{name}{DUMP_EXTENSION}")
+
+    def _reference(self, path, chunks):
+        # References are added before the ones of an overwritten manifest are released, so shared blobs survive
+        for key in chunks:
+            self._refs[key] = self._refs.get(key, 0) + 1
+        self._release(self._chunks.pop(path, ()))
+        if chunks:
+            self._chunks[path] = chunks
+
+    def _release(self, chunks):
+        for key in chunks:
+            self._refs[key] -= 1
+            if (self._refs[key] > 0):
+                continue
+            del self._refs[key]
+            self._usage -= self._blob_sizes.pop(key, 0)
+            try:
+                os.remove(blob_path(self.dump_dir, self.blob_dir, key))
+            except FileNotFoundError:
+                pass
+
+    def _remove(self, path):
+        super()._remove(path)
+        self._release(self._chunks.pop(path, ()))
+
+    def _track_existing(self, path, size, header):
+        super()._track_existing(path, size, header)
+        chunks = {key for t in header["tensors"] if t.get("blob_dir") == self.blob_dir for key in t.get("chunks", ())}
+        self._reference(path, chunks)
+
+    def _scan(self):
+        """Account for existing manifests, then for their blobs, deleting blobs none of them reference."""
+        super()._scan()
+
+        blob_root = os.path.join(self.dump_dir, self.blob_dir)
+        if not os.path.isdir(blob_root):
+            return
+        for root, _, files in os.walk(blob_root):
+            for name in files:
+                path = os.path.join(root, name)
+                key = name[:-len(BLOB_EXTENSION)]
+                if name.startswith(".") or not name.endswith(BLOB_EXTENSION) or (key not in self._refs):
+                    os.remove(path) # orphaned blob or temporary file of an interrupted write
+                    continue
+                self._blob_sizes[key] = os.path.getsize(path)
+                self._usage += self._blob_sizes[key]
+
+class LogDumpStore:
+    """
+    Appends dump records to rolling segment files, so that dumping every request does not
+    create one file per request. Each segment <prefix>.<seq>.seg has a side index
+    <prefix>.<seq>.idx with one "request_id<TAB>offset<TAB>length<TAB>failed" line per record,
+    which lets readers find a record with a single seek. A new segment is started once the
+    current one exceeds max_bytes or has been open for max_seconds.
+
+    For disk quotas, whole closed segments are evicted, oldest first, preferring segments that
+    hold no failures. The segment being written is only closed and evicted once no closed
+    segment is left to evict, so max_bytes should be a small fraction of the quota.
+    """
+
+    def __init__(self, dump_dir, prefix, max_bytes=256 * 1024 * 1024, max_seconds=3600, codec=None, track_usage=False):
+        self.dump_dir = dump_dir
+        self.prefix = re.sub(r"[^A-Za-z0-9_.-]", "_", prefix)
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.codec = codec
+        self.track_usage = track_usage
+
+        self._seg_fd = None
+        self._idx_fd = None
+        self._seg_size = 0
+        self._seg_opened = 0.0
+
+        # seq -> [bytes on disk, holds a failure], oldest first
+        self._segments = OrderedDict()
+        self._usage = 0
+
+        # Continue numbering after any segments left by a previous run of this instance
+        pattern = re.compile(re.escape(self.prefix) + r"\.(\d+)" + re.escape(SEGMENT_EXTENSION) + "$")
+        existing = sorted(int(m.group(1)) for m in map(pattern.match, os.listdir(dump_dir)) if m)
+        self._seq = existing[-1] if existing else -1
+
+        if track_usage:
+            for seq in existing:
+                self._scan_segment(seq)
+
+    def segment_path(self, seq):
+        return os.path.join(self.dump_dir, f"{self.prefix}.{seq:06d}{SEGMENT_EXTENSION}")
+
+    def index_path(self, seq):
+        return os.path.join(self.dump_dir, f"{self.prefix}.{seq:06d}{INDEX_EXTENSION}")
+
+    def write(self, record):
+        """Append a record to the current segment, returning the number of bytes it occupies."""
+        segment_full = (self._seg_size >= self.max_bytes)
+        segment_expired = (time.monotonic() - self._seg_opened >= self.max_seconds)
+        if (self._seg_fd is None) or segment_full or segment_expired:
+            self._rotate()
+
+        # Records start on an aligned offset so their tensors are aligned when memory-mapped
+        pad = -self._seg_size % ALIGNMENT
+        if (pad > 0):
+            os.write(self._seg_fd, bytes(pad))
+            self._seg_size += pad
+
+        offset = self._seg_size
+        length = write_record(self._seg_fd, record, self.codec)
+        self._seg_size += length
+
+        # The index entry is only written once the record is complete
+        failed = is_failure(record)
+        req_id = str(record["id"]).replace("\t", " ").replace("\n", " ")
+        index_line = f"{req_id}\t{offset}\t{length}\t{int(failed)}\n".encode("utf-8")
+        os.write(self._idx_fd, index_line)
+
+        size = pad + length + len(index_line)
+        if self.track_usage:
+            segment = self._segments.setdefault(self._seq, [0, False])
+            segment[0] += size
+            segment[1] = segment[1] or failed
+            self._usage += size
+        return size
+
+    def usage(self):
+        return self._usage
+
+    def evict_oldest(self, include_failures):
+        """Delete the oldest closed segment without failures (or with, if allowed). Returns False if there is none."""
+        closed = [seq for seq in self._segments if seq != self._seq]
+        candidates = [seq for seq in closed if not self._segments[seq][1]]
+        if not candidates and include_failures:
+            candidates = closed
+        if not candidates and (self._seq in self._segments) and (include_failures or not self._segments[self._seq][1]):
+            # Nothing closed is left, so close the current segment (the next write starts a new one) and evict it
+            self.close()
+            candidates = [self._seq]
+        if not candidates:
+            return False
+
+        seq = candidates[0]
+        size, _ = self._segments.pop(seq)
+        self._usage -= size
+        for path in (self.index_path(seq), self.segment_path(seq)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return True
+
+    def close(self):
+        if self._seg_fd is not None:
+            os.close(self._seg_fd)
+            os.close(self._idx_fd)
+            self._seg_fd = None
+            self._idx_fd = None
+
+    def _rotate(self):
+        self.close()
+        self._seq += 1
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        self._seg_fd = os.open(self.segment_path(self._seq), flags, 0o644)
+        self._idx_fd = os.open(self.index_path(self._seq), flags, 0o644)
+        self._seg_size = 0
+        self._seg_opened = time.monotonic()
+
+    def _scan_segment(self, seq):
+        size = 0
+        failed = False
+        for path in (self.segment_path(seq), self.index_path(seq)):
+            if os.path.isfile(path):
+                size += os.path.getsize(path)
+
+        if os.path.isfile(self.index_path(seq)):
+            with open(self.index_path(seq), "rb") as f:
+                failed = any(line.rstrip(b"\n").split(b"\t")[3:4] == [b"1"] for line in f)
+
+        self._segments[seq] = [size, failed]
+        self._usage += size
+
+class DumpMetrics:
+    """Exports the counters of a DumpStats as replay_dump_records_total, labelled by model and outcome."""
+
+    def __init__(self, pb_utils, model_name):
+        self.family = pb_utils.MetricFamily(
+            name="replay_dump_records_total",
+            description="Requests dumped, dropped or evicted by the input dump writer",
+            kind=pb_utils.MetricFamily.COUNTER
+        )
+        self.counters = {kind: self.family.Metric(labels={"model": model_name, "outcome": kind}) for kind in DUMP_COUNTERS}
+
+    def publish(self, stats):
+        # Only called from execute(), never from the dump writer thread
+        for kind, delta in stats.drain().items():
+            if (delta > 0) and (kind in self.counters):
+                self.counters[kind].increment(delta)
+
+def make_dump_store(model_config, dump_dir, instance_name):
+    """
+    Build the dump store selected by the "dump_mode" config parameter ("files", "log" or "dedup"),
+    compressing dumps as set by the "dump_compression" and "dump_shuffle" parameters.
+    """
+    mode = get_config_parameter(model_config, "dump_mode", "files").lower()
+    quota_mb = get_config_parameter(model_config, "dump_quota_mb", None)
+    track_usage = quota_mb is not None
+
+    shuffle = get_config_parameter(model_config, "dump_shuffle", "false").lower() == "true"
+    codec = DumpCodec.from_string(get_config_parameter(model_config, "dump_compression", "none"), shuffle=shuffle)
+
+    if (mode == "files"):
+        return FileDumpStore(dump_dir, codec=codec, track_usage=track_usage, instance_name=instance_name)
+    elif (mode == "log"):
+        max_mb = float(get_config_parameter(model_config, "dump_log_segment_mb", "256"))
+        if track_usage:
+            max_mb = min(max_mb, float(quota_mb) / LOG_SEGMENTS_PER_QUOTA)
+        max_seconds = float(get_config_parameter(model_config, "dump_log_segment_seconds", "3600"))
+        return LogDumpStore(
+            dump_dir,
+            instance_name,
+            max_bytes=int(max_mb * 1024 * 1024),
+            max_seconds=max_seconds,
+            codec=codec,
+            track_usage=track_usage
+        )
+    elif (mode == "dedup"):
+        chunk_kb = float(get_config_parameter(model_config, "dump_chunk_kb", "1024"))
+        return DedupDumpStore(dump_dir, instance_name, chunk_nbytes=int(chunk_kb * 1024), codec=codec, track_usage=track_usage)
+
+    raise ValueError(f"Unknown dump_mode '{mode}', expected 'files', 'log' or 'dedup'")
+
+class DumpWriter:
+    """
+    Writes dump records to disk from a background thread, so that execute() can return
+    responses without waiting on file I/O. The queue is bounded; when it is full, records
+    are either waited on or dropped depending on the configured policy. With the drop policy,
+    the last quarter of the queue is reserved for failed requests.
+
+    If quota_bytes is set, the oldest dumps are evicted to make room for new ones. A successful
+    request never causes a failure to be evicted; it is dropped instead.
+    """
+
+    def __init__(self, store, stats, queue_depth=64, policy=DumpQueuePolicy.BLOCK, quota_bytes=None):
+        self.store = store
+        self.stats = stats
+        self.policy = policy
+        self.quota_bytes = quota_bytes
+
+        self._queue = queue.Queue(maxsize=queue_depth)
+        self._success_slots = max(1, queue_depth - queue_depth // 4)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="replay-dump-writer", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_config(cls, model_config, dump_dir, instance_name, stats):
+        """Build a writer and its store from the dump_* model config parameters."""
+        queue_depth = int(get_config_parameter(model_config, "dump_queue_depth", "64"))
+        policy_string = get_config_parameter(model_config, "dump_queue_policy", "block").lower()
+        if (policy_string not in ("block", "drop")):
+            raise ValueError(f"Unknown dump_queue_policy '{policy_string}', expected 'block' or 'drop'")
+
+        quota_mb = get_config_parameter(model_config, "dump_quota_mb", None)
+        quota_bytes = int(float(quota_mb) * 1024 * 1024) if quota_mb is not None else None
+
+        policy = DumpQueuePolicy.DROP if (policy_string == "drop") else DumpQueuePolicy.BLOCK
+        store = make_dump_store(model_config, dump_dir, instance_name)
+        return cls(store, stats, queue_depth=queue_depth, policy=policy, quota_bytes=quota_bytes)
+
+    def submit(self, record):
+        """
+        Queue a dump record for writing. Arrays in record["inputs"] must not alias memory
+        owned by the request, since they are written after the response has been sent.
+        Returns False if the record was dropped.
+        """
+        if self._closed:
+            raise RuntimeError("Cannot submit dumps to a closed DumpWriter")
+
+        if (self.policy == DumpQueuePolicy.DROP):
+            if not is_failure(record) and (self._queue.qsize() >= self._success_slots):
+                self.stats.count("dropped_queue_full")
+                return False
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                self.stats.count("dropped_queue_full")
+                return False
+        else:
+            self._queue.put(record)
+
+        return True
+
+    def flush(self):
+        """Block until every queued record has been written."""
+        self._queue.join()
+
+    def close(self):
+        """Write all outstanding records and stop the writer thread."""
+        if self._closed:
+            return
+
+        self._closed = True
+        self._queue.put(None) # sentinel, always waits so that nothing queued is lost
+        self._thread.join()
+        self.store.close()
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            try:
+                if record is None:
+                    return
+                self._write(record)
+            except Exception as ex:
+                self.stats.count("write_errors")
+                print(f"Failed to write dump for request '{record.get('id')}': {ex}", file=sys.stderr, flush=True)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, record):
+        if self.quota_bytes is not None:
+            failed = is_failure(record)
+            needed = estimate_record_nbytes(record)
+            while (self.store.usage() + needed > self.quota_bytes) and self.store.evict_oldest(include_failures=failed):
+                self.stats.count("evicted")
+
+            if (self.store.usage() + needed > self.quota_bytes):
+                self.stats.count("dropped_quota")
+                return
+
+        self.store.write(record)
+        self.stats.count("dumped")
@@ -0,0 +1,90 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model_prep"))
+from batching import BufferPool, RequestRunner, fuse_inputs, split_outputs
+
+INPUT_NAMES = ["points", "mask"]
+VARIABLE_AXES = {"points": [2], "mask": [2]}
+
+def make_request(rows, particles, rng):
+    return {
+        "points": rng.standard_normal((rows, 2, particles)).astype(np.float32),
+        "mask": np.ones((rows, 1, particles), dtype=np.float32),
+    }
+
+def masked_forward(inputs, reuse_buffers=False):
+    """Per-row sum of the masked points, plus the padded length the forward pass saw."""
+    points, mask = inputs["points"], inputs["mask"]
+    sums = (points * mask).sum(axis=(1, 2))
+    lengths = np.full(points.shape[0], points.shape[2], dtype=np.int64)
+    return [sums, lengths]
+
+def test_fuse_pads_and_splits_requests_with_different_particle_counts():
+    rng = np.random.default_rng(0)
+    requests = [make_request(2, 5, rng), make_request(1, 12, rng), make_request(3, 8, rng)]
+
+    fused, row_counts = fuse_inputs(requests, INPUT_NAMES, VARIABLE_AXES, BufferPool())
+    assert row_counts == [2, 1, 3]
+    assert fused["points"].shape == (6, 2, 12)
+    assert fused["mask"].shape == (6, 1, 12)
+
+    # Each request sits in its rows, zero-padded past its own particle count
+    offset = 0
+    for request in requests:
+        rows, particles = request["points"].shape[0], request["points"].shape[2]
+        for name in INPUT_NAMES:
+            np.testing.assert_array_equal(fused[name][offset:offset + rows, :, :particles], request[name])
+            assert not fused[name][offset:offset + rows, :, particles:].any()
+        offset += rows
+
+    outputs = split_outputs(masked_forward(fused), row_counts)
+    for request, (sums, lengths) in zip(requests, outputs):
+        assert sums.shape == (request["points"].shape[0],)
+        np.testing.assert_allclose(sums, masked_forward(request)[0], rtol=1e-5)
+        assert (lengths == 12).all()
+
+def test_fuse_pads_to_buckets():
+    rng = np.random.default_rng(1)
+    requests = [make_request(1, 5, rng), make_request(2, 9, rng)]
+    fused, _ = fuse_inputs(requests, INPUT_NAMES, VARIABLE_AXES, buckets={"points": [8, 16], "mask": [8, 16]})
+    assert fused["points"].shape == (3, 2, 16)
+    assert fused["mask"].shape == (3, 1, 16)
+
+def test_runner_fuses_into_one_forward_pass():
+    rng = np.random.default_rng(2)
+    requests = [make_request(2, 5, rng), make_request(4, 7, rng)]
+    calls = []
+
+    def forward(inputs, reuse_buffers=False):
+        calls.append(inputs["points"].shape)
+        return masked_forward(inputs)
+
+    runner = RequestRunner(forward, INPUT_NAMES, VARIABLE_AXES, pool=BufferPool())
+    outputs, err_msgs = runner.run(requests)
+    assert calls == [(6, 2, 7)]
+    assert err_msgs == ["none", "none"]
+    assert [out[0].shape for out in outputs] == [(2,), (4,)]
+    assert runner.fallbacks == 0
+
+def test_runner_falls_back_to_one_request_at_a_time(capsys):
+    rng = np.random.default_rng(3)
+    requests = [make_request(2, 5, rng), make_request(1, 30, rng), make_request(3, 6, rng)]
+
+    def forward(inputs, reuse_buffers=False):
+        if (inputs["points"].shape[2] > 20):
+            raise RuntimeError("too many particles")
+        return masked_forward(inputs)
+
+    runner = RequestRunner(forward, INPUT_NAMES, VARIABLE_AXES, pool=BufferPool(), model_name="test_model")
+    outputs, err_msgs = runner.run(requests)
+
+    # Only the request that fails alone gets the error, the others still get their results
+    assert err_msgs[0] == "none" and err_msgs[2] == "none"
+    assert "too many particles" in err_msgs[1]
+    np.testing.assert_allclose(outputs[0][0], masked_forward(requests[0])[0], rtol=1e-5)
+    assert outputs[2][1].tolist() == [6, 6, 6]
+
+    assert runner.fallbacks == 1
+    assert "Fused forward pass of 3 requests of test_model failed" in capsys.readouterr().err
@@ -0,0 +1,55 @@
+import os
+import sys
+import sqlite3
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "client"))
+from dump_catalog import DumpCatalog
+from replay_dump import LogDumpStore
+
+def make_record(i):
+    return {"id": f"req-{i}", "model": "m", "message": "none", "timestamp": float(i), "inputs": {"x": np.full((2, 3), i, dtype=np.float32)}}
+
+def test_log_index_with_a_partially_written_entry(tmp_path):
+    store = LogDumpStore(str(tmp_path), "instance_0")
+    for i in range(3):
+        store.write(make_record(i))
+    store.close()
+
+    # The server is halfway through writing the last index entry
+    idx_path = store.index_path(0)
+    with open(idx_path, "rb") as f:
+        data = f.read()
+    cut = len(data) - 5
+    with open(idx_path, "wb") as f:
+        f.write(data[:cut])
+
+    catalog = DumpCatalog(str(tmp_path))
+    assert catalog.refresh() == 2
+
+    with open(idx_path, "ab") as f:
+        f.write(data[cut:])
+    assert catalog.refresh() == 1
+    assert catalog.refresh() == 0
+
+    rows, total = catalog.query([])
+    assert total == 3
+    assert [row["id"] for row in rows] == ["req-0", "req-1", "req-2"]
+    catalog.close()
+
+def test_catalog_without_consumed_offsets(tmp_path):
+    # A catalog written before read offsets were stored is upgraded and its log indexes reread
+    store = LogDumpStore(str(tmp_path), "instance_0")
+    store.write(make_record(0))
+    store.close()
+
+    db_path = str(tmp_path / ".dump_catalog.sqlite")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE sources (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER)")
+    conn.commit()
+    conn.close()
+
+    catalog = DumpCatalog(str(tmp_path), db_path)
+    assert catalog.refresh() == 1
+    assert catalog.lookup("req-0") == (store.segment_path(0), 0)
+    catalog.close()
@@ -0,0 +1,259 @@
+import os
+import sys
+import pickle
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model_prep"))
+from dump_format import (
+    ALIGNMENT, BLOB_DIR, DumpCodec, DumpLogIndex, load_dump, load_dump_info, read_header, write_blobs, write_dump_file
+)
+
+DTYPES = ["float32", "float64", "float16", "int64", "int32", "int8", "uint8", "bool"]
+CODECS = ["none", "zstd", "lz4", "zstd:9", "lz4:3"]
+
+def make_tensor(dtype, shape, rng):
+    if (dtype == "bool"):
+        return rng.random(shape) > 0.5
+    if np.dtype(dtype).kind == "f":
+        # Repeated values, so that compression has something to work with
+        return rng.integers(0, 16, size=shape).astype(dtype) / 4
+    return rng.integers(0, 100, size=shape).astype(dtype)
+
+def make_codec(spec, shuffle=False):
+    name = spec.partition(":")[0]
+    if (name == "zstd"):
+        pytest.importorskip("zstandard")
+    elif (name == "lz4"):
+        pytest.importorskip("lz4.frame")
+    return DumpCodec.from_string(spec, shuffle=shuffle)
+
+def make_record(rng, dtype="float32"):
+    return {
+        "id": "req-1",
+        "model": "m",
+        "message": "none",
+        "batch_index": 3,
+        "inputs": {
+            "pf_points": make_tensor(dtype, (5, 2, 30), rng),
+            "pf_mask": make_tensor(dtype, (5, 1, 30), rng),
+            "odd": make_tensor(dtype, (7, 3), rng),  # sizes that are not a multiple of the alignment
+            "empty": make_tensor(dtype, (0, 4), rng)
+        },
+        "outputs": {"softmax": make_tensor(dtype, (5, 4), rng)}
+    }
+
+def find_memmap(arr):
+    while arr is not None:
+        if isinstance(arr, np.memmap):
+            return arr
+        arr = getattr(arr, "base", None)
+    return None
+
+def assert_records_equal(loaded, record):
+    for key, value in record.items():
+        if isinstance(value, dict):
+            assert set(loaded[key]) == set(value)
+            for name, arr in value.items():
+                assert loaded[key][name].dtype == arr.dtype
+                assert loaded[key][name].shape == arr.shape
+                np.testing.assert_array_equal(loaded[key][name], arr)
+        else:
+            assert loaded[key] == value
+
+@pytest.mark.parametrize("dtype", DTYPES)
+@pytest.mark.parametrize("codec", CODECS)
+def test_round_trip(tmp_path, dtype, codec):
+    record = make_record(np.random.default_rng(0), dtype)
+    path = str(tmp_path / "req-1.dump")
+    length = write_dump_file(path, record, make_codec(codec))
+
+    assert os.path.getsize(path) == length
+    assert os.listdir(tmp_path) == ["req-1.dump"]  # no temporary file left behind
+    assert_records_equal(load_dump(path), record)
+
+@pytest.mark.parametrize("codec", ["zstd", "lz4"])
+def test_shuffle_round_trip(tmp_path, codec):
+    record = make_record(np.random.default_rng(0))
+    path = str(tmp_path / "req-1.dump")
+    write_dump_file(path, record, make_codec(codec, shuffle=True))
+
+    header = read_header(path)
+    assert all(t["shuffle"] for t in header["tensors"] if t["nbytes"] > 0)
+    assert_records_equal(load_dump(path), record)
+
+def test_shuffle_is_skipped_for_integer_tensors(tmp_path):
+    record = {"id": "req-1", "inputs": {"ids": np.arange(100, dtype=np.int64)}}
+    path = str(tmp_path / "req-1.dump")
+    write_dump_file(path, record, make_codec("zstd", shuffle=True))
+
+    assert not read_header(path)["tensors"][0]["shuffle"]
+    np.testing.assert_array_equal(load_dump(path)["inputs"]["ids"], record["inputs"]["ids"])
+
+def test_tensors_are_aligned(tmp_path):
+    path = str(tmp_path / "req-1.dump")
+    write_dump_file(path, make_record(np.random.default_rng(0)))
+
+    header = read_header(path)
+    assert header["data_start"] % ALIGNMENT == 0
+    assert all(t["offset"] % ALIGNMENT == 0 for t in header["tensors"])
+
+def test_uncompressed_tensors_are_read_only_memory_maps(tmp_path):
+    path = str(tmp_path / "req-1.dump")
+    write_dump_file(path, make_record(np.random.default_rng(0)))
+
+    loaded = load_dump(path)
+    for arr in loaded["inputs"].values():
+        if arr.size > 0:
+            assert find_memmap(arr) is not None
+            assert not arr.flags.writeable
+
+def test_compressed_tensors_are_new_arrays(tmp_path):
+    path = str(tmp_path / "req-1.dump")
+    write_dump_file(path, make_record(np.random.default_rng(0)), make_codec("zstd"))
+
+    loaded = load_dump(path)
+    assert all(find_memmap(arr) is None for arr in loaded["inputs"].values())
+
+def test_records_at_an_offset(tmp_path):
+    # Log segments hold several records back to back; each is read at its own offset
+    rng = np.random.default_rng(0)
+    records = [make_record(rng), make_record(rng)]
+    paths = [str(tmp_path / f"{i}.dump") for i in range(2)]
+    lengths = [write_dump_file(path, record) for path, record in zip(paths, records)]
+
+    segment = str(tmp_path / "segment.seg")
+    with open(segment, "wb") as out:
+        for path in paths:
+            with open(path, "rb") as f:
+                out.write(f.read())
+
+    assert_records_equal(load_dump(segment), records[0])
+    assert_records_equal(load_dump(segment, offset=lengths[0]), records[1])
+
+def test_load_dump_info_reads_only_the_header(tmp_path):
+    record = make_record(np.random.default_rng(0))
+    path = str(tmp_path / "req-1.dump")
+    write_dump_file(path, record)
+
+    info = load_dump_info(path)
+    assert info["id"] == "req-1"
+    assert info["batch_index"] == 3
+    assert info["tensors"]["inputs"]["pf_points"] == ((5, 2, 30), np.dtype("float32"))
+    assert info["tensors"]["outputs"]["softmax"] == ((5, 4), np.dtype("float32"))
+
+def test_legacy_pickle(tmp_path):
+    record = {"id": "req-1", "model": "m", "message": "none", "inputs": {"pf_points": np.ones((2, 2, 3), dtype=np.float32)}}
+    path = str(tmp_path / "req-1.pkl")
+    with open(path, "wb") as f:
+        pickle.dump(record, f)
+
+    assert_records_equal(load_dump(path), record)
+    assert load_dump_info(path)["tensors"] == {"inputs": {"pf_points": ((2, 2, 3), np.dtype("float32"))}}
+
+@pytest.mark.parametrize("cut", [4, 16, 40])
+def test_truncated_header_raises(tmp_path, cut):
+    path = str(tmp_path / "req-1.dump")
+    write_dump_file(path, make_record(np.random.default_rng(0)))
+    with open(path, "r+b") as f:
+        f.truncate(cut)
+
+    with pytest.raises(ValueError):
+        load_dump(path)
+    with pytest.raises(ValueError):
+        load_dump_info(path)
+
+def test_truncated_data_raises(tmp_path):
+    path = str(tmp_path / "req-1.dump")
+    write_dump_file(path, make_record(np.random.default_rng(0)))
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 100)
+
+    with pytest.raises(ValueError):
+        load_dump(path)
+
+def test_bad_magic_raises(tmp_path):
+    path = str(tmp_path / "req-1.dump")
+    write_dump_file(path, make_record(np.random.default_rng(0)))
+    with open(path, "r+b") as f:
+        f.write(b"NOTADUMP")
+
+    with pytest.raises(ValueError, match="Not a replay dump"):
+        read_header(path)
+
+def test_object_tensors_are_refused(tmp_path):
+    path = str(tmp_path / "req-1.dump")
+    with pytest.raises(ValueError):
+        write_dump_file(path, {"id": "req-1", "inputs": {"names": np.array(["a", None], dtype=object)}})
+    assert os.listdir(tmp_path) == []
+
+@pytest.mark.parametrize("codec", ["none", "zstd", "lz4"])
+@pytest.mark.parametrize("shuffle", [False, True])
+def test_chunked_round_trip(tmp_path, codec, shuffle):
+    rng = np.random.default_rng(0)
+    dump_dir = str(tmp_path)
+    blob_dir = os.path.join(BLOB_DIR, "instance_0")
+    codec = make_codec(codec, shuffle=shuffle)
+
+    # 16 KB chunks: several full chunks, a partial last one, and a tensor smaller than a chunk
+    tensors = {"pf_points": make_tensor("float32", (50, 2, 100), rng), "sv_mask": make_tensor("float32", (50, 1, 7), rng)}
+    refs = {}
+    for name, arr in tensors.items():
+        refs[name], written = write_blobs(dump_dir, blob_dir, arr, 16 * 1024, codec)
+        assert written
+    assert len(refs["pf_points"].chunks) == 3
+    assert len(refs["sv_mask"].chunks) == 1
+
+    path = os.path.join(dump_dir, "req-1.dump")
+    write_dump_file(path, {"id": "req-1", "inputs": refs})
+    assert_records_equal(load_dump(path), {"id": "req-1", "inputs": tensors})
+    assert load_dump_info(path)["tensors"]["inputs"]["pf_points"] == ((50, 2, 100), np.dtype("float32"))
+
+    # The same tensor again writes no new blobs
+    _, written = write_blobs(dump_dir, blob_dir, tensors["pf_points"], 16 * 1024, codec)
+    assert written == {}
+
+def test_missing_blob_raises(tmp_path):
+    dump_dir = str(tmp_path)
+    blob_dir = os.path.join(BLOB_DIR, "instance_0")
+    ref, written = write_blobs(dump_dir, blob_dir, np.ones((100, 100), dtype=np.float32), 16 * 1024)
+    path = os.path.join(dump_dir, "req-1.dump")
+    write_dump_file(path, {"id": "req-1", "inputs": {"x": ref}})
+
+    for root, _, files in os.walk(os.path.join(dump_dir, blob_dir)):
+        for name in files:
+            os.remove(os.path.join(root, name))
+            break
+
+    with pytest.raises(ValueError, match="missing"):
+        load_dump(path)
+
+def write_index(path, entries):
+    # Replace the file, as a restarted server writing a new segment under the same name would
+    with open(f"{path}.tmp", "w") as f:
+        f.writelines(f"{req_id}\t{offset}\t100\tfalse\n" for req_id, offset in entries)
+    os.replace(f"{path}.tmp", path)
+
+def test_log_index_rereads_a_segment_name_reused_after_a_restart(tmp_path):
+    idx_path = str(tmp_path / "instance_0.000001.idx")
+    index = DumpLogIndex(str(tmp_path))
+    write_index(idx_path, [("a", 0), ("b", 100)])
+    index.refresh()
+    assert set(index.entries) == {"a", "b"}
+
+    # A shorter file under the same name
+    write_index(idx_path, [("c", 0)])
+    index.refresh()
+    assert set(index.entries) == {"c"}
+
+    # A longer file under the same name, read from the start rather than from the old position
+    write_index(idx_path, [("d", 0), ("e", 100), ("f", 200)])
+    index.refresh()
+    assert set(index.entries) == {"d", "e", "f"}
+    assert index.lookup("d")[1:] == (0, 100)
+
+    # Appends to the same file are still read incrementally
+    with open(idx_path, "a") as f:
+        f.write("g\t300\t100\tfalse\n")
+    index.refresh()
+    assert set(index.entries) == {"d", "e", "f", "g"}
@@ -0,0 +1,79 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model_prep"))
+from dump_format import load_dump
+from replay_dump import DedupDumpStore, DumpStats, DumpWriter, FileDumpStore, make_dump_store
+
+QUOTA_BYTES = 512 * 1024
+
+def directory_nbytes(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+def write_dumps(store, count, seed=0, instance_name="instance_0"):
+    rng = np.random.default_rng(seed)
+    shared = rng.random((64, 256), dtype=np.float32) # resent with every request, stored once
+    stats = DumpStats()
+    writer = DumpWriter(store, stats, quota_bytes=QUOTA_BYTES)
+    for i in range(count):
+        inputs = {"shared": shared, "unique": rng.random((64, 256), dtype=np.float32)}
+        writer.submit({"id": f"req-{seed}-{i}", "model": "m", "message": "none", "batch_id": f"{instance_name}:{i + 1}", "inputs": inputs})
+    writer.close()
+    return stats
+
+def test_dedup_store_stays_within_quota(tmp_path):
+    store = DedupDumpStore(str(tmp_path), "instance_0", chunk_nbytes=16 * 1024, track_usage=True)
+    stats = write_dumps(store, 40)
+
+    assert stats.snapshot()["evicted"] > 0
+    assert directory_nbytes(tmp_path) <= QUOTA_BYTES
+    assert store.usage() == directory_nbytes(tmp_path)
+
+    # The newest dump is intact, its shared blobs survived the eviction of older dumps
+    dump = load_dump(str(tmp_path / "req-0-39.dump"))
+    assert dump["inputs"]["shared"].shape == (64, 256)
+
+def test_dedup_store_usage_after_restart(tmp_path):
+    write_dumps(DedupDumpStore(str(tmp_path), "instance_0", chunk_nbytes=16 * 1024, track_usage=True), 10)
+    # Leave an orphaned blob behind, as a crash between writing blobs and the manifest would
+    orphan = tmp_path / "blobs" / "instance_0" / "00" / "00orphan.blob"
+    orphan.parent.mkdir(parents=True, exist_ok=True)
+    orphan.write_bytes(bytes(1000))
+
+    store = DedupDumpStore(str(tmp_path), "instance_0", chunk_nbytes=16 * 1024, track_usage=True)
+    assert not orphan.exists()
+    assert store.usage() == directory_nbytes(tmp_path)
+
+    write_dumps(store, 40, seed=1)
+    assert directory_nbytes(tmp_path) <= QUOTA_BYTES
+    assert store.usage() == directory_nbytes(tmp_path)
+
+def test_log_store_with_default_segment_size_stays_within_quota(tmp_path):
+    # The default 256 MB segment is far larger than the quota, so segments must be capped to evict anything
+    config = {"parameters": {"dump_mode": {"string_value": "log"}, "dump_quota_mb": {"string_value": str(QUOTA_BYTES / 1024 / 1024)}}}
+    store = make_dump_store(config, str(tmp_path), "instance_0")
+    stats = write_dumps(store, 40)
+
+    counts = stats.snapshot()
+    assert counts["dropped_quota"] == 0
+    assert counts["dumped"] == 40
+    assert directory_nbytes(tmp_path) <= QUOTA_BYTES
+
+def test_instances_sharing_a_directory_have_separate_quotas(tmp_path):
+    first = FileDumpStore(str(tmp_path), track_usage=True, instance_name="instance_0")
+    write_dumps(first, 40, seed=0, instance_name="instance_0")
+    first_usage = first.usage()
+    first_dumps = set(os.listdir(tmp_path))
+
+    # The second instance neither counts nor evicts the dumps of the first
+    second = FileDumpStore(str(tmp_path), track_usage=True, instance_name="instance_1")
+    assert second.usage() == 0
+    stats = write_dumps(second, 40, seed=1, instance_name="instance_1")
+    assert stats.snapshot()["evicted"] > 0
+    assert first_dumps <= set(os.listdir(tmp_path))
+    assert directory_nbytes(tmp_path) == first_usage + second.usage()
+    assert second.usage() <= QUOTA_BYTES
+
+    # After a restart, each instance again counts only its own dumps
+    assert FileDumpStore(str(tmp_path), track_usage=True, instance_name="instance_0").usage() == first_usage
@@ -0,0 +1,42 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model_prep"))
+from result_cache import ResultCache
+
+INPUT_NAMES = ["x"]
+
+def make_run(calls):
+    def run(all_inputs):
+        calls.append([inputs["x"].shape[0] for inputs in all_inputs])
+        outputs = [[inputs["x"].sum(axis=1), inputs["x"] * 2] for inputs in all_inputs]
+        errors = ["none" if (inputs["x"] >= 0).all() else "negative input" for inputs in all_inputs]
+        return outputs, errors
+    return run
+
+def test_cached_rows_are_not_run_again():
+    rng = np.random.default_rng(0)
+    cache = ResultCache(1 << 20, "model:1")
+    first = {"x": rng.random((4, 3))}
+    calls = []
+    cache.run([first], INPUT_NAMES, make_run(calls))
+
+    # Two rows seen before, one new row
+    second = {"x": np.concatenate([first["x"][[2, 0]], rng.random((1, 3))])}
+    outputs, errors = cache.run([second], INPUT_NAMES, make_run(calls))
+
+    assert calls == [[4], [1]]
+    assert errors == ["none"]
+    np.testing.assert_allclose(outputs[0][0], second["x"].sum(axis=1))
+    np.testing.assert_allclose(outputs[0][1], second["x"] * 2)
+    assert cache.counts["hit"] == 2
+
+def test_failed_requests_are_not_cached():
+    cache = ResultCache(1 << 20, "model:1")
+    calls = []
+    bad = {"x": -np.ones((2, 3))}
+    for _ in range(2):
+        outputs, errors = cache.run([bad], INPUT_NAMES, make_run(calls))
+        assert errors == ["negative input"]
+    assert calls == [[2], [2]]